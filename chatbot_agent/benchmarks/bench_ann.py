@@ -0,0 +1,112 @@
+"""
+Recall and latency benchmark of the IVF index against exact search.
+Builds a DenseVectorIndex of synthetic clustered embeddings (like chunks of many reports of the same
+kinds) in a temporary directory, then measures recall@k and query latency for several `n_probe` values.
+Also checks that incremental inserts and deletes keep the recall.
+
+Example:
+    python bench_ann.py --rows 50000 --dim 1536 --k 5 --probes 1 2 4 8 16
+"""
+
+import os, sys, time
+import argparse, tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from vector_index import DenseVectorIndex, top_k_rows
+from ann_index import IVFIndex
+
+
+def clustered_vectors(topics: np.ndarray, rows: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Synthetic embeddings: a random topic direction per row plus gaussian noise.
+
+    Args:
+        topics (np.ndarray): The unit topic directions, one per row.
+        rows (int): Number of vectors.
+        noise (float): Noise scale relative to the topic direction.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        np.ndarray: The vectors, one per row.
+    """
+    dim = topics.shape[1]
+    vectors = topics[rng.integers(len(topics), size=rows)]
+    vectors += noise * rng.standard_normal((rows, dim)).astype(np.float32) / np.sqrt(dim)
+    return vectors
+
+
+def evaluate(index: DenseVectorIndex, ivf: IVFIndex, queries: np.ndarray, k: int, probes: list) -> None:
+    exact_ids, exact_time = [], 0.0
+    for query in queries:
+        start = time.perf_counter()
+        scores = index.scores(query)
+        top = top_k_rows(scores, k)
+        exact_time += time.perf_counter() - start
+        exact_ids.append({index.ids[row] for row in top})
+    print(f"{'exact':<10}{'recall@' + str(k):>12}{1.0:>10.3f}{exact_time / len(queries) * 1000:>12.2f}{len(index):>14}")
+
+    for n_probe in probes:
+        found, ann_time, scanned = 0, 0.0, 0
+        for query, truth in zip(queries, exact_ids):
+            start = time.perf_counter()
+            hits = ivf.search(query, k, n_probe = n_probe)
+            ann_time += time.perf_counter() - start
+            found += len(truth & {doc_id for doc_id, _ in hits})
+            scanned += len(ivf.candidate_rows(query, n_probe))
+        recall = found / (k * len(queries))
+        print(f"{'ivf/' + str(n_probe):<10}{'':>12}{recall:>10.3f}{ann_time / len(queries) * 1000:>12.2f}{scanned // len(queries):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the IVF index against exact search")
+    parser.add_argument("--rows", type=int, default=20000, help="Number of indexed vectors")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding dimension")
+    parser.add_argument("--topics", type=int, default=200, help="Number of synthetic topics")
+    parser.add_argument("--noise", type=float, default=2.0, help="Noise around the topics")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of results per query")
+    parser.add_argument("--lists", type=int, default=None, help="Number of IVF clusters, about sqrt(rows) by default")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="n_probe values to evaluate")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Storage dtype of the matrix")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    vectors = clustered_vectors(topics, args.rows, args.noise, rng)
+    queries = clustered_vectors(topics, args.queries, args.noise, rng)
+    ids = [f"chunk-{row}" for row in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        index = DenseVectorIndex(os.path.join(workdir, "vector_index"), dtype = args.dtype, model_name = "synthetic")
+        index.add(ids, vectors)
+        ivf = IVFIndex(index, n_lists = args.lists)
+        start = time.perf_counter()
+        ivf.sync()
+        print(f"Trained {len(ivf.centroids)} clusters over {len(index)} rows in {time.perf_counter() - start:.2f}s\n")
+
+        print(f"{'search':<10}{'':>12}{'recall':>10}{'ms/query':>12}{'rows scanned':>14}")
+        evaluate(index, ivf, queries, args.k, args.probes)
+
+        # Incremental updates: drop 10% of the rows, insert as many new ones without retraining
+        n_update = args.rows // 10
+        index.remove(ids[:n_update])
+        index.add([f"new-{row}" for row in range(n_update)], clustered_vectors(topics, n_update, args.noise, rng))
+        start = time.perf_counter()
+        ivf.sync()
+        print(f"\nAfter {n_update} deletes and {n_update} inserts (synced in {time.perf_counter() - start:.2f}s)")
+        evaluate(index, ivf, queries, args.k, args.probes)
+
+        # Restart: the clusters are read back from disk
+        start = time.perf_counter()
+        reloaded = IVFIndex(DenseVectorIndex(index.path, dtype = args.dtype, model_name = "synthetic"), n_lists = args.lists)
+        reloaded.sync()
+        print(f"\nReloaded from disk in {time.perf_counter() - start:.2f}s, "
+              f"{'same' if reloaded.assignments == ivf.assignments else 'different'} assignments")
+
+
+if __name__ == "__main__":
+    main()
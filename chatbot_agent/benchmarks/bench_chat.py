@@ -0,0 +1,278 @@
+"""
+Offline benchmark of the chat worker.
+Starts the stub OpenAI server, writes a synthetic data.txt of configurable size to a temporary directory,
+then drives ChatWithDocs sessions through scripted multi-turn conversations, like test.py sessions.
+Reports the cold indexing time, p50 / p95 / p99 latency per stage, throughput and memory.
+
+Example:
+    python bench_chat.py --records 200 --conversations 20 --turns 6 --concurrency 4 --stream
+"""
+
+import os, sys, io, json, time, random
+import argparse, tempfile, tracemalloc, contextlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from stub_openai_server import StubConfig, StubOpenAIServer
+from instrumentation import LatencyRecorder
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+MEDICINES = ["Ibuprofen", "Paracetamol", "Amoxicillin", "Metformin", "Atorvastatin", "Lisinopril", "Omeprazole", "Cetirizine"]
+TESTS = ["Hemoglobin", "Glucose", "Cholesterol", "Creatinine", "Sodium", "Potassium", "TSH", "Vitamin D"]
+
+# Scripted conversations: new topics followed by follow-ups, {medicine} and {test} are filled in per conversation
+CONVERSATION = [
+    "What are the abnormalities in my report?",
+    "Why is that a concern?",
+    "What is my {test} value?",
+    "What are the side effects of {medicine}?",
+    "Can I take it with food?",
+    "What is the price of {medicine}?",
+    "Where can I buy it?",
+    "Summarize my report in simple words",
+]
+
+
+def synthetic_record(index: int, rng: random.Random, record_tokens: int) -> str:
+    """
+    Build one record shaped like the records the other agents append to data.txt.
+
+    Args:
+        index (int): The record number.
+        rng (random.Random): Random generator.
+        record_tokens (int): Approximate size of the record in tokens.
+
+    Returns:
+        str: The record text.
+    """
+    kind = index % 4
+    lines = []
+    if kind == 0:
+        lines.append(f"The Original Report of the patient is : Report {index}")
+        while len(" ".join(lines)) < record_tokens * 4:
+            test = rng.choice(TESTS)
+            lines.append(f"{test} {rng.uniform(1, 200):.1f} units, reference range {rng.randint(1, 50)}-{rng.randint(60, 250)}")
+    elif kind == 1:
+        lines.append("Whats in my report ? Is everything okay in the report ? The Summarized Report of the patient is:")
+        lines.append("1. Findings:")
+        while len(" ".join(lines)) < record_tokens * 4:
+            test = rng.choice(TESTS)
+            lines.append(f"- {test} was {rng.uniform(1, 200):.1f}, which is {rng.choice(['higher', 'lower'])} than the normal range.")
+    elif kind == 2:
+        medicine = rng.choice(MEDICINES)
+        lines.append(f"All information about {medicine} medicine")
+        while len(" ".join(lines)) < record_tokens * 4:
+            field = rng.choice(["uses", "side_effects", "dosage", "warnings", "interactions"])
+            lines.append(json.dumps({"medication_name": medicine, field: f"{field} of {medicine} number {rng.randint(1, 999)}"}))
+    else:
+        lines.append("Prices of medicines and where to buy them")
+        while len(" ".join(lines)) < record_tokens * 4:
+            medicine = rng.choice(MEDICINES)
+            lines.append(f"| {medicine} | {rng.randint(10, 500)} mg | Rs. {rng.uniform(5, 900):.2f} | Pharmacy {rng.randint(1, 40)} |")
+    return "\n".join(lines)
+
+
+def write_data_file(path: str, records: int, record_tokens: int, seed: int = 0) -> int:
+    """
+    Write a synthetic data file.
+
+    Args:
+        path (str): Path of the data file.
+        records (int): Number of records.
+        record_tokens (int): Approximate size of a record in tokens.
+        seed (int): Random seed.
+
+    Returns:
+        int: Size of the file in bytes.
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for index in range(records):
+            f.write(">>>>\n" + synthetic_record(index, rng, record_tokens) + "\n\n")
+    return os.path.getsize(path)
+
+
+def conversation_queries(index: int, turns: int) -> List[str]:
+    rng = random.Random(index)
+    values = {"medicine": rng.choice(MEDICINES), "test": rng.choice(TESTS)}
+    return [CONVERSATION[(index + turn) % len(CONVERSATION)].format(**values) for turn in range(turns)]
+
+
+def run_conversation(manager: Any, index: int, turns: int, stream: bool) -> None:
+    session_id = f"session-{index}"
+    for query in conversation_queries(index, turns):
+        if stream:
+            session = manager.get(session_id)
+            for _ in session.intent_stream(query):
+                pass
+            manager.enforce_bound(session)
+        else:
+            manager.intent(session_id, query)
+
+
+async def run_async_conversations(manager: Any, conversations: int, turns: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def conversation(index: int) -> None:
+        async with semaphore:
+            for query in conversation_queries(index, turns):
+                await manager.aintent(f"session-{index}", query)
+
+    await asyncio.gather(*(conversation(index) for index in range(conversations)))
+
+
+def percentile_table(summary: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for name, values in summary.items():
+        lines.append(
+            f"{name:<22}{values['count']:>7}{values['p50'] * 1000:>10.1f}{values['p95'] * 1000:>10.1f}{values['p99'] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def max_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of ChatWithDocs against a stub OpenAI server")
+    parser.add_argument("--records", type=int, default=100, help="Number of records in the synthetic data.txt")
+    parser.add_argument("--record-tokens", type=int, default=400, help="Approximate size of a record in tokens")
+    parser.add_argument("--conversations", type=int, default=10, help="Number of scripted conversations")
+    parser.add_argument("--turns", type=int, default=6, help="Turns per conversation")
+    parser.add_argument("--concurrency", type=int, default=1, help="Conversations run at the same time")
+    parser.add_argument("--stream", action="store_true", help="Use streaming responses, like test.py --stream")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the async turn pipeline")
+    parser.add_argument("--retrieval-mode", default="hybrid", choices=["dense", "hybrid", "lexical"], help="Retrieval mode")
+    parser.add_argument("--top-k", type=int, default=2, help="Number of chunks to retrieve")
+    parser.add_argument("--embedding-backend", default="openai", choices=["openai", "local"], help="Embed through the stub or offline")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub seconds before the first completion token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="Stub completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=60, help="Stub tokens per completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Stub seconds per embeddings request")
+    parser.add_argument("--embedding-dim", type=int, default=256, help="Stub embedding dimension")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Stub answers every n-th embeddings request with a 429")
+    parser.add_argument("--warmup-turns", type=int, default=2, help="Untimed turns run first (client and schema setup)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace Python allocations (slower)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the chat worker")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(config = StubConfig(
+        latency = args.latency,
+        token_rate = args.token_rate,
+        completion_tokens = args.completion_tokens,
+        embedding_latency = args.embedding_latency,
+        embedding_dim = args.embedding_dim,
+        rate_limit_every = args.rate_limit_every
+    ))
+    server.start()
+    # Read by the OpenAI clients (and by older langchain versions)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_BASE"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+    # Imported once the environment points at the stub
+    from chat_worker import ChatWithDocs
+    from session_manager import SessionManager
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        data_path = os.path.join(workdir, "data.txt")
+        data_bytes = write_data_file(data_path, args.records, args.record_tokens)
+        print(f"Synthetic data.txt: {args.records} records, {data_bytes / 1024:.0f} KB")
+
+        recorder = LatencyRecorder()
+        with output:
+            chatbot = ChatWithDocs(
+                top_k = args.top_k,
+                embed_cache_path = os.path.join(workdir, "embeddings_cache.jsonl"),
+                index_path = os.path.join(workdir, "vector_index"),
+                retrieval_mode = args.retrieval_mode,
+                embedding_backend = args.embedding_backend,
+                data_path = data_path,
+                turn_hooks = [recorder]
+            )
+            start = time.perf_counter()
+            chatbot.refresh_index()
+            index_time = time.perf_counter() - start
+        chunks = len(chatbot.documents)
+        print(f"Cold indexing: {chunks} chunks in {index_time:.2f}s ({chunks / index_time:.1f} chunks/s)")
+
+        manager = SessionManager(chatbot, max_sessions = max(args.conversations, 1))
+        # The first turns pay for connection setup and the structured output schema, keep them out of the results
+        with output:
+            warmup = chatbot.fork()
+            warmup.followup_classifier = None # Make sure the LLM classifier runs too
+            for query in conversation_queries(0, args.warmup_turns):
+                warmup.intent(query)
+        recorder.reports.clear()
+
+        start = time.perf_counter()
+        with output:
+            if args.use_async:
+                asyncio.run(run_async_conversations(manager, args.conversations, args.turns, args.concurrency))
+            else:
+                with ThreadPoolExecutor(max_workers = args.concurrency) as executor:
+                    list(executor.map(
+                        lambda index: run_conversation(manager, index, args.turns, args.stream),
+                        range(args.conversations)
+                    ))
+        elapsed = time.perf_counter() - start
+
+    server.stop()
+
+    reports = recorder.reports
+    summary = recorder.summary()
+    results = {
+        "config": vars(args),
+        "index": {"chunks": chunks, "seconds": index_time},
+        "turns": len(reports),
+        "seconds": elapsed,
+        "turns_per_second": len(reports) / elapsed if elapsed else 0.0,
+        "followup_turns": sum(report.get("turn") == "followup" for report in reports),
+        "answer_cache_hits": sum(bool(report.get("answer_cache_hit")) for report in reports),
+        "prompt_tokens": sum(report["prompt_tokens"] for report in reports),
+        "completion_tokens": sum(report["completion_tokens"] for report in reports),
+        "stub_requests": dict(server.requests),
+        "stages": summary,
+        "max_rss_mb": max_rss_mb(),
+        "sessions": manager.memory_usage(),
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        results["tracemalloc_peak_mb"] = peak / (1024 * 1024)
+        tracemalloc.stop()
+
+    print(f"\n{results['turns']} turns in {elapsed:.2f}s: {results['turns_per_second']:.2f} turns/s "
+          f"({results['followup_turns']} follow-ups, {results['answer_cache_hits']} answer cache hits)")
+    print(f"Tokens: {results['prompt_tokens']} prompt, {results['completion_tokens']} completion")
+    print(f"Stub requests: {results['stub_requests']}")
+    print(f"\n{percentile_table(summary)}\n")
+    memory = f"Memory: max RSS {results['max_rss_mb']:.0f} MB, session state {results['sessions']['total_bytes'] / 1024:.1f} KB"
+    if "tracemalloc_peak_mb" in results:
+        memory += f", traced peak {results['tracemalloc_peak_mb']:.1f} MB"
+    print(memory)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
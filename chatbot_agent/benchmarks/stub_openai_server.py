@@ -0,0 +1,317 @@
+"""
+Stub OpenAI-compatible server for offline benchmarks of the chat worker.
+Implements the endpoints ChatWithDocs uses: chat completions (plain, streamed as server-sent events
+and structured output with a json_schema response format) and embeddings (float and base64 encoded).
+Responses are synthetic but deterministic, with a configurable latency and token rate so that
+benchmarks measure the worker itself and not the network.
+
+Run it standalone with `python stub_openai_server.py --port 8080`, then point the OpenAI client at it
+with OPENAI_BASE_URL=http://127.0.0.1:8080/v1.
+"""
+
+import json, time, base64, hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+WORDS = (
+    "the report shows blood pressure values above the normal range and the doctor recommends "
+    "treatment with regular monitoring of the readings medicine dose side effects price"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+def stable_seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+
+
+def schema_value(schema: Dict[str, Any], seed: int, definitions: Dict[str, Any]) -> Any:
+    """
+    Build a deterministic value that validates against a (simple) JSON schema.
+
+    Args:
+        schema (Dict[str, Any]): The JSON schema.
+        seed (int): Seed of the generated values.
+        definitions (Dict[str, Any]): The `$defs` of the root schema, for references.
+
+    Returns:
+        Any: The generated value.
+    """
+    if "$ref" in schema:
+        schema = definitions[schema["$ref"].split("/")[-1]]
+    if "anyOf" in schema:
+        schema = schema["anyOf"][0]
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {
+            name: schema_value(prop, stable_seed(f"{seed}:{name}"), definitions)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [schema_value(schema.get("items", {}), seed, definitions)]
+    if kind == "boolean":
+        return bool(seed % 2)
+    if kind == "integer":
+        return seed % 100
+    if kind == "number":
+        return (seed % 1000) / 10
+    if "enum" in schema:
+        return schema["enum"][seed % len(schema["enum"])]
+    return WORDS[seed % len(WORDS)]
+
+
+class StubConfig:
+    """Latency model and behaviour of the stub server."""
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        token_rate: float = 100.0,
+        completion_tokens: int = 60,
+        embedding_latency: float = 0.05,
+        embedding_dim: int = 256,
+        rate_limit_every: int = 0
+    ) -> None:
+        """
+        Initialize the configuration.
+
+        Args:
+            latency (float): Seconds before the first completion token.
+            token_rate (float): Completion tokens generated per second, 0 for no delay.
+            completion_tokens (int): Number of tokens of every completion.
+            embedding_latency (float): Seconds per embeddings request.
+            embedding_dim (int): Dimension of the embedding vectors.
+            rate_limit_every (int): Answer every n-th embeddings request with a 429, 0 to never do so.
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.embedding_latency = embedding_latency
+        self.embedding_dim = embedding_dim
+        self.rate_limit_every = rate_limit_every
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler, the configuration and counters live on the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count(self.path)
+        if self.path.endswith("/chat/completions"):
+            self.chat_completions(request)
+        elif self.path.endswith("/embeddings"):
+            self.embeddings(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _completion_text(self, request: Dict[str, Any], prompt: str) -> str:
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            return json.dumps(schema_value(schema, stable_seed(prompt), schema.get("$defs", {})))
+        seed = stable_seed(prompt)
+        return " ".join(WORDS[(seed + i) % len(WORDS)] for i in range(self.server.config.completion_tokens))
+
+    def chat_completions(self, request: Dict[str, Any]) -> None:
+        config = self.server.config
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        text = self._completion_text(request, prompt)
+        tokens = text.split(" ")
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": len(tokens),
+            "total_tokens": estimate_tokens(prompt) + len(tokens),
+        }
+        completion_id = f"chatcmpl-stub{stable_seed(prompt)}"
+        created = int(time.time())
+        model = request.get("model", "stub")
+        token_delay = 1 / config.token_rate if config.token_rate else 0.0
+
+        time.sleep(config.latency)
+        if not request.get("stream"):
+            time.sleep(token_delay * len(tokens))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text, "refusal": None},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+            return
+
+        # Server-sent events, one chunk per token
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(choices: List[Dict[str, Any]], chunk_usage: Optional[Dict[str, int]] = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+            }
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for index, token in enumerate(tokens):
+            content = token if index == 0 else f" {token}"
+            send_chunk([{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": None}])
+            time.sleep(token_delay)
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_chunk([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def embeddings(self, request: Dict[str, Any]) -> None:
+        config = self.server.config
+        if config.rate_limit_every and self.server.requests["embeddings"] % config.rate_limit_every == 0:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers = {"retry-after-ms": "100"}
+            )
+            return
+
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(config.embedding_latency)
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = np.random.default_rng(stable_seed(str(text))).standard_normal(config.embedding_dim).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+
+        tokens = sum(estimate_tokens(str(text)) for text in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """Threaded stub server, one thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: Optional[StubConfig] = None) -> None:
+        """
+        Initialize the server, port 0 picks a free port.
+
+        Args:
+            host (str): The interface to listen on.
+            port (int): The port to listen on.
+            config (StubConfig): The latency model.
+        """
+        super().__init__((host, port), StubHandler)
+        self.config = config or StubConfig()
+        self.requests = {"chat": 0, "embeddings": 0}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            if path.endswith("/chat/completions"):
+                self.requests["chat"] += 1
+            elif path.endswith("/embeddings"):
+                self.requests["embeddings"] += 1
+
+    def start(self) -> None:
+        """
+        Serve in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="StubOpenAIServer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first completion token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="Completion tokens per second, 0 for no delay")
+    parser.add_argument("--completion-tokens", type=int, default=60, help="Tokens per completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--embedding-dim", type=int, default=256, help="Dimension of the embeddings")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every n-th embeddings request with a 429")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        completion_tokens=args.completion_tokens,
+        embedding_latency=args.embedding_latency,
+        embedding_dim=args.embedding_dim,
+        rate_limit_every=args.rate_limit_every
+    )
+    server = StubOpenAIServer(args.host, args.port, config)
+    print(f"Stub OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
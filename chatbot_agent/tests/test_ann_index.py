@@ -0,0 +1,76 @@
+import os, sys, json
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from ann_index import IVFIndex
+from vector_index import DenseVectorIndex
+
+DIM = 8
+
+
+def vectors(start, count):
+    rng = np.random.default_rng(start)
+    return rng.standard_normal((count, DIM)).tolist()
+
+
+def ids(start, count):
+    return [f"doc-{i}" for i in range(start, start + count)]
+
+
+def build(tmp_path, count = 64):
+    index = DenseVectorIndex(str(tmp_path / "index"), model_name = "m")
+    index.add(ids(0, count), vectors(0, count))
+    ivf = IVFIndex(index, n_lists = 4)
+    ivf.sync()
+    return index, ivf
+
+
+def test_inserts_append_to_the_log_without_rewriting_the_snapshot(tmp_path):
+    index, ivf = build(tmp_path)
+    snapshot = os.stat(ivf.lists_path)
+
+    index.add(ids(64, 2), vectors(64, 2))
+    ivf.sync()
+    index.remove(["doc-0"])
+    ivf.sync()
+
+    assert os.stat(ivf.lists_path).st_mtime_ns == snapshot.st_mtime_ns
+    with open(ivf.log_path) as f:
+        assert len(f.readlines()) == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    reopened = IVFIndex(index, n_lists = 4)
+    assert reopened.assignments == ivf.assignments
+    assert "doc-0" not in reopened.assignments and "doc-65" in reopened.assignments
+
+
+def test_log_is_folded_into_the_snapshot_once_it_outgrows_it(tmp_path):
+    index, ivf = build(tmp_path)
+
+    # Less than the retrain growth, so the centroids are kept
+    for start in range(64, 192, 16):
+        index.add(ids(start, 16), vectors(start, 16))
+        ivf.sync()
+
+    assert ivf.trained_rows == 64 and ivf._log_entries <= ivf._snapshot_entries
+    with open(ivf.lists_path) as f:
+        assert len(json.load(f)["assignments"]) > 64
+    assert IVFIndex(index, n_lists = 4).assignments == ivf.assignments
+
+
+def test_log_of_other_centroids_is_ignored(tmp_path):
+    index, ivf = build(tmp_path)
+    index.add(ids(64, 2), vectors(64, 2))
+    ivf.sync()
+
+    # Another process retrains the centroids, the stale one must not overwrite its snapshot
+    other = IVFIndex(index, n_lists = 4)
+    other.train()
+    index.remove(["doc-1"])
+    ivf.sync()
+
+    reopened = IVFIndex(index, n_lists = 4)
+    assert reopened.generation == other.generation
+    assert reopened.assignments == other.assignments
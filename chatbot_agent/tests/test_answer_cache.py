@@ -0,0 +1,81 @@
+import os, sys, shutil
+import asyncio
+
+import pytest
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers")
+sys.path.append(WORKERS)
+
+QUERY = "What is the price of paracetamol?"
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    from chat_worker import ChatWithDocs
+
+    shutil.copy(os.path.join(WORKERS, "data.txt"), tmp_path / "data.txt")
+    worker = ChatWithDocs(
+        embedding_backend="local",
+        retrieval_mode="dense",  # Answers are cached under the query embedding
+        data_path=str(tmp_path / "data.txt"),
+        embed_cache_path=str(tmp_path / "embeddings_cache.jsonl"),
+        index_path=str(tmp_path / "vector_index"),
+    )
+    answers = []
+
+    def chat(prompt_temp):
+        answers.append(f"answer {len(answers)}")
+        return answers[-1]
+
+    async def achat(prompt_temp):
+        return chat(prompt_temp)
+
+    worker.chat, worker.achat = chat, achat
+    return worker
+
+
+def no_prompt(query):
+    raise AssertionError("the prompt of a cached answer was built")
+
+
+def test_cache_hit_skips_the_prompt(worker):
+    assert worker.intent(QUERY) == "answer 0"
+
+    session = worker.fork()
+    session.build_rag_prompt = no_prompt
+    assert session.intent(QUERY) == "answer 0"
+    assert session.turn_stats["answer_cache_hit"]
+
+    session = worker.fork()
+    session.build_rag_prompt = no_prompt
+    assert "".join(session.intent_stream(QUERY)) == "answer 0"
+    assert session.turn_stats["answer_cache_hit"]
+
+
+def test_async_cache_hit_skips_the_prompt(worker):
+    assert asyncio.run(worker.aintent(QUERY)) == "answer 0"
+
+    session = worker.fork()
+    session.build_rag_prompt = no_prompt
+    assert asyncio.run(session.aintent(QUERY)) == "answer 0"
+    assert session.turn_stats["answer_cache_hit"]
+
+
+def test_sessions_of_other_patients_do_not_share_answers(worker):
+    first = worker.fork(patient_id="1234567")
+    second = worker.fork(patient_id="7654321")
+    assert first.intent(QUERY) == "answer 0"
+    assert second.intent(QUERY) == "answer 1"
+    assert not second.turn_stats["answer_cache_hit"]
+
+    # Nor sessions of the same patient with another conversation
+    third = worker.fork(patient_id="1234567")
+    third.set_state({"conversation_history": [
+        {"role": "user", "content": "I am allergic to ibuprofen"},
+        {"role": "assistant", "content": "Noted, I will keep that in mind."},
+    ]})
+    third.classify_query = lambda query: (False, True)
+    assert third.intent(QUERY) == "answer 2"
+
+    assert worker.fork(patient_id="1234567").intent(QUERY) == "answer 0"
@@ -0,0 +1,41 @@
+import os, sys, shutil
+import asyncio, threading, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers")
+
+
+def test_search_waiting_for_the_index_lock_does_not_block_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    from chat_worker import ChatWithDocs
+
+    shutil.copy(os.path.join(WORKERS, "data.txt"), tmp_path / "data.txt")
+    worker = ChatWithDocs(
+        embedding_backend="local",
+        data_path=str(tmp_path / "data.txt"),
+        embed_cache_path=str(tmp_path / "embeddings_cache.jsonl"),
+        index_path=str(tmp_path / "vector_index"),
+    )
+    worker.refresh_index()
+
+    async def main():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        # An index update holding the lock, e.g. from the watcher thread
+        worker.refresh_index = lambda: None
+        worker.index_lock.acquire()
+        threading.Timer(0.3, worker.index_lock.release).start()
+        tick_task = asyncio.create_task(ticker())
+        context = await worker.arun_retriever("What is the price of paracetamol?")
+        tick_task.cancel()
+        return context, ticks
+
+    context, ticks = asyncio.run(main())
+    assert "paracetamol" in context.lower()
+    assert len(ticks) >= 10 and max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
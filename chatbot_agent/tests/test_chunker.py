@@ -0,0 +1,82 @@
+import os, sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from chunker import StructuredChunker, detect_record_type, detect_patient_id
+
+
+class WordCounter:
+    """One token per word, so that the windows are easy to reason about."""
+
+    def count(self, text):
+        return len(text.split())
+
+
+HEADER = "Whats in my report ? The Original Report of the patient is :"
+
+
+def record(lines, lead="\n"):
+    return lead + HEADER + "\n" + "\n".join(lines) + "\n"
+
+
+def body_lines(chunk):
+    return chunk.page_content.split("\n")[1:]
+
+
+@pytest.fixture
+def chunker():
+    return StructuredChunker(WordCounter(), chunk_tokens=12, overlap_tokens=4)
+
+
+def test_chunks_are_line_aligned_and_point_back_to_the_record(chunker):
+    text = record([f"row {i} value {i * 10}" for i in range(12)])  # 4 tokens per line
+    chunks = chunker.chunk_record(text, record_offset=1000)
+    assert len(chunks) > 1
+    for index, chunk in enumerate(chunks):
+        assert chunk.page_content.startswith(HEADER + "\n")
+        assert chunk.metadata["offset"] == 1000 and chunk.metadata["chunk"] == index
+        assert text[chunk.metadata["start"]:chunk.metadata["end"]].strip() == "\n".join(body_lines(chunk))
+        assert text[chunk.metadata["end"]:].strip() == "" or text[chunk.metadata["end"] - 1] == "\n"  # At a line end
+        assert sum(WordCounter().count(line) for line in body_lines(chunk)) <= 12
+
+
+def test_windows_overlap_by_whole_lines(chunker):
+    chunks = chunker.chunk_record(record([f"row {i} value {i * 10}" for i in range(12)]))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert body_lines(chunk)[0] == body_lines(previous)[-1]  # One 4-token line fits in the overlap
+    covered = [line for chunk in chunks for line in body_lines(chunk)]
+    assert sorted(set(covered)) == sorted(f"row {i} value {i * 10}" for i in range(12))
+
+
+def test_headings_start_a_chunk_without_overlap(chunker):
+    lines = ["Blood Test:", "hemoglobin 13.5 g/dL", "platelets normal range", "Lipid Profile:", "LDL 130 mg/dL"]
+    chunks = chunker.chunk_record(record(lines))
+    assert [body_lines(chunk)[0] for chunk in chunks] == ["Blood Test:", "Lipid Profile:"]
+
+
+def test_oversized_lines_are_split(chunker):
+    line = " ".join(f"w{i}" for i in range(40))
+    text = record([line])
+    chunks = chunker.chunk_record(text)
+    assert len(chunks) >= 3
+    # The pieces cover the whole line
+    covered = set()
+    for chunk in chunks:
+        covered.update(range(chunk.metadata["start"], chunk.metadata["end"]))
+    start = text.index(line)
+    assert set(range(start, start + len(line))) <= covered
+
+
+def test_record_type_and_patient(chunker):
+    text = record(["Patient ID: 1234567", "Hemoglobin 9.1 g/dL"])
+    chunk, = chunker.chunk_record(text, patient_id="ignored")
+    assert chunk.metadata["record_type"] == "report" and chunk.metadata["patient_id"] == "1234567"
+
+    chunk, = chunker.chunk_record(record(["Hemoglobin 9.1 g/dL"]), patient_id="7654321")
+    assert chunk.metadata["patient_id"] == "7654321"
+
+    assert detect_record_type("Whats in the chest x ray result ?") == "image_finding"
+    assert detect_patient_id("MRN: 42-ab and more") == "42-ab"
+    assert chunker.chunk_record("\n  \n") == []
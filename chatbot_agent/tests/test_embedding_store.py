@@ -0,0 +1,61 @@
+import os, sys, json, threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from embedding_store import EmbeddingStore, content_hash
+from embedding_backends import make_embeddings
+
+
+def make_store(path, **kwargs):
+    embeddings = make_embeddings("local")
+    return EmbeddingStore(embeddings, model_name = embeddings.model, path = str(path), **kwargs)
+
+
+def file_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_entries_of_other_models_are_compacted_on_load(tmp_path):
+    path = tmp_path / "embeddings_cache.jsonl"
+    with open(path, "w") as f:
+        for i in range(5):
+            f.write(json.dumps({"model": "old-model", "hash": str(i), "vector": [0.0]}) + "\n")
+    store = make_store(path)
+    store.embed_documents(["a", "b"])
+
+    store = make_store(path)
+    assert len(store) == 2
+    assert [record["hash"] for record in file_lines(path)] == [content_hash("a"), content_hash("b")]
+
+
+def test_retain_compacts_once_dead_entries_outnumber_live_ones(tmp_path):
+    path = tmp_path / "embeddings_cache.jsonl"
+    store = make_store(path)
+    store.embed_documents(["a", "b", "c", "d"])
+
+    store.retain({content_hash("a"), content_hash("b")})
+    assert len(file_lines(path)) == 4  # Two dead lines for two live entries
+
+    store.retain({content_hash("a")})
+    assert [record["hash"] for record in file_lines(path)] == [content_hash("a")]
+    assert make_store(path).embed_documents(["a"]) == store.embed_documents(["a"])
+
+
+def test_query_cache_is_thread_safe(tmp_path):
+    store = make_store(tmp_path / "embeddings_cache.jsonl", query_cache_size = 8)
+    errors = []
+
+    def embed(offset):
+        try:
+            for i in range(300):
+                store.embed_query(f"query {(offset + i) % 40}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = embed, args = (n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and len(store._queries) <= 8
@@ -0,0 +1,107 @@
+import os, sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from followup_classifier import ANAPHORA_PATTERN, FollowupClassifier
+
+TOPIC = "What are the side effects of paracetamol?"
+HISTORY = [
+    {"role": "user", "content": TOPIC},
+    {"role": "assistant", "content": "Paracetamol can cause nausea and, rarely, liver damage at high doses."},
+]
+# Neither an anaphora nor a new data category, the lexical rules leave both undecided
+SIMILAR_QUERY = "What are the side effects of paracetamol tablets?"
+UNRELATED_QUERY = "How should I store insulin pens at home?"
+
+
+def test_lexical_rules_leave_the_queries_undecided():
+    classifier = FollowupClassifier()
+    assert classifier.classify(SIMILAR_QUERY, HISTORY, TOPIC) is None
+    assert classifier.classify(UNRELATED_QUERY, HISTORY, TOPIC) is None
+
+
+@pytest.mark.parametrize("similarity, expected", [(0.9, (True, False)), (0.1, (False, True)), (0.5, None)])
+def test_similarity_thresholds_decide(similarity, expected):
+    classifier = FollowupClassifier(similarity_fn=lambda query, topic: similarity)
+    assert classifier.classify(SIMILAR_QUERY, HISTORY, TOPIC) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "What is the price of paracetamol?",
+    "Is this medicine safe during pregnancy?",
+    "Also show my blood test results",
+    "What are the side effects of that medicine?",
+])
+def test_common_words_are_not_anaphora(query):
+    assert not ANAPHORA_PATTERN.search(query.lower())
+
+
+@pytest.mark.parametrize("query", ["Tell me more about it", "Why is that?", "Is it serious?", "Explain this"])
+def test_referring_phrases_are_anaphora(query):
+    assert ANAPHORA_PATTERN.search(query.lower())
+
+
+@pytest.fixture
+def chat_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    from chat_worker import ChatWithDocs
+
+    worker = ChatWithDocs(
+        embedding_backend="local",
+        data_path=str(tmp_path / "data.txt"),
+        embed_cache_path=str(tmp_path / "embeddings_cache.jsonl"),
+        index_path=str(tmp_path / "vector_index"),
+    )
+    worker.conversation_history = list(HISTORY)
+    worker.last_query_topic = TOPIC
+
+    similarities = []
+    similarity_fn = worker.followup_classifier.similarity_fn
+    def recording_similarity(query, topic):
+        similarities.append(similarity_fn(query, topic))
+        return similarities[-1]
+    worker.followup_classifier.similarity_fn = recording_similarity
+    return worker, similarities
+
+
+@pytest.mark.parametrize("query, expected", [(SIMILAR_QUERY, (True, False)), (UNRELATED_QUERY, (False, True))])
+def test_chat_worker_embeds_the_query_before_classifying(chat_worker, query, expected):
+    worker, similarities = chat_worker
+    assert worker.classify_query(query) == expected
+    assert similarities and similarities[-1] is not None
+    assert worker.followup_classifier.stats["fast_path"] == 1
+
+
+@pytest.mark.parametrize("query, expected", [(SIMILAR_QUERY, (True, False)), (UNRELATED_QUERY, (False, True))])
+def test_chat_worker_embeds_the_query_before_classifying_async(chat_worker, query, expected):
+    import asyncio
+
+    worker, similarities = chat_worker
+    assert asyncio.run(worker.aclassify_query(query)) == expected
+    assert similarities and similarities[-1] is not None
+    assert worker.followup_classifier.stats["fast_path"] == 1
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Tell me more about it", (True, False)),
+    ("What is the price of my chest x-ray scan?", (False, True)),
+])
+def test_lexical_decisions_make_no_embedding_call(chat_worker, query, expected):
+    worker, similarities = chat_worker
+    embedded = []
+    embed_query = worker.embedding_model.embeddings.embed_query
+    worker.embedding_model.embeddings.embed_query = lambda text: embedded.append(text) or embed_query(text)
+
+    assert worker.classify_query(query) == expected
+    assert not embedded and not similarities
+    assert worker.followup_classifier.stats == {"fast_path": 1, "fallback": 0}
+
+
+def test_undecided_queries_are_counted_once(chat_worker):
+    worker, _ = chat_worker
+    worker.followup_classifier.similarity_fn = lambda query, topic: 0.5
+    worker.llm = None  # The LLM fallback fails and answers new context
+    assert worker.classify_query(SIMILAR_QUERY) == (False, True)
+    assert worker.followup_classifier.stats == {"fast_path": 0, "fallback": 1}
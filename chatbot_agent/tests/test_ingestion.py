@@ -0,0 +1,88 @@
+import os, sys, shutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from ingestion import DataFileIngestor
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers")
+
+
+def append(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+def test_appends_are_read_from_the_last_record(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text(">>>>\nfirst record\n>>>>\nsecond rec")
+    ingestor = DataFileIngestor(str(path))
+    assert ingestor.poll() == ([(4, "\nfirst record\n"), (22, "\nsecond rec")], [], True)
+    assert ingestor.poll() == ([], [], False)
+
+    # The last record was still being written, it is re-read with the new one
+    append(path, "ord\n>>>>\nthird record\n")
+    assert ingestor.poll() == ([(22, "\nsecond record\n"), (41, "\nthird record\n")], [], False)
+    assert list(ingestor.records) == [4, 22, 41]
+
+
+def test_appending_to_a_short_file_is_not_a_replacement(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text(">>>>\nshort\n")
+    ingestor = DataFileIngestor(str(path))
+    ingestor.poll()
+    for i in range(10):
+        append(path, f">>>>\nrecord {i} " + "x" * 40 + "\n")
+        changed, removed, reset = ingestor.poll()
+        assert not reset and not removed and [text for _, text in changed] == [f"\nrecord {i} " + "x" * 40 + "\n"]
+    assert os.path.getsize(path) > DataFileIngestor.head_bytes
+
+
+def test_replaced_or_truncated_files_are_read_again(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text(">>>>\nold record one\n>>>>\nold record two\n")
+    ingestor = DataFileIngestor(str(path))
+    ingestor.poll()
+
+    replacement = tmp_path / "new.txt"
+    replacement.write_text(">>>>\nnew record one\n>>>>\nnew record two, longer\n")
+    os.replace(replacement, path)
+    changed, removed, reset = ingestor.poll()
+    assert reset and [text for _, text in changed] == ["\nnew record one\n", "\nnew record two, longer\n"]
+
+    path.write_text(">>>>\nnew\n")
+    changed, removed, reset = ingestor.poll()
+    assert reset and changed == [(4, "\nnew\n")] and removed == [24]
+
+
+def make_worker(tmp_path):
+    from chat_worker import ChatWithDocs
+
+    worker = ChatWithDocs(
+        embedding_backend="local",
+        data_path=str(tmp_path / "data.txt"),
+        embed_cache_path=str(tmp_path / "embeddings_cache.jsonl"),
+        index_path=str(tmp_path / "vector_index"),
+    )
+    embedded = []
+    embed_documents = worker.embedding_model.embeddings.embed_documents
+    worker.embedding_model.embeddings.embed_documents = lambda texts: embedded.extend(texts) or embed_documents(texts)
+    return worker, embedded
+
+
+def test_restarted_worker_resumes_from_the_persisted_index(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    shutil.copy(os.path.join(WORKERS, "data.txt"), tmp_path / "data.txt")
+    worker, embedded = make_worker(tmp_path)
+    worker.refresh_index()
+    indexed = len(worker.vector_index)
+    assert embedded and indexed == len(worker.documents)
+
+    # Only the appended record is embedded, before and after a restart
+    append(tmp_path / "data.txt", "\n>>>>\nAll information about ORS: oral rehydration salts, one sachet in a litre of water\n")
+    worker.refresh_index()
+    assert len(worker.vector_index) == indexed + 1
+
+    restarted, embedded = make_worker(tmp_path)
+    restarted.refresh_index()
+    assert not embedded
+    assert sorted(restarted.vector_index.ids) == sorted(worker.vector_index.ids)
@@ -0,0 +1,46 @@
+import os, sys
+import asyncio, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from instrumentation import TurnTimer
+from test_followup_classifier import SIMILAR_QUERY, chat_worker  # noqa: F401 (fixture)
+
+
+def test_nested_stages_are_only_counted_once():
+    timer = TurnTimer()
+    with timer.stage("classify"):
+        time.sleep(0.02)
+        with timer.stage("embedding"):
+            time.sleep(0.1)
+    assert timer.stages["embedding"] >= 0.1
+    assert 0.02 <= timer.stages["classify"] < 0.08
+
+
+def test_concurrent_tasks_do_not_nest():
+    timer = TurnTimer()
+
+    async def retrieval():
+        with timer.stage("search"):
+            await asyncio.sleep(0.1)
+
+    async def turn():
+        task = asyncio.create_task(retrieval())
+        with timer.stage("classify"):
+            await asyncio.sleep(0.1)
+        await task
+
+    asyncio.run(turn())
+    assert timer.stages["classify"] >= 0.1 and timer.stages["search"] >= 0.1
+
+
+def test_classification_embedding_is_timed_as_embedding(chat_worker):
+    worker, _ = chat_worker
+    embed_query = worker.embedding_model.embeddings.embed_query
+    worker.embedding_model.embeddings.embed_query = lambda text: time.sleep(0.05) or embed_query(text)
+
+    worker.timer = TurnTimer()
+    with worker.timer.stage("classify"):
+        assert worker.classify_query(SIMILAR_QUERY) == (True, False)
+    assert worker.timer.stages["embedding"] >= 0.1  # The query and the last topic
+    assert worker.timer.stages["classify"] < 0.05
@@ -0,0 +1,97 @@
+import os, sys, shutil
+
+import pytest
+
+WORKERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers")
+sys.path.append(WORKERS)
+
+# Offsets of the records of workers/data.txt: MRN 1234567's report, its summary and chest X-ray finding,
+# two medicine information records and the medicine prices
+REPORT, SUMMARY, XRAY_FINDING = 4, 1313, 2864
+MEDICINE_RECORDS = {3109, 7011, 11680}
+
+
+def make_worker(tmp_path, data_path, **kwargs):
+    from chat_worker import ChatWithDocs
+
+    worker = ChatWithDocs(
+        embedding_backend="local",
+        data_path=str(data_path),
+        embed_cache_path=str(tmp_path / "embeddings_cache.jsonl"),
+        index_path=str(tmp_path / "vector_index"),
+        **kwargs
+    )
+    worker.refresh_index()
+    return worker
+
+
+def visible_offsets(worker, query):
+    with worker.index_lock:
+        allowed = worker.allowed_ids(query)
+    ids = worker.documents if allowed is None else allowed
+    return {worker.documents[doc_id].metadata["offset"] for doc_id in ids}
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    path = tmp_path / "data.txt"
+    shutil.copy(os.path.join(WORKERS, "data.txt"), path)
+    return path
+
+
+def test_report_summary_and_finding_inherit_the_report_patient(tmp_path, data_path):
+    worker = make_worker(tmp_path, data_path)
+    patients = {doc.metadata["offset"]: doc.metadata["patient_id"] for doc in worker.documents.values()}
+    assert patients[REPORT] == patients[SUMMARY] == patients[XRAY_FINDING] == "1234567"
+    # The medicine records are about the prescription of the report
+    assert all(patients[offset] == "1234567" for offset in MEDICINE_RECORDS)
+
+
+@pytest.mark.parametrize("query", ["Whats in the chest x ray result?", "Is everything okay in my report?", "hello"])
+def test_other_patient_cannot_see_the_records_of_mrn_1234567(tmp_path, data_path, query):
+    worker = make_worker(tmp_path, data_path)
+
+    other = worker.fork(patient_id="7654321")
+    assert not visible_offsets(other, query) & {REPORT, SUMMARY, XRAY_FINDING}
+    assert "Whats in the chest x ray result" not in other.run_retriever(query)
+
+    owner = worker.fork(patient_id="1234567")
+    assert XRAY_FINDING in visible_offsets(owner, "Whats in the chest x ray result?")
+
+
+def test_medicine_records_are_not_shared(tmp_path, data_path):
+    worker = make_worker(tmp_path, data_path, patient_id="1234567")
+    assert visible_offsets(worker, "What is the price of paracetamol?") == {11680}
+    assert MEDICINE_RECORDS <= visible_offsets(worker, "hello")
+
+    other = worker.fork(patient_id="7654321")
+    assert not visible_offsets(other, "What is the price of paracetamol?") & MEDICINE_RECORDS
+    assert not visible_offsets(other, "hello") & MEDICINE_RECORDS
+
+
+def test_unattributed_records_are_hidden_from_patients(tmp_path, data_path):
+    # Without the report, the other records name no patient and follow no report
+    text = data_path.read_text()
+    data_path.write_text(text[text.index(">>>>", REPORT):])
+    worker = make_worker(tmp_path, data_path, patient_id="7654321")
+    assert worker.documents and not visible_offsets(worker, "hello")
+
+    # Unless the data file belongs to a patient
+    (tmp_path / "source").mkdir()
+    worker = make_worker(tmp_path / "source", data_path, patient_id="7654321", data_patient_id="7654321")
+    assert any(doc.metadata["record_type"] == "image_finding" for doc in worker.documents.values())
+    assert any(
+        worker.documents[doc_id].metadata["record_type"] == "image_finding" for doc_id in worker.allowed_ids("hello")
+    )
+
+
+def test_appended_records_follow_the_last_report(tmp_path, data_path):
+    worker = make_worker(tmp_path, data_path)
+    with open(data_path, "a") as f:
+        f.write("\n>>>>\nThe Original Report of the patient is : \nPatient ID: 7654321\nHemoglobin 9.1 g/dL\n")
+        f.write("\n>>>>\nWhats in the brain MRI result ? medical image report ?\nNo tumor detected\n")
+    worker.refresh_index()
+    patients = {doc.page_content: doc.metadata["patient_id"] for doc in worker.documents.values()}
+    assert patients[next(content for content in patients if "No tumor detected" in content)] == "7654321"
+    assert XRAY_FINDING not in visible_offsets(worker.fork(patient_id="7654321"), "hello")
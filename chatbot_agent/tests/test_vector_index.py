@@ -0,0 +1,113 @@
+import os, sys
+import multiprocessing
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers"))
+
+from vector_index import DenseVectorIndex
+
+DIM = 8
+
+
+def vectors(start, count):
+    rng = np.random.default_rng(start)
+    return rng.standard_normal((count, DIM)).tolist()
+
+
+def ids(start, count):
+    return [f"doc-{i}" for i in range(start, start + count)]
+
+
+@pytest.fixture
+def small_capacity(monkeypatch):
+    monkeypatch.setattr(DenseVectorIndex, "min_capacity", 4)
+
+
+def test_rows_persist_and_are_found(tmp_path):
+    path = str(tmp_path / "index")
+    index = DenseVectorIndex(path, model_name = "m")
+    index.add(ids(0, 3), vectors(0, 3))
+
+    reopened = DenseVectorIndex(path, model_name = "m")
+    assert reopened.ids == ids(0, 3)
+    assert reopened.search(vectors(0, 3)[1], 1)[0][0] == "doc-1"
+
+
+def test_index_of_another_model_is_discarded(tmp_path):
+    path = str(tmp_path / "index")
+    DenseVectorIndex(path, model_name = "m").add(ids(0, 3), vectors(0, 3))
+    assert len(DenseVectorIndex(path, model_name = "other")) == 0
+
+
+def test_matrix_grows_geometrically_and_keeps_its_rows(tmp_path, small_capacity):
+    index = DenseVectorIndex(str(tmp_path / "index"), model_name = "m")
+    capacities = []
+    for start in range(0, 20, 2):
+        index.add(ids(start, 2), vectors(start, 2))
+        capacities.append(index._mapped.shape[0])
+    assert capacities == [4, 4, 8, 8, 16, 16, 16, 16, 32, 32]
+
+    expected = np.concatenate([vectors(start, 2) for start in range(0, 20, 2)])
+    expected /= np.linalg.norm(expected, axis = 1, keepdims = True)
+    assert np.allclose(index.matrix, expected, atol = 1e-6)
+    assert index.rows == {doc_id: row for row, doc_id in enumerate(ids(0, 20))}
+
+
+def test_duplicate_ids_are_skipped(tmp_path):
+    index = DenseVectorIndex(str(tmp_path / "index"), model_name = "m")
+    index.add(ids(0, 2), vectors(0, 2))
+    index.add(["doc-1", "doc-2", "doc-2"], vectors(1, 3))
+    assert index.ids == ids(0, 3)
+
+
+def test_remove_rewrites_the_remaining_rows(tmp_path):
+    path = str(tmp_path / "index")
+    index = DenseVectorIndex(path, model_name = "m")
+    index.add(ids(0, 5), vectors(0, 5))
+    before = np.asarray(index.matrix).copy()
+
+    index.remove(["doc-1", "doc-3", "unknown"])
+    assert index.ids == ["doc-0", "doc-2", "doc-4"]
+    assert np.allclose(index.matrix, before[[0, 2, 4]])
+
+    reopened = DenseVectorIndex(path, model_name = "m")
+    assert reopened.ids == index.ids
+    assert reopened.search(vectors(0, 5)[4], 1)[0][0] == "doc-4"
+
+
+def test_writes_of_other_instances_are_reloaded(tmp_path):
+    path = str(tmp_path / "index")
+    reader = DenseVectorIndex(path, model_name = "m")
+    writer = DenseVectorIndex(path, model_name = "m")
+
+    writer.add(ids(0, 2), vectors(0, 2))
+    assert reader.search(vectors(0, 2)[0], 1)[0][0] == "doc-0"
+
+    writer.remove(["doc-0"])
+    reader.reload_if_changed()
+    assert reader.ids == ["doc-1"] and reader.version == writer.version
+
+    # A writer that missed the other's rows starts from the latest state on disk
+    reader.add(ids(2, 1), vectors(2, 1))
+    writer.add(ids(3, 1), vectors(3, 1))
+    assert DenseVectorIndex(path, model_name = "m").ids == ["doc-1", "doc-2", "doc-3"]
+
+
+def add_rows(path, start):
+    index = DenseVectorIndex(path, model_name = "m")
+    for i in range(start, start + 30, 3):
+        index.add(ids(i, 3), vectors(i, 3))
+
+
+def test_processes_writing_one_index_keep_every_row(tmp_path):
+    path = str(tmp_path / "index")
+    processes = [multiprocessing.Process(target = add_rows, args = (path, start)) for start in (0, 100, 200)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    index = DenseVectorIndex(path, model_name = "m")
+    assert sorted(index.ids) == sorted(ids(0, 30) + ids(100, 30) + ids(200, 30))
+    assert np.allclose(np.linalg.norm(index.matrix, axis = 1), 1.0, atol = 1e-5)
@@ -0,0 +1,307 @@
+"""
+Approximate nearest neighbour search for the chat worker.
+An inverted file (IVF) index over the rows of a DenseVectorIndex: the embeddings are clustered with
+spherical k-means and a query only scores the rows of its `n_probe` closest clusters, instead of the
+whole matrix. The vectors stay in the memory-mapped matrix, the IVF index only keeps the centroids and
+the cluster of every row id, so inserts and deletes are cheap and the index is rebuilt from the
+centroids after a restart. The assignments are snapshotted when the centroids are trained, the later
+changes are appended to a log that is folded into a new snapshot once it outgrows it.
+"""
+
+import os, json, time, threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vector_index import DenseVectorIndex, top_k_rows
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Cluster L2-normalised vectors by cosine similarity.
+
+    Args:
+        vectors (np.ndarray): The vectors, one per row.
+        n_clusters (int): Number of clusters.
+        n_iter (int): Number of k-means iterations.
+        seed (int): Random seed of the initial centroids.
+
+    Returns:
+        np.ndarray: The L2-normalised centroids, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size = n_clusters, replace = False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis = 1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis = 1, keepdims = True)
+        # Re-seed empty clusters with random vectors
+        empty = norms[:, 0] < 1e-12
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size = int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis = 1, keepdims = True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted file index generating candidate rows of a DenseVectorIndex."""
+
+    # Rows sampled to train the centroids, per cluster
+    train_rows_per_list = 256
+
+    def __init__(
+        self,
+        vector_index: DenseVectorIndex,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        retrain_growth: float = 4.0
+    ) -> None:
+        """
+        Initialize the index and load the centroids and assignments from disk, if any.
+
+        Args:
+            vector_index (DenseVectorIndex): The index holding the vectors, the IVF files are stored next to it.
+            n_lists (int): Number of clusters, about sqrt(rows) when None.
+            n_probe (int): Number of closest clusters scanned per query.
+            retrain_growth (float): Retrain the centroids when the index grew by this factor since training.
+        """
+        self.vector_index = vector_index
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.retrain_growth = retrain_growth
+        self.centroids_path = f"{vector_index.path}.ivf.npy"
+        self.lists_path = f"{vector_index.path}.ivf.json"
+        self.log_path = f"{vector_index.path}.ivf.log"
+
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Dict[str, int] = {} # Row id -> cluster
+        self.trained_rows = 0
+        self.generation = None # Identifies the centroids, log lines written for other centroids are ignored
+        self._log_entries = 0 # Assignment changes in the log since the snapshot
+        self._snapshot_entries = 0 # Assignments in the snapshot
+        self._centroids_stamp = None # Detects centroids retrained by another process
+        self.lists: List[np.ndarray] = [] # Cluster -> rows of the vector index
+        self._synced_version = None # The version of the vector index the lists were built for
+        self.load()
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def load(self) -> None:
+        """
+        Read the centroids, the assignments snapshot and the log of the later changes from disk.
+        A missing or mismatched index is treated as untrained.
+        """
+        self.centroids, self.assignments, self.trained_rows, self._synced_version = None, {}, 0, None
+        self.generation, self._log_entries, self._snapshot_entries, self._centroids_stamp = None, 0, 0, None
+        if not (os.path.exists(self.centroids_path) and os.path.exists(self.lists_path)):
+            return
+        try:
+            with self.vector_index._locked(shared = True):
+                with open(self.lists_path, "r") as f:
+                    meta = json.load(f)
+                centroids = np.load(self.centroids_path)
+                centroids_stamp = self._stamp(self.centroids_path)
+                assignments = meta["assignments"]
+                log = []
+                if os.path.exists(self.log_path):
+                    with open(self.log_path, "r") as f:
+                        log = f.readlines()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error loading IVF index: {e}")
+            return
+        if meta.get("model") != self.vector_index.model_name or centroids.ndim != 2:
+            print("IVF index on disk does not match the vector index, retraining it")
+            return
+
+        generation = meta.get("generation")
+        self._snapshot_entries = len(assignments)
+        for line in log:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written line from an interrupted run
+                continue
+            if record.get("generation") != generation:
+                continue
+            for doc_id, cluster in record["assignments"].items():
+                if cluster is None:
+                    assignments.pop(doc_id, None)
+                else:
+                    assignments[doc_id] = cluster
+            self._log_entries += len(record["assignments"])
+
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = assignments
+        self.trained_rows = meta.get("trained_rows", len(assignments))
+        self.generation = generation
+        self._centroids_stamp = centroids_stamp
+
+    def _stamp(self, path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _temp_path(self, path: str) -> str:
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _persist(self, centroids: bool = False) -> None:
+        """
+        Snapshot the assignments, and the centroids when they were retrained, and empty the log.
+        Must be called with the file lock of the vector index held.
+        """
+        if centroids:
+            temp_path = self._temp_path(self.centroids_path)
+            with open(temp_path, "wb") as f:
+                np.save(f, self.centroids)
+            os.replace(temp_path, self.centroids_path)
+            self._centroids_stamp = self._stamp(self.centroids_path)
+        temp_path = self._temp_path(self.lists_path)
+        with open(temp_path, "w") as f:
+            json.dump({
+                "model": self.vector_index.model_name,
+                "generation": self.generation,
+                "trained_rows": self.trained_rows,
+                "assignments": self.assignments
+            }, f)
+        os.replace(temp_path, self.lists_path)
+        # The snapshot includes the logged changes
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._log_entries, self._snapshot_entries = 0, len(self.assignments)
+
+    def _log(self, changes: Dict[str, Optional[int]]) -> None:
+        """
+        Append assignment changes to the log, None for a removed row, or snapshot the assignments
+        when the log outgrew them. Only writes the changes, not every assignment.
+
+        Args:
+            changes (Dict[str, Optional[int]]): Row id -> new cluster, or None.
+        """
+        try:
+            with self.vector_index._locked():
+                # Another process retrained the centroids, its snapshot must not be replaced by these assignments
+                if self._stamp(self.centroids_path) != self._centroids_stamp:
+                    return
+                self._log_entries += len(changes)
+                if self._log_entries > self._snapshot_entries:
+                    self._persist()
+                    return
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps({"generation": self.generation, "assignments": changes}) + "\n")
+        except OSError as e:
+            print(f"Error saving IVF index: {e}")
+
+    def _assign(self, rows: np.ndarray) -> np.ndarray:
+        assignment = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), DenseVectorIndex.block_size):
+            block = np.asarray(self.vector_index.matrix[rows[start:start + DenseVectorIndex.block_size]], dtype=np.float32)
+            assignment[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis = 1)
+        return assignment
+
+    def train(self) -> None:
+        """
+        Cluster the vectors of the index and assign every row to its closest centroid.
+        """
+        n_rows = len(self.vector_index)
+        if not n_rows:
+            return
+        n_lists = min(self.n_lists or max(int(np.sqrt(n_rows)), 1), n_rows)
+        rng = np.random.default_rng(0)
+        sample_size = min(n_rows, n_lists * self.train_rows_per_list)
+        sample = np.sort(rng.choice(n_rows, size = sample_size, replace = False))
+        vectors = np.asarray(self.vector_index.matrix[sample], dtype=np.float32)
+
+        self.centroids = spherical_kmeans(vectors, n_lists)
+        rows = np.arange(n_rows)
+        self.assignments = dict(zip(self.vector_index.ids, self._assign(rows).tolist()))
+        self.trained_rows = n_rows
+        self.generation = time.time_ns()
+        try:
+            with self.vector_index._locked():
+                self._persist(centroids = True)
+        except OSError as e:
+            print(f"Error saving IVF index: {e}")
+
+    def sync(self) -> None:
+        """
+        Bring the clusters up to date with the vector index: assign new rows to their closest centroid,
+        forget removed rows and retrain when the index outgrew the centroids.
+        """
+        index = self.vector_index
+        if self._synced_version == index.version:
+            return
+        if not len(index):
+            self.assignments, self.lists = {}, []
+            self._synced_version = index.version
+            return
+
+        if (
+            not self.is_trained
+            or self.centroids.shape[1] != index.matrix.shape[1]
+            or len(index) > self.trained_rows * self.retrain_growth
+        ):
+            self.train()
+        else:
+            changes: Dict[str, Optional[int]] = {}
+            # Deletes only drop the assignment, the centroids stay valid
+            for doc_id in [doc_id for doc_id in self.assignments if doc_id not in index.rows]:
+                del self.assignments[doc_id]
+                changes[doc_id] = None
+            new_rows = np.asarray([row for row, doc_id in enumerate(index.ids) if doc_id not in self.assignments], dtype=np.int64)
+            if len(new_rows):
+                for row, cluster in zip(new_rows.tolist(), self._assign(new_rows).tolist()):
+                    self.assignments[index.ids[row]] = cluster
+                    changes[index.ids[row]] = cluster
+            if changes:
+                self._log(changes)
+
+        # Rows of every cluster, in the current row order of the matrix
+        clusters = np.asarray([self.assignments[doc_id] for doc_id in index.ids], dtype=np.int64)
+        order = np.argsort(clusters, kind = "stable")
+        bounds = np.searchsorted(clusters[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self._synced_version = index.version
+
+    def candidate_rows(self, query_vector: List[float], n_probe: Optional[int] = None) -> np.ndarray:
+        """
+        Rows of the clusters closest to the query.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            n_probe (int): Number of clusters to scan, `self.n_probe` by default.
+
+        Returns:
+            np.ndarray: The candidate row numbers, sorted.
+        """
+        self.sync()
+        if not self.lists:
+            return np.arange(0)
+        query = np.asarray(query_vector, dtype=np.float32)
+        closest = top_k_rows(self.centroids @ query, n_probe or self.n_probe)
+        return np.sort(np.concatenate([self.lists[cluster] for cluster in closest]))
+
+    def search(self, query_vector: List[float], k: int, n_probe: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Find approximately the k rows most similar to the query.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            k (int): Number of results to return.
+            n_probe (int): Number of clusters to scan, `self.n_probe` by default.
+
+        Returns:
+            List[Tuple[str, float]]: (id, score) pairs sorted by decreasing score.
+        """
+        if k <= 0:
+            return []
+        rows = self.candidate_rows(query_vector, n_probe)
+        if not len(rows):
+            return []
+        scores = self.vector_index.scores(query_vector, rows)
+        return [(self.vector_index.ids[rows[i]], float(scores[i])) for i in top_k_rows(scores, k)]
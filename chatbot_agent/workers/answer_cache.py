@@ -0,0 +1,113 @@
+"""
+Semantic answer cache for the chat worker.
+Stores generated answers keyed by query embedding, a hash of the rest of the prompt inputs (retrieved context,
+conversation and patient, see 'ChatWithDocs.create_answer_cache_key') and the LLM model,
+so that repeated patient questions ("is my report okay?") skip generation.
+Entries expire after a TTL, are evicted LRU beyond a size bound and are dropped when the documents change.
+"""
+
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """LRU / TTL answer cache matched by cosine similarity of the query embeddings."""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl: float = 3600.0) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            threshold (float): Minimum cosine similarity between two queries to reuse an answer.
+            max_entries (int): Maximum number of cached answers, the least recently used are evicted.
+            ttl (float): Time to live of an answer in seconds.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.corpus_version = None
+        self.entries: "OrderedDict[int, dict]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        self.entries.clear()
+
+    def set_corpus_version(self, version: str) -> None:
+        """
+        Invalidate the cache when the underlying document set changed.
+
+        Args:
+            version (str): Fingerprint of the current document set.
+        """
+        if version != self.corpus_version:
+            self.clear()
+            self.corpus_version = version
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, query_vector: List[float], context_hash: str, model: str) -> Optional[str]:
+        """
+        Find a cached answer for a similar query over the same context and model.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            context_hash (str): Hash of the retrieved context and the other prompt inputs besides the query.
+            model (str): The LLM model name.
+
+        Returns:
+            Optional[str]: The cached answer, or None on a miss.
+        """
+        self._expire()
+        candidates = [
+            (entry_id, entry) for entry_id, entry in self.entries.items()
+            if entry["context_hash"] == context_hash and entry["model"] == model
+        ]
+        if candidates:
+            similarities = np.stack([entry["vector"] for _, entry in candidates]) @ self._normalize(query_vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                entry_id, entry = candidates[best]
+                self.entries.move_to_end(entry_id)
+                self.stats["hits"] += 1
+                return entry["answer"]
+
+        self.stats["misses"] += 1
+        return None
+
+    def store(self, query_vector: List[float], context_hash: str, model: str, answer: str) -> None:
+        """
+        Cache an answer.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            context_hash (str): Hash of the retrieved context and the other prompt inputs besides the query.
+            model (str): The LLM model name.
+            answer (str): The generated answer.
+        """
+        self.entries[self._next_id] = {
+            "vector": self._normalize(query_vector),
+            "context_hash": context_hash,
+            "model": model,
+            "answer": answer,
+            "created": time.monotonic(),
+        }
+        self._next_id += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
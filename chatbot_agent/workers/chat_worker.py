@@ -4,50 +4,266 @@ This worker is responsible for handling chat messages and generating responses u
 Uses Retrieval Augmented Generation (RAG) to fetch relevant context from the database and generate responses.
 """
 
-import os, sys, json
+import os, sys, json, time, copy
+import asyncio, threading
 from pydantic import BaseModel
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterator, Optional, Callable
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_core.documents import Document
 
-from openai import OpenAI
+import numpy as np
+
+from openai import OpenAI, AsyncOpenAI
 
 from prompts import rag_prompt
+from embedding_store import EmbeddingStore, content_hash
+from embedding_pipeline import EmbeddingPipeline
+from embedding_backends import make_embeddings, EMBEDDING_BACKENDS
+from vector_index import DenseVectorIndex, top_k_rows
+from ann_index import IVFIndex
+from lexical_index import BM25Index, fuse_scores, normalize_scores
+from reranker import mmr_select
+from followup_classifier import FollowupClassifier
+from answer_cache import SemanticAnswerCache
+from prompt_builder import TokenCounter, PromptBuilder
+from ingestion import DataFileIngestor
+from chunker import StructuredChunker, detect_patient_id
+from metadata_index import MetadataIndex, route_record_types
+from instrumentation import TurnTimer
+
+
+class QueryClassification(BaseModel): 
+    is_followup: bool
+    requires_new_context: bool
 
 
 class ChatWithDocs: 
     """Chat Worker for the Chatbot agent."""
 
-    def __init__(self, llm_model: str = "gpt-4o-mini", embed_model: str = "text-embedding-3-small", top_k: int = 2) -> None:
+    # Seconds before retrying to embed chunks after the embedding backend failed
+    embed_retry_interval = 30.0
+
+    def __init__(
+        self, 
+        llm_model: str = "gpt-4o-mini", 
+        embed_model: str = "text-embedding-3-small", 
+        top_k: int = 2, 
+        embed_cache_path: str = "embeddings_cache.jsonl",
+        index_path: str = "vector_index",
+        index_dtype: str = "float32",
+        fast_classifier: bool = True,
+        answer_cache: bool = True,
+        answer_cache_threshold: float = 0.95,
+        prompt_token_budget: int = 8000,
+        retrieval_mode: str = "hybrid",
+        hybrid_alpha: float = 0.5,
+        lexical_coverage: float = 1.0,
+        data_path: str = "data.txt",
+        data_patient_id: Optional[str] = None,
+        watch_interval: Optional[float] = None,
+        chunk_tokens: int = 256,
+        chunk_overlap: int = 32,
+        embed_batch_tokens: int = 100000,
+        embed_concurrency: int = 4,
+        turn_hooks: Optional[List[Callable[[Dict[str, Any]], None]]] = None,
+        index_backend: str = "exact",
+        ann_threshold: int = 20000,
+        ann_probe: int = 8,
+        patient_id: Optional[str] = None,
+        route_queries: bool = True,
+        embedding_backend: str = "openai",
+        mmr_lambda: Optional[float] = 0.7,
+        context_token_budget: Optional[int] = None,
+        fetch_k: int = 20
+    ) -> None:
         """
         Initialize the chat worker with the given LLM model and embedding model. 
+        Chunk embeddings are cached on disk at `embed_cache_path` and loaded once here.
+        The retrieval index is memory-mapped from `index_path` and stored as `index_dtype` (float32 or float16).
+        With `fast_classifier` the easy follow-up decisions are made locally, see FollowupClassifier;
+        when its lexical rules are undecided, the query is embedded for its similarity to the last topic.
+        With `answer_cache` answers to new-context queries are reused for similar queries 
+        (cosine similarity >= `answer_cache_threshold`) over the same context, conversation and patient, 
+        see SemanticAnswerCache.
+        RAG prompts are fitted into `prompt_token_budget` tokens, older turns are summarized, see PromptBuilder.
+        `retrieval_mode` is "dense" (embeddings only), "hybrid" (embedding and BM25 scores fused with weight 
+        `hybrid_alpha`) or "lexical" (BM25 only, no network call). In hybrid mode, queries whose informative 
+        terms are all found in the best BM25 chunk (share >= `lexical_coverage`) are answered lexically.
+        Records appended to `data_path` are ingested incrementally, on every retrieval and, if `watch_interval` 
+        is set, from a background thread polling the file every `watch_interval` seconds.
+        Records are split into chunks of at most `chunk_tokens` tokens overlapping by `chunk_overlap`, see StructuredChunker.
+        New chunks are embedded in batches of at most `embed_batch_tokens` tokens with at most `embed_concurrency` 
+        requests in flight, backing off on rate limits, see EmbeddingPipeline.
+        Every turn is timed per stage, the report is stored in `self.turn_stats` and passed to `turn_hooks`, see TurnTimer.
+        `index_backend` is "exact" (scan every chunk), "ivf" (approximate search scanning the `ann_probe` closest 
+        clusters, see IVFIndex) or "auto" (ivf once the index holds `ann_threshold` chunks).
+        With `patient_id` only the chunks of that patient are searched, 
+        sessions can be forked for other patients. A record that names no patient belongs to the patient named 
+        by the closest preceding record, else to `data_patient_id`, else to no patient and is only searched 
+        by sessions without a patient. With `route_queries` queries about one kind of data only 
+        search the matching record types, e.g. price questions only the price records, see MetadataIndex.
+        `embedding_backend` is "openai" (`embed_model` through the API) or "local" (offline hashed n-gram 
+        embeddings, `embed_model` is ignored), see make_embeddings. If the query cannot be embedded, 
+        retrieval falls back to BM25.
+        The `fetch_k` best chunks are re-ranked with maximal marginal relevance (weight `mmr_lambda`, None to 
+        disable it) to skip near-duplicates, and the context is packed up to `context_token_budget` tokens, 
+        or `top_k` chunks when no budget is set, see mmr_select.
         """
         # Check if OpenAI API key is set
         if not os.getenv("OPENAI_API_KEY"):
             print("Warning: OPENAI_API_KEY environment variable not set")
         
+        assert retrieval_mode in ("dense", "hybrid", "lexical"), "retrieval_mode must be dense, hybrid or lexical"
+        assert index_backend in ("exact", "ivf", "auto"), "index_backend must be exact, ivf or auto"
+        assert embedding_backend in EMBEDDING_BACKENDS, "embedding_backend must be openai or local"
+
         # Initialize the clients, models
         try:
             self.llm = OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
+            self.allm = AsyncOpenAI(api_key = os.getenv("OPENAI_API_KEY"))
             self.model = llm_model
             self.top_k = top_k
-            self.embedding_model = OpenAIEmbeddings(model = embed_model)
-            self.vector_store = InMemoryVectorStore(self.embedding_model)
+            if embedding_backend == "openai":
+                embeddings = make_embeddings(
+                    "openai", 
+                    embed_model, 
+                    max_batch_tokens = embed_batch_tokens, 
+                    max_concurrency = embed_concurrency
+                )
+            else:
+                embeddings = make_embeddings(embedding_backend)
+            # Cache entries and index rows are keyed by the vector space
+            self.embedding_model = EmbeddingStore(
+                embeddings, 
+                model_name = embeddings.model, 
+                path = embed_cache_path
+            )
+            self.vector_index = DenseVectorIndex(path = index_path, dtype = index_dtype, model_name = embeddings.model)
+            self.ann_index = IVFIndex(self.vector_index, n_probe = ann_probe) if index_backend != "exact" else None
+            self.ann_threshold = ann_threshold if index_backend == "auto" else 0
+            self.lexical_index = BM25Index()
+            self.metadata_index = MetadataIndex()
+            self.route_queries = route_queries
+            self.mmr_lambda = mmr_lambda
+            self.context_token_budget = context_token_budget
+            self.fetch_k = fetch_k
+            self.retrieval_mode = retrieval_mode
+            self.hybrid_alpha = hybrid_alpha
+            self.lexical_coverage = lexical_coverage
+            self.prompt_builder = PromptBuilder(
+                TokenCounter(llm_model), 
+                budget = prompt_token_budget, 
+                summarize_fn = self.summarize_history
+            )
+            self.ingestor = DataFileIngestor(data_path, patient_id = data_patient_id)
+            self.chunker = StructuredChunker(
+                self.prompt_builder.counter, 
+                chunk_tokens = chunk_tokens, 
+                overlap_tokens = chunk_overlap
+            )
+            self.record_ids = {} # Byte offset of the record in the data file -> content hashes of its chunks
+            self.named_patients = {} # Byte offset of the record -> patient it names, if any
+            self.record_patients = {} # Byte offset of the record -> patient its chunks were attributed to
+            self.documents = {} # Content hash -> langchain document, for the chunks in the index
+            self.index_lock = threading.Lock() # Guards the index and documents, shared by forked sessions
+            self.embedding_ids = set() # Chunks being embedded by a session, shared by forked sessions
+            self.embed_retry = {"at": 0.0} # When to retry embedding chunks after a failure, shared by forked sessions
+            self.followup_classifier = FollowupClassifier(similarity_fn = self.cached_similarity) if fast_classifier else None
+            self.answer_cache = SemanticAnswerCache(threshold = answer_cache_threshold) if answer_cache else None
+            self.turn_hooks = list(turn_hooks or []) # Shared by forked sessions
         except Exception as e:
             print(f"Error initializing component: {e}")
             raise exception(f"Error: {e}")
         
         # Conversation State  
-        self.conversation_history = []
-        self.current_context = None 
-        self.last_query_topic = None
+        self.patient_id = patient_id
+        self.reset_state()
         
         # Check if data exists 
-        if os.path.exists("data.txt"):
-            print("data.txt found!")
+        if os.path.exists(data_path):
+            print(f"{data_path} found!")
+        if watch_interval:
+            self.ingestor.start(self.refresh_index, interval = watch_interval)
             
+    def reset_state(self) -> None:
+        """
+        Reset the per-conversation state.
+        """
+        self.conversation_history = []
+        self.current_context = None 
+        self.last_query_topic = None
+
+        # Timings of the last streamed response, see 'chat_stream'
+        self.stream_stats = {}
+        # (query embedding, prompt inputs hash) of the current turn, set when new context was fetched
+        self.answer_cache_key = None
+
+        # Rolling summary of conversation_history[:summarized_upto], see 'build_rag_prompt'
+        self.history_summary = ""
+        self.summarized_upto = 0
+        # Token counts of the last RAG prompt, see 'build_rag_prompt'
+        self.prompt_stats = {}
+        # Timer of the current turn and report of the last finished turn, see 'intent'
+        self.timer = TurnTimer()
+        self.turn_stats = {}
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Export the per-conversation state.
+
+        Returns:
+            Dict[str, Any]: A JSON serializable copy of the conversation state.
+        """
+        return {
+            "conversation_history": list(self.conversation_history),
+            "current_context": self.current_context,
+            "last_query_topic": self.last_query_topic,
+            "history_summary": self.history_summary,
+            "summarized_upto": self.summarized_upto,
+            "patient_id": self.patient_id,
+        }
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the per-conversation state exported with 'get_state'.
+
+        Args:
+            state (Dict[str, Any]): The conversation state.
+        """
+        self.reset_state()
+        self.conversation_history = list(state.get("conversation_history", []))
+        self.current_context = state.get("current_context")
+        self.last_query_topic = state.get("last_query_topic")
+        self.history_summary = state.get("history_summary", "")
+        self.summarized_upto = state.get("summarized_upto", 0)
+        self.patient_id = state.get("patient_id", self.patient_id)
+
+    def drop_oldest_exchange(self) -> None:
+        """
+        Drop the oldest user / assistant exchange from the conversation history.
+        """
+        del self.conversation_history[:2]
+        self.summarized_upto = max(self.summarized_upto - 2, 0)
+
+    def fork(self, patient_id: Optional[str] = None) -> "ChatWithDocs":
+        """
+        Create a new conversation that shares the LLM clients, embeddings, index and caches of this one.
+
+        Args:
+            patient_id (str): The patient of the new conversation, the patient of this one when None.
+
+        Returns:
+            ChatWithDocs: A chat worker with an empty conversation state.
+        """
+        session = copy.copy(self)
+        # History summaries are generated, timed and charged by the session itself
+        session.prompt_builder = copy.copy(self.prompt_builder)
+        session.prompt_builder.summarize_fn = session.summarize_history
+        session.reset_state()
+        if patient_id is not None:
+            session.patient_id = patient_id
+        return session
+
     def create_followup_prompt(self, query: str) -> str:
         """
         Create a follow-up prompt for the given query.
@@ -77,6 +293,148 @@ class ChatWithDocs:
         """
         return augmented_prompt
 
+    def summarize_history(self, summary: str, turns: str) -> str:
+        """
+        Fold conversation turns into the rolling summary of the conversation.
+
+        Args:
+            summary (str): The current summary, empty at first.
+            turns (str): The formatted turns to add to the summary.
+
+        Returns:
+            str: The updated summary.
+        """
+        prompt = f"""
+            Update the summary of a conversation between a patient and a medical assistant chatbot.
+            Keep every medical fact, value, medicine name and open question, drop greetings and formatting.
+            Answer with the updated summary only, in at most 150 words.
+
+            Current summary:
+            {summary or "None"}
+
+            New conversation turns:
+            {turns}
+        """
+        try:
+            return self.chat(prompt_temp = prompt)
+        except Exception as e:
+            print(f"Error summarizing history: {e}")
+            return summary
+
+    def build_rag_prompt(self, query: str) -> str:
+        """
+        Build the RAG prompt for the query and current context within the prompt token budget.
+        Token counts, including the tokens saved compared to the raw history, are stored in `self.prompt_stats`.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            str: The RAG prompt.
+        """
+        prompt, self.history_summary, self.summarized_upto, self.prompt_stats = self.prompt_builder.build(
+            rag_prompt,
+            query = query,
+            context = self.current_context,
+            history = self.conversation_history,
+            summary = self.history_summary,
+            summarized_upto = self.summarized_upto
+        )
+        return prompt
+
+    def create_classification_prompt(self, query: str) -> str:
+        """
+        Create the prompt used to classify the query into follow-up or new query.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            str: The classification prompt.
+        """
+        prompt = f"""
+            You are part of AI medical chatbot responsible for determining the intent of user queries. 
+            The database from which you answer question contains three things: 
+                - Medical Reports (Text based) : These are the medical reports of the user. (and their summaries)
+                - Medical Images (MRIs, Chest X-rays, etc.) findings: These are the findings from the medical images of the user. 
+                - Medicine data : These are the data about the medicines prescribed to the user. (Side effects, dosage, how to use, etc.)
+                - Medicine links : These are buying links for the medicine
+
+            Keeping the above in mind, you are to classify the user query into one of the following categories:
+            1. Follow-up query: A query that is a follow-up to the previous conversation and can be answered with existing context.
+            2. New query: A query that is not a follow-up to the previous conversation and requires fetching new data.
+            
+            Analyze this query in the context of the current conversation.
+            
+            last topic: {self.last_query_topic}
+            
+            Latest conversation:
+            {self.conversation_history[-2]['content'] if len(self.conversation_history) >= 2 else "No previous message"}
+            {self.conversation_history[-1]['content'] if len(self.conversation_history) >= 1 else "No previous message"}
+            
+            New query: {query}
+        """
+        return prompt
+
+    def cached_similarity(self, text_a: str, text_b: str) -> Optional[float]:
+        """
+        Cosine similarity of two recent queries, only if both embeddings are already cached.
+
+        Args:
+            text_a (str): The first query.
+            text_b (str): The second query.
+
+        Returns:
+            Optional[float]: The similarity, or None if an embedding is not cached.
+        """
+        vector_a = self.embedding_model.cached_query_vector(text_a)
+        vector_b = self.embedding_model.cached_query_vector(text_b)
+        if vector_a is None or vector_b is None:
+            return None
+        vector_a, vector_b = np.asarray(vector_a), np.asarray(vector_b)
+        return float(vector_a @ vector_b / max(np.linalg.norm(vector_a) * np.linalg.norm(vector_b), 1e-12))
+
+    def classification_texts(self, query: str) -> List[str]:
+        """
+        Texts to embed for the similarity cue of the local classification, when its lexical rules are undecided.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            List[str]: The last topic and the query, empty when the local classifier does not use similarity.
+        """
+        if self.followup_classifier is None or self.followup_classifier.similarity_fn is None:
+            return []
+        return [text for text in (self.last_query_topic, query) if text]
+
+    def embed_for_classification(self, query: str) -> None:
+        """
+        Embed the query and the last topic for the similarity cue of the local classification. 
+        The embeddings are kept in the query cache, so retrieval reuses the query one.
+
+        Args:
+            query (str): The user query.
+        """
+        try:
+            for text in self.classification_texts(query):
+                self.embedding_model.embed_query(text)
+        except Exception as e:
+            print(f"Error embedding the query for classification: {e}")
+
+    async def aembed_for_classification(self, query: str) -> None:
+        """
+        Async variant of 'embed_for_classification', shares the embedding request of the speculative retrieval.
+
+        Args:
+            query (str): The user query.
+        """
+        try:
+            for text in self.classification_texts(query):
+                await self.embedding_model.aembed_query(text)
+        except Exception as e:
+            print(f"Error embedding the query for classification: {e}")
+
     def classify_query(self, query: str) -> Tuple[bool, bool]: 
         """
         Classify the query into follow-up or new query.
@@ -94,45 +452,32 @@ class ChatWithDocs:
         # If no conversation history, it's a new query 
         if not self.conversation_history: 
             return False, True
-        
-        class QueryClassification(BaseModel): 
-            is_followup: bool
-            requires_new_context: bool
+
+        # Decide the easy cases locally
+        if self.followup_classifier is not None:
+            decision = self.followup_classifier.classify(
+                query, self.conversation_history, self.last_query_topic, use_similarity = False
+            )
+            if decision is None:
+                # Only embed when the lexical rules are not enough
+                with self.timer.stage("embedding"):
+                    self.embed_for_classification(query)
+                decision = self.followup_classifier.classify(query, self.conversation_history, self.last_query_topic)
+            if decision is not None:
+                return decision
 
         try: 
-            # Create Query Classification Prompt s
-            prompt = f"""
-                You are part of AI medical chatbot responsible for determining the intent of user queries. 
-                The database from which you answer question contains three things: 
-                    - Medical Reports (Text based) : These are the medical reports of the user. (and their summaries)
-                    - Medical Images (MRIs, Chest X-rays, etc.) findings: These are the findings from the medical images of the user. 
-                    - Medicine data : These are the data about the medicines prescribed to the user. (Side effects, dosage, how to use, etc.)
-                    - Medicine links : These are buying links for the medicine
-
-                Keeping the above in mind, you are to classify the user query into one of the following categories:
-                1. Follow-up query: A query that is a follow-up to the previous conversation and can be answered with existing context.
-                2. New query: A query that is not a follow-up to the previous conversation and requires fetching new data.
-                
-                Analyze this query in the context of the current conversation.
-                
-                last topic: {self.last_query_topic}
-                
-                Latest conversation:
-                {self.conversation_history[-2]['content'] if len(self.conversation_history) >= 2 else "No previous message"}
-                {self.conversation_history[-1]['content'] if len(self.conversation_history) >= 1 else "No previous message"}
-                
-                New query: {query}
-            """
             classification = self.llm.beta.chat.completions.parse(
                 model = "gpt-4o-mini",
                 messages = [
                     {
                         "role": "user", 
-                        "content": prompt
+                        "content": self.create_classification_prompt(query)
                     }
                 ],
                 response_format = QueryClassification
             ) 
+            self.timer.add_usage(classification.usage)
             is_followup = json.loads(classification.choices[0].message.content)["is_followup"]
             requires_new_context = json.loads(classification.choices[0].message.content)["requires_new_context"]
             return is_followup, requires_new_context
@@ -141,78 +486,471 @@ class ChatWithDocs:
             print(e)
             return False, True
 
-    def intent(self, query: str) -> str:
+    async def aclassify_query(self, query: str) -> Tuple[bool, bool]: 
         """
-        Method to handle the intent of the user query and generate response using 'chat' method.
+        Async variant of 'classify_query'.
 
         Args:
             query (str): The user query.
 
         Returns:
-            str: The generated response. 
+            Tuple[bool, bool]: is_followup and requires_new_context, see 'classify_query'.
         """
         assert isinstance(query, str), "Query must be a string"
 
-        is_followup, requires_new_context = self.classify_query(query)
+        # If no conversation history, it's a new query 
+        if not self.conversation_history: 
+            return False, True
+
+        # Decide the easy cases locally
+        if self.followup_classifier is not None:
+            decision = self.followup_classifier.classify(
+                query, self.conversation_history, self.last_query_topic, use_similarity = False
+            )
+            if decision is None:
+                # Only embed when the lexical rules are not enough
+                with self.timer.stage("embedding"):
+                    await self.aembed_for_classification(query)
+                decision = self.followup_classifier.classify(query, self.conversation_history, self.last_query_topic)
+            if decision is not None:
+                return decision
+
+        try: 
+            classification = await self.allm.beta.chat.completions.parse(
+                model = "gpt-4o-mini",
+                messages = [
+                    {
+                        "role": "user", 
+                        "content": self.create_classification_prompt(query)
+                    }
+                ],
+                response_format = QueryClassification
+            ) 
+            self.timer.add_usage(classification.usage)
+            parsed = json.loads(classification.choices[0].message.content)
+            return parsed["is_followup"], parsed["requires_new_context"]
+
+        except Exception as e:
+            print(e)
+            return False, True
+
+    def build_prompt(self, query: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Classify the query, fetch new context if needed and build the prompt for the LLM.
+        The answer cache is looked up right after retrieval, a hit skips the prompt (and its history summary).
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: The prompt to send to the LLM, None on an answer cache hit,
+                and the cached answer, None on a miss.
+        """
+        self.answer_cache_key = None
+        with self.timer.stage("classify"):
+            is_followup, requires_new_context = self.classify_query(query)
 
         try:
             if not is_followup or requires_new_context:
                 print(":: Fetching new context 🔍 ::")
+                self.timer.fields["turn"] = "new_context"
                 # New context has to be fetched
                 new_context = self.run_retriever(query)
                 self.current_context = new_context
                 self.last_query_topic = query
+                self.answer_cache_key = self.create_answer_cache_key(query)
+                response = self.lookup_answer()
+                if response is not None:
+                    return None, response
 
-                prompt = rag_prompt.format(query = query, context = self.current_context, history = self.conversation_history)
-
-                response = self.chat(
-                    prompt_temp = prompt
-                )
+                with self.timer.stage("prompt"):
+                    return self.build_rag_prompt(query), None
             else: 
                 print(":: Follow up querying ⤴️ ::")
+                self.timer.fields["turn"] = "followup"
                 # Use existing context
-                prompt = self.create_followup_prompt(query)
-
-                response = self.chat(
-                    prompt_temp = prompt
-                )
+                with self.timer.stage("prompt"):
+                    return self.create_followup_prompt(query), None
         except Exception as e:
             print(e)
-            raise exception(f"Error in intent method: {e}")
+            raise Exception(f"Error in intent method: {e}")
 
-        # Update conversation history
+    def create_answer_cache_key(self, query: str) -> Optional[Tuple[List[float], str]]:
+        """
+        Create the answer cache key of the current turn from the query embedding and a hash of everything else
+        the answer is generated from: the retrieved context, the conversation (history and its summary)
+        and the patient. Sessions of other patients or with another conversation never share an answer.
+        The query embedding is only taken from the in-memory cache, no embedding call is made.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            Optional[Tuple[List[float], str]]: The query embedding and prompt inputs hash, or None.
+        """
+        if self.answer_cache is None:
+            return None
+        query_vector = self.embedding_model.cached_query_vector(query)
+        if query_vector is None:
+            return None
+        prompt_inputs = json.dumps({
+            "patient_id": self.patient_id,
+            "history": self.conversation_history,
+            "summary": self.history_summary,
+            "context": self.current_context,
+        })
+        return query_vector, content_hash(prompt_inputs)
+
+    def lookup_answer(self) -> Optional[str]:
+        """
+        Look up a cached answer for the current turn.
+
+        Returns:
+            Optional[str]: The cached answer, or None.
+        """
+        if self.answer_cache is None or self.answer_cache_key is None:
+            return None
+        query_vector, inputs_hash = self.answer_cache_key
+        response = self.answer_cache.lookup(query_vector, inputs_hash, self.model)
+        if response is not None:
+            print(":: Answer found in cache ⚡ ::")
+        return response
+
+    def store_answer(self, response: str) -> None:
+        """
+        Cache the answer of the current turn, if it was generated for new context.
+
+        Args:
+            response (str): The generated response.
+        """
+        if self.answer_cache is None or self.answer_cache_key is None:
+            return
+        query_vector, inputs_hash = self.answer_cache_key
+        self.answer_cache.store(query_vector, inputs_hash, self.model, response)
+
+    def update_history(self, query: str, response: str) -> None:
+        """
+        Record a finished exchange in the conversation state.
+
+        Args:
+            query (str): The user query.
+            response (str): The generated response.
+        """
         self.conversation_history.append({"role": "user", "content": query})
         self.conversation_history.append({"role": "assistant", "content": response})
         self.last_query_topic = query
 
+    def intent(self, query: str) -> str:
+        """
+        Method to handle the intent of the user query and generate response using 'chat' method.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            str: The generated response. 
+        """
+        assert isinstance(query, str), "Query must be a string"
+
+        self.timer = TurnTimer(self.turn_hooks)
+        prompt, response = self.build_prompt(query)
+        cache_hit = response is not None
+        try:
+            if not cache_hit:
+                with self.timer.stage("generation"):
+                    response = self.chat(
+                        prompt_temp = prompt
+                    )
+                self.store_answer(response)
+        except Exception as e:
+            print(e)
+            raise Exception(f"Error in intent method: {e}")
+
+        # Update conversation history
+        self.update_history(query, response)
+        self.turn_stats = self.timer.finish(answer_cache_hit = cache_hit)
+
+        return response 
+
+    def intent_stream(self, query: str) -> Iterator[str]:
+        """
+        Streaming variant of 'intent', yields the response tokens as they arrive.
+        The assembled response is added to the conversation history once the stream finishes.
+
+        Args:
+            query (str): The user query.
+
+        Yields:
+            str: The next piece of the generated response.
+        """
+        assert isinstance(query, str), "Query must be a string"
+
+        self.timer = TurnTimer(self.turn_hooks)
+        prompt, response = self.build_prompt(query)
+        cache_hit = response is not None
+        if cache_hit:
+            self.stream_stats = {"time_to_first_token": 0.0, "total_time": 0.0}
+            yield response
+        else:
+            parts = []
+            for token in self.chat_stream(prompt_temp = prompt):
+                parts.append(token)
+                yield token
+            response = "".join(parts)
+            self.store_answer(response)
+
+        # Update conversation history
+        self.update_history(query, response)
+        self.turn_stats = self.timer.finish(answer_cache_hit = cache_hit)
+
+    async def aintent(self, query: str) -> str:
+        """
+        Async variant of 'intent'.
+        Retrieval starts speculatively while the query is being classified, and is thrown away 
+        if the query turns out to be a follow-up. When the lexical rules of the local classification are
+        undecided, it shares the query embedding request of the speculative retrieval.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            str: The generated response. 
+        """
+        assert isinstance(query, str), "Query must be a string"
+
+        self.answer_cache_key = None
+        self.timer = TurnTimer(self.turn_hooks)
+        retrieval = asyncio.create_task(self.arun_retriever(query))
+        try:
+            with self.timer.stage("classify"):
+                is_followup, requires_new_context = await self.aclassify_query(query)
+
+            if not is_followup or requires_new_context:
+                print(":: Fetching new context 🔍 ::")
+                self.timer.fields["turn"] = "new_context"
+                # New context has to be fetched
+                self.current_context = await retrieval
+                self.last_query_topic = query
+                self.answer_cache_key = self.create_answer_cache_key(query)
+                # A cached answer needs no prompt, nor the history summary it may call the LLM for
+                response = self.lookup_answer()
+                if response is None:
+                    with self.timer.stage("prompt"):
+                        prompt = await asyncio.to_thread(self.build_rag_prompt, query)
+            else: 
+                print(":: Follow up querying ⤴️ ::")
+                self.timer.fields["turn"] = "followup"
+                # Use existing context
+                response = None
+                with self.timer.stage("prompt"):
+                    prompt = self.create_followup_prompt(query)
+
+            cache_hit = response is not None
+            if not cache_hit:
+                with self.timer.stage("generation"):
+                    response = await self.achat(
+                        prompt_temp = prompt
+                    )
+                self.store_answer(response)
+        except Exception as e:
+            print(e)
+            raise Exception(f"Error in aintent method: {e}")
+        finally:
+            if not retrieval.done():
+                retrieval.cancel()
+            elif not retrieval.cancelled():
+                retrieval.exception() # Mark a failed speculative retrieval as handled
+
+        # Update conversation history
+        self.update_history(query, response)
+        self.turn_stats = self.timer.finish(answer_cache_hit = cache_hit)
+
         return response 
 
     def build_context(self) -> list: 
         """
-        Updates the context by reading the data from the file and converting it into langchain documents.
+        Updates the context with the records appended to the data file and returns it as langchain documents.
 
         Returns:
             list: A list of langchain documents.
         """
         try:
-            with open("data.txt", "r") as f:
-                context = f.read()
-            # Process Context    
-            chunks = context.split(">>>>")
-            # if any element in this list is empty string, remove it 
-            chunks = [chunk for chunk in chunks if chunk != '']
-            # if any element in this list is None, remove it
-            chunks = [chunk for chunk in chunks if chunk is not None]
-            # Convert to langchain documents 
-            chunk_docs = [Document(page_content=chunk) for chunk in chunks]
-            return chunk_docs
-        except FileNotFoundError:
-            print("data.txt not found")
-            return []
+            self.refresh_index()
+            return list(self.documents.values())
         except Exception as e:
             print(f"Error building context: {e}")
             return []
+
+    def refresh_index(self) -> None:
+        """
+        Ingest the records appended to the data file since the last call and update the indexes.
+        Only new records are parsed, hashed, embedded (unless cached on disk) and indexed.
+        The chunks are embedded without holding the index lock, the other sessions keep searching meanwhile.
+        """
+        with self.index_lock:
+            changed, removed, reset = self.ingestor.poll()
+            if changed or removed:
+                self._apply_changes(changed, removed, reset)
+            elif len(self.vector_index) >= len(self.documents) or time.monotonic() < self.embed_retry["at"]:
+                return
+            # New chunks, or chunks whose embedding failed earlier
+            new_ids = [
+                doc_id for doc_id in self.documents 
+                if doc_id not in self.vector_index and doc_id not in self.embedding_ids
+            ]
+            texts = [self.documents[doc_id].page_content for doc_id in new_ids]
+            self.embedding_ids.update(new_ids)
+        self._embed_missing(new_ids, texts)
+
+    def _apply_changes(self, changed: List[Tuple[int, str]], removed: List[int], reset: bool) -> None:
+        self.vector_index.reload_if_changed()
+
+        # Re-chunk only the changed records, and the ones after them whose patient changed
+        records = self.attribute_patients(changed, removed)
+
+        # Forget the chunks of the records that were removed or are re-chunked
+        stale_ids = set()
+        for offset in removed + [offset for offset, _, _ in records]:
+            stale_ids.update(self.record_ids.pop(offset, []))
+
+        new_docs = {}
+        for offset, text, patient_id in records:
+            chunks = self.chunker.chunk_record(text, record_offset = offset, patient_id = patient_id)
+            if not chunks:
+                continue
+            self.record_ids[offset] = [self.chunk_id(doc) for doc in chunks]
+            new_docs.update(zip(self.record_ids[offset], chunks))
+        stale_ids -= {doc_id for doc_ids in self.record_ids.values() for doc_id in doc_ids}
+
+        # After a full read, also drop what a previous run left in the persisted index
+        if reset or self.record_ids.keys() <= {offset for offset, _, _ in records}:
+            stale_ids |= {doc_id for doc_id in self.vector_index.ids if doc_id not in new_docs}
+
+        # Updated in place, the dicts are shared with forked sessions
+        for doc_id in stale_ids:
+            self.documents.pop(doc_id, None)
+            self.lexical_index.remove(doc_id)
+            self.metadata_index.remove(doc_id)
+        if stale_ids:
+            self.vector_index.remove(list(stale_ids))
+
+        for doc_id, doc in new_docs.items():
+            self.documents[doc_id] = doc
+            self.lexical_index.add(doc_id, doc.page_content)
+            self.metadata_index.add(doc_id, doc.metadata)
+
+        # Let the embedding cache drop the old versions of the re-chunked records
+        if stale_ids:
+            self.embedding_model.retain({content_hash(doc.page_content) for doc in self.documents.values()})
+
+        # Update the clusters of the removed rows now rather than on the next query
+        if self.use_ann():
+            self.ann_index.sync()
+
+        if self.answer_cache is not None:
+            self.answer_cache.set_corpus_version(self.ingestor.version)
             
+    def attribute_patients(
+        self, 
+        changed: List[Tuple[int, str]], 
+        removed: List[int]
+    ) -> List[Tuple[int, str, Optional[str]]]:
+        """
+        Attribute the records to patients: a record belongs to the patient it names, else to the patient named 
+        by the closest preceding record (e.g. the summary and image findings after a report), else to the 
+        patient of the data file. Must be called with the index lock held.
+
+        Args:
+            changed (List[Tuple[int, str]]): (byte offset, text) of the new or changed records.
+            removed (List[int]): Byte offsets of the removed records.
+
+        Returns:
+            List[Tuple[int, str, Optional[str]]]: (byte offset, text, patient) of the records to re-chunk: 
+                the changed ones and the ones whose attribution changed with them.
+        """
+        for offset in removed:
+            self.named_patients.pop(offset, None)
+            self.record_patients.pop(offset, None)
+        changed_texts = dict(changed)
+        for offset, text in changed:
+            self.named_patients[offset] = detect_patient_id(text)
+
+        records = []
+        patient_id = self.ingestor.patient_id
+        for offset in sorted(self.named_patients):
+            patient_id = self.named_patients[offset] or patient_id
+            if offset in changed_texts:
+                records.append((offset, changed_texts[offset], patient_id))
+            elif self.record_patients.get(offset) != patient_id and offset in self.ingestor.records:
+                records.append((offset, self.ingestor.records[offset], patient_id))
+            self.record_patients[offset] = patient_id
+        return records
+
+    def _embed_missing(self, new_ids: List[str], texts: List[str]) -> None:
+        """
+        Embed chunks that are not in the vector index yet and index them. Must be called without the index lock,
+        with the chunk ids claimed in `embedding_ids`.
+        If the embedding backend fails, the chunks are only searched by keywords until the retry,
+        `embed_retry_interval` seconds later.
+
+        Args:
+            new_ids (List[str]): The chunk ids.
+            texts (List[str]): The chunk contents.
+        """
+        if not new_ids:
+            return
+        try:
+            vectors = self.embedding_model.embed_documents(texts)
+        except Exception as e:
+            print(f"Error embedding {len(new_ids)} chunks, searching them by keywords only for now: {e}")
+            self.embed_retry["at"] = time.monotonic() + self.embed_retry_interval
+            with self.index_lock:
+                self.embedding_ids.difference_update(new_ids)
+            return
+
+        with self.index_lock:
+            self.embedding_ids.difference_update(new_ids)
+            # Skip the chunks whose record changed while they were embedded
+            keep = [i for i, doc_id in enumerate(new_ids) if doc_id in self.documents]
+            self.vector_index.add([new_ids[i] for i in keep], [vectors[i] for i in keep])
+            # Update the clusters now rather than on the next query
+            if self.use_ann():
+                self.ann_index.sync()
+        pipeline = self.embedding_model.embeddings
+        if isinstance(pipeline, EmbeddingPipeline):
+            print(f"Indexed {len(new_ids)} chunks, embedding throughput {pipeline.chunks_per_second:.1f} chunks/s")
+
+    @staticmethod
+    def chunk_id(doc: Document) -> str:
+        """
+        Id of a chunk in the indexes: the hash of its content, and of its patient for patient records, 
+        so that identical text in the records of two patients stays in both partitions.
+
+        Args:
+            doc (Document): The chunk.
+
+        Returns:
+            str: The chunk id.
+        """
+        patient_id = doc.metadata.get("patient_id")
+        if patient_id is None:
+            return content_hash(doc.page_content)
+        return content_hash(f"{patient_id}\n{doc.page_content}")
+
+    def allowed_ids(self, query: str) -> Optional[set]:
+        """
+        Chunk ids the query may search: the patient's partition, narrowed to the record types of the query.
+        Must be called with the index lock held.
+
+        Args:
+            query (str): The user query.
+
+        Returns:
+            Optional[set]: The allowed chunk ids, None to search every chunk.
+        """
+        record_types = route_record_types(query) if self.route_queries and query else None
+        return self.metadata_index.filter(self.patient_id, record_types)
+
     def run_retriever(self, query: str) -> str:
         """
         Run the retriever to get the relevant context for the given query.
@@ -226,22 +964,198 @@ class ChatWithDocs:
         assert isinstance(query, str), "Query must be a string"
 
         # Get context 
-        chunk_docs = self.build_context()
-        if not chunk_docs: 
+        with self.timer.stage("build_context"):
+            self.refresh_index()
+        if not self.documents: 
+            return "No context yet. Please upload medical reports or prescription to get started."
+
+        # Answer from the inverted index alone when possible
+        with self.timer.stage("search"):
+            lexical_context = self.search_lexical_context(query)
+        if lexical_context is not None:
+            return lexical_context
+
+        # Get relevant documents
+        try:
+            with self.timer.stage("embedding"):
+                query_vector = self.embedding_model.embed_query(query)
+        except Exception as e:
+            print(f"Error embedding the query, falling back to keyword search: {e}")
+            with self.timer.stage("search"):
+                return self.search_lexical_context(query, fallback = True)
+        with self.timer.stage("search"):
+            return self.search_context(query_vector, query)
+
+    async def arun_retriever(self, query: str) -> str:
+        """
+        Async variant of 'run_retriever'. File reading, index updates and searches run in worker threads,
+        so the event loop never waits for the index lock (held by 'refresh_index' while records are indexed),
+        the query is embedded with the async embedding client.
+
+        Args: 
+            query (str): The user query.
+            
+        Returns:
+            combined_context (str): The combined context from the retrieved documents. 
+        """
+        assert isinstance(query, str), "Query must be a string"
+
+        # Get context 
+        with self.timer.stage("build_context"):
+            await asyncio.to_thread(self.refresh_index)
+        if not self.documents: 
             return "No context yet. Please upload medical reports or prescription to get started."
-        store = self.vector_store.from_documents(chunk_docs, self.embedding_model)
 
-        # Build retriever 
-        retriever = store.as_retriever(search_kwargs={"k": self.top_k})
+        # Answer from the inverted index alone when possible
+        with self.timer.stage("search"):
+            lexical_context = await asyncio.to_thread(self.search_lexical_context, query)
+        if lexical_context is not None:
+            return lexical_context
 
         # Get relevant documents
-        retrieved_docs = retriever.invoke(query)
+        try:
+            with self.timer.stage("embedding"):
+                query_vector = await self.embedding_model.aembed_query(query)
+        except Exception as e:
+            print(f"Error embedding the query, falling back to keyword search: {e}")
+            with self.timer.stage("search"):
+                return await asyncio.to_thread(self.search_lexical_context, query, fallback = True)
+        with self.timer.stage("search"):
+            return await asyncio.to_thread(self.search_context, query_vector, query)
+
+    def combine_documents(self, doc_ids: List[str]) -> str:
+        """
+        Combine the retrieved documents into a single context.
+
+        Args:
+            doc_ids (List[str]): Ids of the retrieved documents, best first.
+
+        Returns:
+            combined_context (str): The combined context from the retrieved documents. 
+        """
+        retrieved_docs = [self.documents[doc_id] for doc_id in doc_ids if doc_id in self.documents]
         # Combine documents
         combined_docs = [doc.page_content for doc in retrieved_docs]
         combined_context = "\n".join(combined_docs)
 
         return combined_context
 
+    def search_lexical_context(self, query: str, fallback: bool = False) -> Optional[str]:
+        """
+        Search the inverted index, without any network call.
+        In hybrid mode a result is only returned when the lexical match is strong.
+
+        Args:
+            query (str): The user query.
+            fallback (bool): Always return the best lexical matches, e.g. when the query cannot be embedded.
+
+        Returns:
+            Optional[str]: The combined context, or None if embedding search is needed.
+        """
+        if self.retrieval_mode == "dense" and not fallback:
+            return None
+
+        with self.index_lock:
+            self.vector_index.reload_if_changed() # For the vectors of the re-ranking
+            hits = self.lexical_index.search(query, k = self.fetch_k, allowed = self.allowed_ids(query))
+            if self.retrieval_mode == "hybrid" and not fallback:
+                if not hits or self.lexical_index.coverage(query, hits[0][0]) < self.lexical_coverage:
+                    return None
+                print(":: Strong keyword match, skipping embeddings 🔑 ::")
+            ids = [doc_id for doc_id, _ in hits]
+            scores = normalize_scores(np.asarray([score for _, score in hits], dtype=np.float32))
+            return self.combine_documents(self.select_documents(ids, scores))
+
+    def search_context(self, query_vector: List[float], query: Optional[str] = None) -> str:
+        """
+        Search the vector index and combine the top documents into a single context.
+        In hybrid mode the embedding scores are fused with the BM25 scores of the query.
+        Only the rows the query may search are scored, see 'allowed_ids', and with the ANN index only the 
+        candidate rows of the closest clusters.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            query (str): The user query, needed for hybrid search.
+
+        Returns:
+            combined_context (str): The combined context from the retrieved documents. 
+        """
+        with self.index_lock:
+            # Rows added by other processes sharing the index files
+            self.vector_index.reload_if_changed()
+            if not len(self.vector_index):
+                return self.combine_documents([])
+
+            # Only the rows of the patient / record type partition, else of the closest clusters with the ANN index,
+            # else every row
+            allowed = self.allowed_ids(query)
+            if allowed is not None:
+                rows = self.metadata_index.rows(allowed, self.vector_index.rows)
+            elif self.use_ann():
+                rows = self.ann_index.candidate_rows(query_vector)
+            else:
+                rows = None
+            self.timer.fields["scanned_chunks"] = len(self.vector_index) if rows is None else len(rows)
+            ids = self.vector_index.ids if rows is None else [self.vector_index.ids[row] for row in rows]
+            scores = self.vector_index.scores(query_vector, rows)
+            if self.retrieval_mode == "hybrid" and query:
+                scores = fuse_scores(
+                    scores, 
+                    self.lexical_index.score_array(query, ids, allowed), 
+                    alpha = self.hybrid_alpha
+                )
+            candidates = top_k_rows(scores, self.fetch_k)
+            doc_ids = self.select_documents([ids[i] for i in candidates], scores[candidates])
+            return self.combine_documents(doc_ids)
+
+    def select_documents(self, doc_ids: List[str], scores: np.ndarray) -> List[str]:
+        """
+        Pick the chunks of the context among the candidates, see mmr_select.
+        Must be called with the index lock held.
+
+        Args:
+            doc_ids (List[str]): The candidate chunk ids, best first.
+            scores (np.ndarray): Relevance of every candidate.
+
+        Returns:
+            List[str]: The selected chunk ids, in selection order.
+        """
+        keep = [i for i, doc_id in enumerate(doc_ids) if doc_id in self.documents]
+        doc_ids = [doc_ids[i] for i in keep]
+        scores = np.asarray(scores, dtype=np.float32)[keep]
+        if self.mmr_lambda is None and self.context_token_budget is None:
+            return doc_ids[:self.top_k]
+
+        # Chunks missing from the vector index (e.g. keyword-only in degraded mode) are never redundant
+        dim = self.vector_index.matrix.shape[1] if len(self.vector_index) else 1
+        vectors = np.zeros((len(doc_ids), dim), dtype=np.float32)
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id in self.vector_index:
+                vectors[i] = self.vector_index.matrix[self.vector_index.rows[doc_id]]
+        token_counts = np.asarray([
+            self.documents[doc_id].metadata.get("tokens") or self.prompt_builder.counter.count(self.documents[doc_id].page_content)
+            for doc_id in doc_ids
+        ])
+        selected = mmr_select(
+            vectors,
+            scores,
+            token_counts,
+            token_budget = self.context_token_budget,
+            max_items = None if self.context_token_budget else self.top_k,
+            lambda_mult = 1.0 if self.mmr_lambda is None else self.mmr_lambda
+        )
+        self.timer.fields["context_tokens"] = int(token_counts[selected].sum()) if selected else 0
+        return [doc_ids[i] for i in selected]
+
+    def use_ann(self) -> bool:
+        """
+        Whether searches go through the approximate index.
+
+        Returns:
+            bool: True with the ivf backend, or with the auto backend once the index is large enough.
+        """
+        return self.ann_index is not None and len(self.vector_index) >= self.ann_threshold
+
     def chat(
         self, 
         prompt_temp: str
@@ -264,15 +1178,75 @@ class ChatWithDocs:
                 }
             ]
         )
+        self.timer.add_usage(response.usage)
         return response.choices[0].message.content
-        
-        
 
+    async def achat(
+        self, 
+        prompt_temp: str
+    ) -> str:  
+        """
+        Async variant of 'chat'.
 
+        Args:
+            prompt_temp (str): The prompt template.
 
+        Returns:
+            str: The generated response. 
+        """
+        response = await self.allm.chat.completions.create(
+            model = self.model,
+            messages = [
+                {
+                    "role": "user", 
+                    "content": prompt_temp
+                }
+            ]
+        )
+        self.timer.add_usage(response.usage)
+        return response.choices[0].message.content
 
+    def chat_stream(
+        self, 
+        prompt_temp: str
+    ) -> Iterator[str]:
+        """
+        Streaming variant of 'chat', yields the response tokens as they arrive.
+        Time to first token and total time (in seconds) are stored in `self.stream_stats`.
 
+        Args:
+            prompt_temp (str): The prompt template.
 
+        Yields:
+            str: The next piece of the generated response.
+        """
+        start = time.perf_counter()
+        self.stream_stats = {"time_to_first_token": None, "total_time": None}
 
+        stream = self.llm.chat.completions.create(
+            model = self.model,
+            messages = [
+                {
+                    "role": "user", 
+                    "content": prompt_temp
+                }
+            ],
+            stream = True,
+            stream_options = {"include_usage": True}
+        )
+        for chunk in stream:
+            # The last chunk only carries the token usage
+            if getattr(chunk, "usage", None) is not None:
+                self.timer.add_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if not token:
+                continue
+            if self.stream_stats["time_to_first_token"] is None:
+                self.stream_stats["time_to_first_token"] = time.perf_counter() - start
+                self.timer.record("time_to_first_token", self.stream_stats["time_to_first_token"])
+            yield token
 
-     
+        self.stream_stats["total_time"] = time.perf_counter() - start
+        self.timer.record("generation", self.stream_stats["total_time"])
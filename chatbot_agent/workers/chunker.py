@@ -0,0 +1,183 @@
+"""
+Structure-aware chunker for the records of the chatbot data file.
+A record can be a whole multi-page report, so it is split on headings and kept line (table row) aligned,
+then packed into token-sized windows with overlap. The first line of a record (the questions it answers
+and its title) is repeated in every chunk, and each chunk records its source offset, record type and
+patient: the one the record names ("Patient ID: ..." or "MRN: ..."), else the one it is attributed to
+by the caller, e.g. the patient of the preceding report, whose prescription the medicine records are about.
+Records are chunked independently, so a changed record can be re-chunked without touching the rest.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from prompt_builder import TokenCounter
+
+
+# Numbered, markdown or "Title:" style heading lines
+HEADING_PATTERN = re.compile(r"^\s*(#{1,6}\s+\S.*|\d+[.)]\s+\S.{0,80}:\s*|[A-Z][^\n:]{0,80}:\s*)$")
+
+# Record types, checked in order against the beginning of the record
+RECORD_TYPES = [
+    ("medicine_prices", ["prices of medicines", "cost of medicines", "where to buy"]),
+    ("medicine_data", ["all information about", "medication_name"]),
+    ("image_finding", ["x ray", "x-ray", "xray", "mri", "ct scan", "medical image"]),
+    ("report_summary", ["summarized report", "summary of the report"]),
+    ("report", ["original report", "report"]),
+]
+
+# Patient identifier of a record, agents writing patient data tag records with a "Patient ID:" line
+PATIENT_PATTERN = re.compile(r"\b(?:patient[ _-]?id|mrn)\s*[:#]\s*([A-Za-z0-9][A-Za-z0-9_\-]*)", re.IGNORECASE)
+
+
+def detect_record_type(text: str) -> str:
+    """
+    Detect the type of a data file record from its first lines.
+
+    Args:
+        text (str): The record text.
+
+    Returns:
+        str: One of the RECORD_TYPES names, or "other".
+    """
+    head = text[:300].lower()
+    for record_type, keywords in RECORD_TYPES:
+        if any(keyword in head for keyword in keywords):
+            return record_type
+    return "other"
+
+
+def detect_patient_id(text: str) -> Optional[str]:
+    """
+    Find the patient identifier of a data file record.
+
+    Args:
+        text (str): The record text.
+
+    Returns:
+        Optional[str]: The patient identifier, None if the record names no patient.
+    """
+    match = PATIENT_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+class StructuredChunker:
+    """Splits records on headings and lines into overlapping token windows."""
+
+    def __init__(self, counter: TokenCounter, chunk_tokens: int = 256, overlap_tokens: int = 32) -> None:
+        """
+        Initialize the chunker.
+
+        Args:
+            counter (TokenCounter): Token counter used to size the windows.
+            chunk_tokens (int): Maximum number of tokens of a chunk body.
+            overlap_tokens (int): Number of tokens repeated from the end of the previous chunk.
+        """
+        assert overlap_tokens < chunk_tokens, "overlap_tokens must be smaller than chunk_tokens"
+        self.counter = counter
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _units(self, text: str, start: int) -> List[Tuple[int, int, int, bool]]:
+        """
+        Split a text into lines, the smallest units a chunk is made of.
+        Lines longer than a window are split further.
+
+        Args:
+            text (str): The text.
+            start (int): Character offset of the text in the record.
+
+        Returns:
+            List[Tuple[int, int, int, bool]]: (start, end, tokens, is_heading) per unit.
+        """
+        units = []
+        for match in re.finditer(r"[^\n]*\n?", text):
+            line = match.group()
+            if not line.strip():
+                continue
+            line_start = start + match.start()
+            tokens = self.counter.count(line)
+            if tokens <= self.chunk_tokens:
+                units.append((line_start, line_start + len(line), tokens, bool(HEADING_PATTERN.match(line.rstrip("\n")))))
+                continue
+            # Split an oversized line into pieces of about chunk_tokens tokens
+            piece_chars = max(len(line) * self.chunk_tokens // tokens, 1)
+            for piece_start in range(0, len(line), piece_chars):
+                piece = line[piece_start:piece_start + piece_chars]
+                units.append((line_start + piece_start, line_start + piece_start + len(piece), self.counter.count(piece), False))
+        return units
+
+    def chunk_record(self, text: str, record_offset: int = 0, patient_id: Optional[str] = None) -> List[Document]:
+        """
+        Chunk a single record.
+
+        Args:
+            text (str): The record text.
+            record_offset (int): Byte offset of the record in the data file.
+            patient_id (str): Patient of the record if it names none.
+
+        Returns:
+            List[Document]: The chunks, with `offset`, `start`, `end` (character positions in the record),
+                `record_type`, `patient_id`, `chunk` and `tokens` (token count of the chunk) metadata.
+        """
+        lead = len(text) - len(text.lstrip())
+        text = text.strip()
+        if not text:
+            return []
+        record_type = detect_record_type(text)
+        patient_id = detect_patient_id(text) or patient_id
+
+        # The first line (questions answered by the record and its title) is repeated in every chunk
+        header, _, body = text.partition("\n")
+        body_start = len(header) + 1
+        units = self._units(body, body_start)
+        if not units:
+            units = [(0, len(header), self.counter.count(header), False)]
+            header = ""
+
+        windows = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            _, _, tokens, is_heading = unit
+            # Start a new chunk at a heading, or when the window is full
+            starts_section = is_heading and current_tokens >= self.chunk_tokens // 4
+            if current and (current_tokens + tokens > self.chunk_tokens or starts_section):
+                windows.append(current)
+                # Carry the last lines over, unless a new section starts
+                overlap = []
+                if not starts_section:
+                    overlap_tokens = 0
+                    for previous in reversed(current):
+                        if overlap_tokens + previous[2] > self.overlap_tokens:
+                            break
+                        overlap.insert(0, previous)
+                        overlap_tokens += previous[2]
+                current = overlap
+                current_tokens = sum(previous[2] for previous in overlap)
+            current.append(unit)
+            current_tokens += tokens
+        if current:
+            windows.append(current)
+
+        chunks = []
+        for index, window in enumerate(windows):
+            start, end = window[0][0], window[-1][1]
+            content = text[start:end].strip()
+            if header:
+                content = f"{header.strip()}\n{content}"
+            chunks.append(Document(
+                page_content = content,
+                metadata = {
+                    "offset": record_offset,
+                    "start": lead + start,
+                    "end": lead + end,
+                    "record_type": record_type,
+                    "patient_id": patient_id,
+                    "chunk": index,
+                    "tokens": self.counter.count(content)
+                }
+            ))
+        return chunks
@@ -0,0 +1,110 @@
+"""
+Embedding backends of the chat worker.
+"openai" embeds through the OpenAI API (see EmbeddingPipeline), "local" is a deterministic hashed
+character n-gram embedding computed in process, without network or model download, for offline runs,
+CI benchmarks and low-cost deployments.
+The two backends produce different vector spaces, an index built with one cannot be searched with the other.
+"""
+
+import math, re, zlib
+from collections import Counter
+from typing import Any, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_pipeline import EmbeddingPipeline
+
+
+EMBEDDING_BACKENDS = ("openai", "local")
+
+
+class LocalHashingEmbeddings(Embeddings):
+    """
+    Hashed character n-gram embeddings.
+    Every n-gram of the normalised words is hashed (crc32, stable across processes) to one of `dim`
+    signed buckets, weighted by its sublinear term frequency, and the vector is L2-normalised.
+    There is no corpus-dependent IDF, so a text always gets the same vector and cached embeddings stay valid.
+    """
+
+    def __init__(self, dim: int = 512, min_n: int = 3, max_n: int = 5) -> None:
+        """
+        Initialize the embeddings.
+
+        Args:
+            dim (int): Dimension of the vectors.
+            min_n (int): Shortest n-gram length.
+            max_n (int): Longest n-gram length.
+        """
+        self.dim = dim
+        self.min_n = min_n
+        self.max_n = max_n
+        # Part of the cache and index keys, vectors of other settings are not comparable
+        self.model = f"local-hashing-{dim}-{min_n}-{max_n}"
+
+    def _ngrams(self, text: str) -> Counter:
+        counts = Counter()
+        for word in re.findall(r"\w+", text.lower()):
+            word = f"<{word}>"
+            for n in range(self.min_n, self.max_n + 1):
+                for start in range(max(len(word) - n + 1, 1)):
+                    counts[word[start:start + n]] += 1
+        return counts
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for ngram, count in self._ngrams(text).items():
+            bucket = zlib.crc32(ngram.encode("utf-8"))
+            # The top bit picks the sign, so that collisions cancel out instead of adding up
+            sign = -1.0 if bucket & 0x80000000 else 1.0
+            vector[bucket % self.dim] += sign * (1 + math.log(count))
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents.
+
+        Args:
+            texts (List[str]): The documents to embed.
+
+        Returns:
+            List[List[float]]: One embedding vector per document.
+        """
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        return self._embed(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def make_embeddings(backend: str = "openai", model: str = "text-embedding-3-small", **kwargs: Any) -> Embeddings:
+    """
+    Create the embeddings of a backend. The name of the vector space is in the `model` attribute.
+
+    Args:
+        backend (str): "openai" or "local".
+        model (str): The OpenAI embedding model, ignored by the local backend.
+        **kwargs: Options of the backend class, see EmbeddingPipeline and LocalHashingEmbeddings.
+
+    Returns:
+        Embeddings: The embeddings.
+    """
+    if backend == "openai":
+        return EmbeddingPipeline(model = model, **kwargs)
+    if backend == "local":
+        return LocalHashingEmbeddings(**kwargs)
+    raise ValueError(f"Unknown embedding backend {backend}, expected one of {', '.join(EMBEDDING_BACKENDS)}")
@@ -0,0 +1,232 @@
+"""
+Batched embedding pipeline for the chat worker.
+Packs the chunks to embed into batches bounded by a token and an input count, and sends a bounded
+number of batches concurrently. A batch that is rate limited (429) waits for the Retry-After delay
+(or an exponential backoff with jitter) and is retried, while the other batches stay in flight.
+"""
+
+import os, time, random
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+from langchain_core.embeddings import Embeddings
+
+from prompt_builder import TokenCounter
+
+
+# Errors worth retrying, the others (bad request, authentication) fail the batch right away
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Read the delay requested by the API in the Retry-After headers of an error.
+
+    Args:
+        error (Exception): The API error.
+
+    Returns:
+        Optional[float]: The delay in seconds, or None if the API did not request one.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class EmbeddingPipeline(Embeddings):
+    """
+    OpenAI embeddings with token-bounded batching, bounded concurrency and rate limit backoff.
+    Can be used anywhere a langchain `Embeddings` object is expected.
+    """
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        max_batch_tokens: int = 100000,
+        max_batch_size: int = 512,
+        max_input_tokens: int = 8191,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        counter: Optional[TokenCounter] = None
+    ) -> None:
+        """
+        Initialize the pipeline.
+
+        Args:
+            model (str): The embedding model name.
+            max_batch_tokens (int): Maximum number of tokens sent in one request.
+            max_batch_size (int): Maximum number of inputs sent in one request.
+            max_input_tokens (int): Inputs longer than this are truncated (the model context length).
+            max_concurrency (int): Maximum number of requests in flight.
+            max_retries (int): Number of retries of a batch before giving up.
+            backoff (float): Initial backoff in seconds, doubled on every retry.
+            max_backoff (float): Maximum backoff in seconds.
+            counter (TokenCounter): Token counter, the tiktoken encoding of `model` by default.
+        """
+        # Retries are handled here so a rate limited batch does not hold back the others
+        self.client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"), max_retries = 0)
+        self.aclient = AsyncOpenAI(api_key = os.getenv("OPENAI_API_KEY"), max_retries = 0)
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_input_tokens = max_input_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.counter = counter or TokenCounter(model)
+
+        self.stats = {"chunks": 0, "requests": 0, "retries": 0, "rate_limited": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def chunks_per_second(self) -> float:
+        """Embedding throughput over all 'embed_documents' calls."""
+        return self.stats["chunks"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Pack inputs into batches of at most `max_batch_tokens` tokens and `max_batch_size` inputs.
+        Over-long inputs are truncated in place to `max_input_tokens`.
+
+        Args:
+            texts (List[str]): The inputs, modified in place when truncated.
+
+        Returns:
+            List[List[int]]: The indices of the inputs of every batch.
+        """
+        batches = []
+        current, current_tokens = [], 0
+        for index, text in enumerate(texts):
+            tokens = self.counter.count(text)
+            if tokens > self.max_input_tokens:
+                texts[index] = self.counter.truncate_end(text, self.max_input_tokens)
+                tokens = self.max_input_tokens
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _delay(self, error: Exception, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            # Exponential backoff with full jitter, so retried batches do not hit the API together
+            delay = random.uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff))
+        return delay
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed one batch, retrying on rate limits and transient errors.
+
+        Args:
+            texts (List[str]): The inputs of the batch.
+
+        Returns:
+            List[List[float]]: One embedding vector per input.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._count("requests")
+                response = self.client.embeddings.create(model = self.model, input = texts)
+                return [item.embedding for item in sorted(response.data, key = lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                self._count("retries")
+                time.sleep(self._delay(e, attempt))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents in concurrent, token-bounded batches.
+
+        Args:
+            texts (List[str]): The documents to embed.
+
+        Returns:
+            List[List[float]]: One embedding vector per document.
+        """
+        if not texts:
+            return []
+        # The API rejects empty inputs
+        texts = [text if text.strip() else " " for text in texts]
+        batches = self.batches(texts)
+
+        start = time.perf_counter()
+        vectors: List[Any] = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers = min(self.max_concurrency, len(batches))) as executor:
+            results = executor.map(self._embed_batch, [[texts[index] for index in batch] for batch in batches])
+            for batch, batch_vectors in zip(batches, results):
+                for index, vector in zip(batch, batch_vectors):
+                    vectors[index] = vector
+
+        self._count("seconds", time.perf_counter() - start)
+        self._count("chunks", len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        return self._embed_batch([text or " "])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Async variant of 'embed_query'.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._count("requests")
+                response = await self.aclient.embeddings.create(model = self.model, input = [text or " "])
+                return response.data[0].embedding
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                self._count("retries")
+                await asyncio.sleep(self._delay(e, attempt))
+
+    def report(self) -> Dict[str, float]:
+        """
+        Report the embedding statistics.
+
+        Returns:
+            Dict[str, float]: The counters and the throughput in chunks per second.
+        """
+        return {**self.stats, "chunks_per_second": round(self.chunks_per_second, 2)}
@@ -0,0 +1,249 @@
+"""
+Persistent embedding store for the chat worker.
+Caches chunk embeddings on disk, keyed by the embedding model name and a hash of the chunk content,
+so that only new or changed chunks are ever sent to the embedding API. The file is append-only and
+is compacted (rewritten with the live entries of the current model) once its dead lines, i.e. entries
+of other models, duplicates and chunks that left the index, outnumber the live ones.
+"""
+
+import os, json, hashlib
+import asyncio, threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set
+
+from langchain_core.embeddings import Embeddings
+
+
+def content_hash(text: str) -> str:
+    """
+    Compute a stable hash of a chunk of text.
+
+    Args:
+        text (str): The chunk content.
+
+    Returns:
+        str: The sha256 hex digest of the content.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore(Embeddings):
+    """
+    Embeddings wrapper that persists document embeddings to an append-only JSONL file.
+    Can be used anywhere a langchain `Embeddings` object is expected.
+    """
+
+    def __init__(
+        self, 
+        embeddings: Embeddings, 
+        model_name: str, 
+        path: str = "embeddings_cache.jsonl", 
+        query_cache_size: int = 256,
+        compact_ratio: float = 1.0
+    ) -> None:
+        """
+        Initialize the store and load the existing embeddings from disk.
+
+        Args:
+            embeddings (Embeddings): The underlying embedding model used for cache misses.
+            model_name (str): Name of the embedding model, part of the cache key.
+            path (str): Path of the JSONL file holding the cached embeddings.
+            query_cache_size (int): Number of recent query embeddings kept in memory.
+            compact_ratio (float): The file is compacted when it holds more than `compact_ratio` dead lines 
+                per live entry.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.query_cache_size = query_cache_size
+        self.compact_ratio = compact_ratio
+        self._vectors: Dict[str, List[float]] = {}
+        self._dead_lines = 0 # Lines of the file that are not in `_vectors`
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending_queries: Dict[str, asyncio.Task] = {} # Query embeddings in flight, see 'aembed_query'
+        self._write_lock = threading.Lock() # Documents can be embedded by several sessions at once
+        self._query_lock = threading.Lock() # Queries are embedded by the sessions' threads and event loop
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def __contains__(self, text: str) -> bool:
+        return content_hash(text) in self._vectors
+
+    def load(self) -> None:
+        """
+        Load the cached embeddings of the current model from disk.
+        Entries written for other embedding models are skipped, and compacted away when they dominate the file.
+        """
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written line from an interrupted run
+                    continue
+                if record.get("model") == self.model_name:
+                    self._vectors[record["hash"]] = record["vector"]
+        with self._write_lock:
+            self._dead_lines = lines - len(self._vectors)
+            self._compact_if_needed()
+
+    def retain(self, keys: Set[str]) -> None:
+        """
+        Forget the embeddings of the chunks that are no longer indexed, e.g. old versions of changed records.
+        Their lines become dead and are dropped at the next compaction.
+
+        Args:
+            keys (Set[str]): Content hashes of the live chunks.
+        """
+        with self._write_lock:
+            dead = [key for key in self._vectors if key not in keys]
+            for key in dead:
+                del self._vectors[key]
+            self._dead_lines += len(dead)
+            self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        """
+        Rewrite the cache file with the live entries only, once the dead lines outnumber them `compact_ratio` 
+        times. Must be called with the write lock held.
+        """
+        if self._dead_lines <= self.compact_ratio * len(self._vectors):
+            return
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                for key, vector in self._vectors.items():
+                    f.write(json.dumps({"model": self.model_name, "hash": key, "vector": vector}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error compacting embeddings cache: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        print(f"Compacted embeddings cache, dropped {self._dead_lines} dead entries")
+        self._dead_lines = 0
+
+    def _save(self, records: Dict[str, List[float]]) -> None:
+        """
+        Append newly computed embeddings to the cache file.
+
+        Args:
+            records (Dict[str, List[float]]): Mapping of content hash to embedding vector.
+        """
+        try:
+            with open(self.path, "a") as f:
+                for key, vector in records.items():
+                    f.write(json.dumps({"model": self.model_name, "hash": key, "vector": vector}) + "\n")
+        except OSError as e:
+            print(f"Error saving embeddings cache: {e}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents, only calling the embedding model for unseen content.
+
+        Args:
+            texts (List[str]): The documents to embed.
+
+        Returns:
+            List[List[float]]: One embedding vector per document.
+        """
+        keys = [content_hash(text) for text in texts]
+
+        # Collect the unique documents that are not cached yet, 'retain' may drop entries meanwhile
+        with self._write_lock:
+            found = {key: self._vectors[key] for key in keys if key in self._vectors}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_records = dict(zip(missing.keys(), vectors))
+            with self._write_lock:
+                self._vectors.update(new_records)
+                self._save(new_records)
+            found.update(new_records)
+
+        return [found[key] for key in keys]
+
+    def cached_query_vector(self, text: str) -> Optional[List[float]]:
+        """
+        Look up the embedding of a recent query without calling the embedding model.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            Optional[List[float]]: The cached query embedding, or None.
+        """
+        with self._query_lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+            return vector
+
+    def _remember_query(self, text: str, vector: List[float]) -> None:
+        with self._query_lock:
+            self._queries[text] = vector
+            self._queries.move_to_end(text)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last = False)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query. Recent queries are kept in memory only, they are rarely repeated verbatim.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        vector = self.cached_query_vector(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Async variant of 'embed_query'.
+        Concurrent calls for the same query share one embedding request, e.g. the speculative retrieval
+        and the follow-up classifier of a turn. Cancelling one caller does not cancel the request.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        vector = self.cached_query_vector(text)
+        if vector is not None:
+            return vector
+
+        loop = asyncio.get_running_loop()
+        task = self._pending_queries.get(text)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(self.embeddings.aembed_query(text))
+            self._pending_queries[text] = task
+            task.add_done_callback(lambda done: self._finish_query(text, done))
+        return await asyncio.shield(task)
+
+    def _finish_query(self, text: str, task: asyncio.Task) -> None:
+        if self._pending_queries.get(text) is task:
+            del self._pending_queries[text]
+        # Also marks the exception as retrieved when every caller was cancelled
+        if not task.cancelled() and task.exception() is None:
+            self._remember_query(text, task.result())
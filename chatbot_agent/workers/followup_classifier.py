@@ -0,0 +1,163 @@
+"""
+Local fast-path classifier for follow-up queries.
+Decides the easy cases of 'ChatWithDocs.classify_query' from pronoun / anaphora cues, lexical overlap
+with the last exchange and (optionally) embedding similarity to the last topic, without a network call.
+Returns None when it is not confident, in which case the caller falls back to the LLM.
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+# Phrases that refer back to something said earlier in the conversation. Common words such as "it",
+# "this" or "also" appear in most new questions too and are only counted in referring phrases
+ANAPHORA_PATTERN = re.compile(
+    r"\b(these|those|them|above|previous|earlier|again|elaborate|first one|second one|last one|"
+    r"you said|you mentioned|what about|how about|why is that|what does that mean|tell me more|"
+    r"(more|about|explain|mean by) (it|this|that)|(is|was|does|did) (it|this|that) (mean|serious|normal|dangerous))\b"
+)
+
+# Keywords of the data categories held in data.txt, asking about another category needs new context
+CATEGORY_KEYWORDS = {
+    "report": ["report", "blood", "test", "summary", "abnormal", "pressure", "hemoglobin"],
+    "image": ["x-ray", "xray", "mri", "ct", "scan", "image", "tumor", "lung", "chest", "brain"],
+    "medicine": ["medicine", "medication", "drug", "tablet", "dose", "dosage", "side effect", "prescription"],
+    "price": ["price", "cost", "buy", "purchase", "link", "pharmacy", "cheap", "rs"],
+}
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "for", "and", "or", "my",
+    "me", "i", "you", "your", "what", "whats", "which", "who", "how", "why", "when", "where", "do", "does",
+    "did", "can", "could", "should", "would", "will", "please", "tell", "about", "with", "any", "there",
+}
+
+
+class FollowupClassifier:
+    """Heuristic follow-up classifier with hit counters."""
+
+    def __init__(
+        self,
+        overlap_threshold: float = 0.3,
+        new_topic_overlap: float = 0.1,
+        similarity_fn: Optional[Callable[[str, str], Optional[float]]] = None,
+        similarity_high: float = 0.8,
+        similarity_low: float = 0.3
+    ) -> None:
+        """
+        Initialize the classifier.
+
+        Args:
+            overlap_threshold (float): Minimum share of query words found in the last exchange for a follow-up.
+            new_topic_overlap (float): Maximum share of query words found in the last exchange for a new query.
+            similarity_fn (Callable): Optional function returning the embedding similarity of two texts,
+                or None when it cannot be computed locally.
+            similarity_high (float): Similarity to the last topic above which the query is a follow-up.
+            similarity_low (float): Similarity to the last topic below which the query is a new query.
+        """
+        self.overlap_threshold = overlap_threshold
+        self.new_topic_overlap = new_topic_overlap
+        self.similarity_fn = similarity_fn
+        self.similarity_high = similarity_high
+        self.similarity_low = similarity_low
+        self.stats = {"fast_path": 0, "fallback": 0}
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of classifications decided locally."""
+        total = self.stats["fast_path"] + self.stats["fallback"]
+        return self.stats["fast_path"] / total if total else 0.0
+
+    @staticmethod
+    def content_words(text: str) -> Set[str]:
+        """
+        Lowercase content words of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            Set[str]: The words, without stopwords.
+        """
+        return {word for word in re.findall(r"[a-z0-9\-]+", text.lower()) if word not in STOPWORDS}
+
+    @staticmethod
+    def categories(text: str) -> Set[str]:
+        """
+        Data categories mentioned in a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            Set[str]: The categories found, see CATEGORY_KEYWORDS.
+        """
+        text = text.lower()
+        return {
+            category for category, keywords in CATEGORY_KEYWORDS.items()
+            if any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in keywords)
+        }
+
+    def classify(
+        self,
+        query: str,
+        conversation_history: List[Dict[str, str]],
+        last_query_topic: Optional[str],
+        use_similarity: bool = True
+    ) -> Optional[Tuple[bool, bool]]:
+        """
+        Classify the query if the case is easy.
+        Callers that embed the texts of `similarity_fn` can first classify with the lexical rules only
+        (`use_similarity` False), and embed only when they leave the query undecided.
+
+        Args:
+            query (str): The user query.
+            conversation_history (List[Dict[str, str]]): The conversation so far.
+            last_query_topic (str): The last topic of the conversation.
+            use_similarity (bool): Also use the similarity to the last topic. An undecided lexical-only
+                classification is not counted in the stats, the following full one is.
+
+        Returns:
+            Optional[Tuple[bool, bool]]: (is_followup, requires_new_context), or None if not confident.
+        """
+        decision = self._decide(query, conversation_history, last_query_topic, use_similarity)
+        if decision is not None or use_similarity:
+            self.stats["fast_path" if decision is not None else "fallback"] += 1
+        return decision
+
+    def _decide(
+        self,
+        query: str,
+        conversation_history: List[Dict[str, str]],
+        last_query_topic: Optional[str],
+        use_similarity: bool = True
+    ) -> Optional[Tuple[bool, bool]]:
+        # No conversation yet, always a new query
+        if not conversation_history:
+            return False, True
+
+        last_exchange = " ".join(msg["content"] for msg in conversation_history[-2:])
+        if last_query_topic:
+            last_exchange = f"{last_query_topic} {last_exchange}"
+
+        query_words = self.content_words(query)
+        overlap = len(query_words & self.content_words(last_exchange)) / len(query_words) if query_words else 1.0
+        has_anaphora = bool(ANAPHORA_PATTERN.search(query.lower()))
+        new_categories = self.categories(query) - self.categories(last_exchange)
+
+        # "Tell me more about it", "why is that?"
+        if has_anaphora and not new_categories and (len(query_words) <= 3 or overlap >= self.overlap_threshold):
+            return True, False
+
+        # Asks about a kind of data that was not part of the last exchange
+        if new_categories and not has_anaphora and overlap <= self.new_topic_overlap:
+            return False, True
+
+        if use_similarity and self.similarity_fn is not None and last_query_topic:
+            similarity = self.similarity_fn(query, last_query_topic)
+            if similarity is not None:
+                if similarity >= self.similarity_high and not new_categories:
+                    return True, False
+                if similarity <= self.similarity_low:
+                    return False, True
+
+        return None
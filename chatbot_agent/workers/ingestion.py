@@ -0,0 +1,161 @@
+"""
+Incremental ingestion of the chatbot data file.
+Other agents only ever append `>>>>` separated records to data.txt, so the ingestor remembers the file
+identity and the byte offset of the last record and only parses what was appended since the last poll.
+The last record is re-read on every change, in case it was still being written.
+A truncated or replaced file is detected and re-read from the start.
+"""
+
+import os, hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class DataFileIngestor:
+    """Offset-tracking reader of `>>>>` separated records."""
+
+    # Bytes at the start of the file hashed into its identity
+    head_bytes = 256
+
+    def __init__(self, path: str = "data.txt", separator: str = ">>>>", patient_id: Optional[str] = None) -> None:
+        """
+        Initialize the ingestor, nothing is read until the first poll.
+
+        Args:
+            path (str): Path of the data file.
+            separator (str): The record separator.
+            patient_id (str): Patient of the data file (e.g. a per-patient file), for the records before the first
+                one naming a patient. None for a file shared by several patients.
+        """
+        self.path = path
+        self.separator = separator.encode("utf-8")
+        self.patient_id = patient_id
+        self.records: Dict[int, str] = {}  # Byte offset of the record -> record text
+        self.identity = None
+        self.size = 0
+        self.mtime = None
+        self.tail_offset = 0  # Byte offset of the last record, re-read on every change
+        self.lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def version(self) -> str:
+        """Fingerprint of the ingested content, changes whenever records change."""
+        return f"{self.identity}:{self.size}"
+
+    def _file_identity(self, stat: os.stat_result, length: int) -> Tuple[int, int, int, str]:
+        # Device and inode, plus the first bytes for filesystems without stable inodes
+        with open(self.path, "rb") as f:
+            head = hashlib.sha256(f.read(length)).hexdigest()[:16]
+        return stat.st_dev, stat.st_ino, length, head
+
+    def _same_file(self, stat: os.stat_result) -> bool:
+        """
+        Whether the file is still the one last read, comparing the prefix its identity was computed over,
+        so that appending to a file shorter than `head_bytes` does not look like a replacement.
+        """
+        if self.identity is None:
+            return False
+        return self._file_identity(stat, self.identity[2]) == self.identity
+
+    def _parse(self, data: bytes, base_offset: int) -> List[Tuple[int, str]]:
+        """
+        Split raw bytes into records.
+
+        Args:
+            data (bytes): The bytes read from the file.
+            base_offset (int): Byte offset of `data` in the file.
+
+        Returns:
+            List[Tuple[int, str]]: (byte offset, text) of every non-empty record.
+        """
+        records = []
+        start = 0
+        while start <= len(data):
+            end = data.find(self.separator, start)
+            if end == -1:
+                end = len(data)
+            text = data[start:end].decode("utf-8", errors="replace")
+            if text:
+                records.append((base_offset + start, text))
+            start = end + len(self.separator)
+        return records
+
+    def poll(self) -> Tuple[List[Tuple[int, str]], List[int], bool]:
+        """
+        Read the records appended since the last poll.
+
+        Returns:
+            Tuple[List[Tuple[int, str]], List[int], bool]:
+                - The new or changed records as (byte offset, text).
+                - The byte offsets of records that no longer exist.
+                - True if the file was replaced or truncated and everything was re-read.
+        """
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                removed = list(self.records)
+                self.records, self.identity, self.size, self.mtime, self.tail_offset = {}, None, 0, None, 0
+                return [], removed, bool(removed)
+
+            if stat.st_size == self.size and stat.st_mtime_ns == self.mtime and self.identity is not None:
+                return [], [], False
+
+            reset = stat.st_size < self.size or not self._same_file(stat)
+            identity = self._file_identity(stat, min(stat.st_size, self.head_bytes))
+            removed = []
+            if reset:
+                removed = list(self.records)
+                self.records, self.tail_offset = {}, 0
+
+            read_from = self.tail_offset
+            with open(self.path, "rb") as f:
+                f.seek(read_from)
+                data = f.read()
+
+            changed = []
+            for offset, text in self._parse(data, read_from):
+                if self.records.get(offset) != text:
+                    self.records[offset] = text
+                    changed.append((offset, text))
+            if self.records:
+                self.tail_offset = max(self.records)
+
+            self.identity = identity
+            self.size = read_from + len(data)
+            self.mtime = stat.st_mtime_ns
+            return changed, [offset for offset in removed if offset not in self.records], reset
+
+    def start(self, callback: Callable[[], None], interval: float = 1.0) -> None:
+        """
+        Watch the file in a background thread, calling `callback` every `interval` seconds
+        (the callback is expected to poll).
+
+        Args:
+            callback (Callable): Function called periodically.
+            interval (float): Seconds between two calls.
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error ingesting {self.path}: {e}")
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, name="DataFileIngestor", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background watcher.
+        """
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,204 @@
+"""
+Per-turn latency instrumentation for the chat worker.
+A TurnTimer measures the stages of one turn (classification, context building, embedding, search,
+prompt assembly, time to first token, generation) and the LLM token usage. When the turn finishes,
+the report is passed to hooks: any callable taking the report, e.g. a LoggingHook, a MetricsHook
+or a LatencyRecorder that aggregates percentiles across turns.
+"""
+
+import json, time, logging
+import threading, contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+# The stages of a turn, in pipeline order
+STAGES = ["classify", "build_context", "embedding", "search", "prompt", "time_to_first_token", "generation"]
+
+TurnHook = Callable[[Dict[str, Any]], None]
+
+# Stages being timed in the current thread or task, innermost last: (timer, [seconds of their nested stages])
+_active_stages: contextvars.ContextVar = contextvars.ContextVar("active_stages", default = ())
+
+
+class TurnTimer:
+    """Collects stage timings and token usage of a single turn."""
+
+    def __init__(self, hooks: Optional[List[TurnHook]] = None) -> None:
+        """
+        Start timing a turn.
+
+        Args:
+            hooks (List[Callable]): Functions called with the report when the turn finishes.
+        """
+        self.hooks = hooks or []
+        self.stages: Dict[str, float] = {}
+        self.tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+        self.fields: Dict[str, Any] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock() # Stages of a turn can run in a worker thread, e.g. the speculative retrieval
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a block of code as a stage, repeated stages are added up.
+        The time of a stage nested in another one (in the same thread or task) is only counted in the inner
+        stage, e.g. embedding the query to classify it counts as embedding, not as classification.
+
+        Args:
+            name (str): The stage name, see STAGES.
+        """
+        nested = [0.0]
+        token = _active_stages.set(_active_stages.get() + ((self, nested),))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            _active_stages.reset(token)
+            outer = _active_stages.get()
+            if outer and outer[-1][0] is self:
+                outer[-1][1][0] += seconds
+            self.record(name, seconds - nested[0])
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record the duration of a stage measured elsewhere.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): The duration in seconds.
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_usage(self, usage: Any) -> None:
+        """
+        Add the token usage of an LLM call.
+
+        Args:
+            usage: The `usage` of an OpenAI response, ignored if None.
+        """
+        if usage is None:
+            return
+        with self._lock:
+            self.tokens["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self.tokens["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def finish(self, **fields: Any) -> Dict[str, Any]:
+        """
+        End the turn and pass the report to the hooks.
+        A failing hook is reported and does not fail the turn.
+
+        Args:
+            **fields: Extra fields of the report, e.g. the kind of turn.
+
+        Returns:
+            Dict[str, Any]: The report, with `stages` (seconds per stage), token counts and `total_time`.
+        """
+        self.fields.update(fields)
+        report = {
+            **self.fields,
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            **self.tokens,
+            "total_time": round(self.elapsed(), 6),
+        }
+        for hook in self.hooks:
+            try:
+                hook(report)
+            except Exception as e:
+                print(f"Error in turn hook: {e}")
+        return report
+
+
+class LoggingHook:
+    """Logs every turn report as a JSON log record."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO) -> None:
+        """
+        Initialize the hook.
+
+        Args:
+            logger (logging.Logger): The logger, "chat_worker.turns" by default.
+            level (int): The log level of the records.
+        """
+        self.logger = logger or logging.getLogger("chat_worker.turns")
+        self.level = level
+
+    def __call__(self, report: Dict[str, Any]) -> None:
+        self.logger.log(self.level, json.dumps(report), extra = {"turn_report": report})
+
+
+class MetricsHook:
+    """Forwards every turn report to a metrics sink, one observation per stage."""
+
+    def __init__(self, observe: Callable[[str, float], None], prefix: str = "chat") -> None:
+        """
+        Initialize the hook.
+
+        Args:
+            observe (Callable): Function (metric name, value) -> None, e.g. a histogram's observe.
+            prefix (str): Prefix of the metric names.
+        """
+        self.observe = observe
+        self.prefix = prefix
+
+    def __call__(self, report: Dict[str, Any]) -> None:
+        for name, seconds in report["stages"].items():
+            self.observe(f"{self.prefix}.{name}_seconds", seconds)
+        self.observe(f"{self.prefix}.total_seconds", report["total_time"])
+        self.observe(f"{self.prefix}.prompt_tokens", report["prompt_tokens"])
+        self.observe(f"{self.prefix}.completion_tokens", report["completion_tokens"])
+
+
+class LatencyRecorder:
+    """Keeps the turn reports in memory and summarizes the stage latencies as percentiles."""
+
+    def __init__(self, max_reports: int = 100000) -> None:
+        """
+        Initialize the recorder.
+
+        Args:
+            max_reports (int): Maximum number of reports kept, the oldest are dropped.
+        """
+        self.max_reports = max_reports
+        self.reports: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.reports.append(report)
+            if len(self.reports) > self.max_reports:
+                del self.reports[0]
+
+    def summary(self, percentiles: tuple = (50, 95, 99)) -> Dict[str, Dict[str, float]]:
+        """
+        Summarize the recorded latencies.
+
+        Args:
+            percentiles (tuple): The percentiles to compute.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Per stage (and "total"), the number of samples and the percentiles in seconds.
+        """
+        with self._lock:
+            reports = list(self.reports)
+        samples: Dict[str, List[float]] = {}
+        for report in reports:
+            for name, seconds in report["stages"].items():
+                samples.setdefault(name, []).append(seconds)
+            samples.setdefault("total", []).append(report["total_time"])
+
+        order = {name: index for index, name in enumerate(STAGES + ["total"])}
+        summary = {}
+        for name in sorted(samples, key = lambda name: order.get(name, len(order))):
+            values = np.asarray(samples[name])
+            summary[name] = {"count": len(values)}
+            for q in percentiles:
+                summary[name][f"p{q}"] = float(np.percentile(values, q))
+        return summary
@@ -0,0 +1,216 @@
+"""
+In-process inverted index with BM25 scoring for the chat worker.
+Medical queries often hinge on exact tokens (e.g. "Hemoglobin", "MRN", drug names) that embeddings can miss.
+The index is built incrementally as chunks arrive and its scores are fused with the embedding scores.
+"""
+
+import math, re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "for", "and", "or", "my",
+    "me", "i", "you", "your", "what", "whats", "which", "who", "how", "why", "when", "where", "do", "does",
+    "did", "can", "could", "should", "would", "will", "please", "tell", "about", "with", "any", "there",
+    "it", "this", "that", "am", "have", "has", "get", "give", "show", "all", "some",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms, keeping values like "142/87" or "12.5" together.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def normalize_scores(scores: np.ndarray) -> np.ndarray:
+    """
+    Min-max normalize scores to [0, 1].
+
+    Args:
+        scores (np.ndarray): The scores.
+
+    Returns:
+        np.ndarray: The normalized scores (all zeros if the scores are constant).
+    """
+    if not len(scores):
+        return scores
+    low, high = float(scores.min()), float(scores.max())
+    if high - low < 1e-12:
+        return np.zeros_like(scores, dtype=np.float32)
+    return ((scores - low) / (high - low)).astype(np.float32)
+
+
+def fuse_scores(dense: np.ndarray, lexical: np.ndarray, alpha: float = 0.5) -> np.ndarray:
+    """
+    Fuse embedding and BM25 scores of the same rows.
+
+    Args:
+        dense (np.ndarray): Cosine similarity per row.
+        lexical (np.ndarray): BM25 score per row.
+        alpha (float): Weight of the embedding scores, 1 - alpha is the weight of BM25.
+
+    Returns:
+        np.ndarray: The fused scores.
+    """
+    return alpha * normalize_scores(dense) + (1 - alpha) * normalize_scores(lexical)
+
+
+class BM25Index:
+    """Incremental inverted index scored with Okapi BM25."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        """
+        Initialize an empty index.
+
+        Args:
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> {doc id: term frequency}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_lengths
+
+    @property
+    def doc_ids(self) -> List[str]:
+        return list(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """
+        Index a document. Already indexed ids are skipped.
+
+        Args:
+            doc_id (str): The document id.
+            text (str): The document text.
+        """
+        if doc_id in self.doc_lengths:
+            return
+        terms = tokenize(text)
+        counts = Counter(terms)
+        for term, frequency in counts.items():
+            self.postings[term][doc_id] = frequency
+        self.doc_terms[doc_id] = list(counts)
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, doc_id: str) -> None:
+        """
+        Remove a document from the index. Unknown ids are ignored.
+
+        Args:
+            doc_id (str): The document id.
+        """
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def query_terms(self, query: str) -> List[str]:
+        """
+        Informative terms of a query: without stopwords and duplicates.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            List[str]: The query terms.
+        """
+        return list(dict.fromkeys(term for term in tokenize(query) if term not in STOPWORDS))
+
+    def scores(self, query: str, allowed: Optional[Set[str]] = None) -> Dict[str, float]:
+        """
+        BM25 scores of the documents matching at least one query term.
+
+        Args:
+            query (str): The query.
+            allowed (Set[str]): Only score these document ids, all documents when None.
+
+        Returns:
+            Dict[str, float]: Score per matching document id.
+        """
+        n_docs = len(self.doc_lengths)
+        if not n_docs:
+            return {}
+        avg_length = self.total_length / n_docs
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term in self.query_terms(query):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return dict(scores)
+
+    def score_array(self, query: str, ids: List[str], allowed: Optional[Set[str]] = None) -> np.ndarray:
+        """
+        BM25 scores aligned with a list of ids, e.g. the rows of the vector index.
+
+        Args:
+            query (str): The query.
+            ids (List[str]): The document ids.
+            allowed (Set[str]): The ids that can be in `ids`, to skip scoring other documents.
+
+        Returns:
+            np.ndarray: One score per id, 0 for documents not matching.
+        """
+        scores = self.scores(query, allowed)
+        return np.asarray([scores.get(doc_id, 0.0) for doc_id in ids], dtype=np.float32)
+
+    def search(self, query: str, k: int, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Find the k best matching documents.
+
+        Args:
+            query (str): The query.
+            k (int): Number of results to return.
+            allowed (Set[str]): Only search these document ids, all documents when None.
+
+        Returns:
+            List[Tuple[str, float]]: (id, score) pairs sorted by decreasing score.
+        """
+        return sorted(self.scores(query, allowed).items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def coverage(self, query: str, doc_id: str) -> float:
+        """
+        Share of the informative query terms found in a document.
+
+        Args:
+            query (str): The query.
+            doc_id (str): The document id.
+
+        Returns:
+            float: The coverage in [0, 1], 0 for queries without informative terms.
+        """
+        terms = self.query_terms(query)
+        if not terms:
+            return 0.0
+        return sum(doc_id in self.postings.get(term, {}) for term in terms) / len(terms)
@@ -0,0 +1,145 @@
+"""
+Metadata partitions of the chat worker index.
+Keeps posting sets of chunk ids per patient and per record type, so that a query can be restricted to
+one patient's chunks and to the record types it is about
+before any vector is scored. A query is routed to record types with the data categories of
+FollowupClassifier, e.g. a price question only scans the medicine price records.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set
+
+import numpy as np
+
+from followup_classifier import FollowupClassifier
+
+
+# Record types holding the data of each query category, see CATEGORY_KEYWORDS and RECORD_TYPES
+CATEGORY_RECORD_TYPES = {
+    "report": {"report", "report_summary"},
+    "image": {"image_finding"},
+    "medicine": {"medicine_data"},
+    "price": {"medicine_prices"},
+}
+
+
+def route_record_types(query: str) -> Optional[Set[str]]:
+    """
+    Record types a query is about, from the data categories it mentions.
+    Price questions only need the price records, even when they mention a medicine.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        Optional[Set[str]]: The record types to search, None to search all of them.
+    """
+    categories = FollowupClassifier.categories(query)
+    if "price" in categories:
+        categories = {"price"}
+    if not categories:
+        return None
+    return set().union(*(CATEGORY_RECORD_TYPES[category] for category in categories))
+
+
+class MetadataIndex:
+    """Posting sets of chunk ids per metadata value."""
+
+    def __init__(self, fields: Iterable[str] = ("patient_id", "record_type")) -> None:
+        """
+        Initialize an empty index.
+
+        Args:
+            fields (Iterable[str]): The metadata fields to index.
+        """
+        self.fields = tuple(fields)
+        self.postings: Dict[str, Dict[Any, Set[str]]] = {field: defaultdict(set) for field in self.fields}
+        self.doc_values: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_values)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_values
+
+    def add(self, doc_id: str, metadata: Dict[str, Any]) -> None:
+        """
+        Index the metadata of a chunk. Already indexed ids are skipped.
+
+        Args:
+            doc_id (str): The chunk id.
+            metadata (Dict[str, Any]): The chunk metadata, missing fields are indexed as None.
+        """
+        if doc_id in self.doc_values:
+            return
+        values = {field: metadata.get(field) for field in self.fields}
+        for field, value in values.items():
+            self.postings[field][value].add(doc_id)
+        self.doc_values[doc_id] = values
+
+    def remove(self, doc_id: str) -> None:
+        """
+        Remove a chunk from the index. Unknown ids are ignored.
+
+        Args:
+            doc_id (str): The chunk id.
+        """
+        values = self.doc_values.pop(doc_id, None)
+        if values is None:
+            return
+        for field, value in values.items():
+            postings = self.postings[field][value]
+            postings.discard(doc_id)
+            if not postings:
+                del self.postings[field][value]
+
+    def ids(self, field: str, values: Iterable[Any]) -> Set[str]:
+        """
+        Chunk ids having one of the given values.
+
+        Args:
+            field (str): The metadata field.
+            values (Iterable[Any]): The accepted values.
+
+        Returns:
+            Set[str]: The matching chunk ids.
+        """
+        postings = self.postings[field]
+        return set().union(*(postings.get(value, set()) for value in values))
+
+    def filter(self, patient_id: Optional[str] = None, record_types: Optional[Set[str]] = None) -> Optional[Set[str]]:
+        """
+        Chunk ids a query may see: the chunks of the patient.
+        Records that could not be attributed to a patient are never seen with a patient filter.
+        If the patient has no chunk of the requested record types, only the patient filter applies.
+
+        Args:
+            patient_id (str): The patient of the conversation, None for no patient filter.
+            record_types (Set[str]): The record types of the query, None for no record type filter.
+
+        Returns:
+            Optional[Set[str]]: The allowed chunk ids, None if nothing is filtered.
+        """
+        allowed = None
+        if patient_id is not None:
+            allowed = self.ids("patient_id", [patient_id])
+        if record_types:
+            typed = self.ids("record_type", record_types)
+            typed = typed if allowed is None else typed & allowed
+            if typed:
+                allowed = typed
+        return allowed
+
+    @staticmethod
+    def rows(allowed: Set[str], rows: Dict[str, int]) -> np.ndarray:
+        """
+        Rows of the allowed chunks in a vector index.
+
+        Args:
+            allowed (Set[str]): The allowed chunk ids.
+            rows (Dict[str, int]): Row of every chunk id of the vector index.
+
+        Returns:
+            np.ndarray: The sorted row numbers.
+        """
+        return np.sort(np.fromiter((rows[doc_id] for doc_id in allowed if doc_id in rows), dtype=np.int64))
@@ -0,0 +1,195 @@
+"""
+Token-budgeted prompt assembly for the chat worker.
+Fits the conversation history and retrieved context into a token budget counted with tiktoken.
+Older turns are folded into a rolling summary incrementally: only the turns that drop out of the window
+are summarized, together with the previous summary, instead of rebuilding it every turn.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import tiktoken
+
+
+class TokenCounter:
+    """
+    Counts tokens with the tiktoken encoding of the LLM model.
+    Falls back to an estimate of 4 characters per token when the encoding cannot be loaded (offline).
+    """
+
+    chars_per_token = 4
+
+    def __init__(self, model: str = "gpt-4o-mini") -> None:
+        """
+        Initialize the counter.
+
+        Args:
+            model (str): The LLM model name, unknown models use the o200k_base encoding.
+        """
+        try:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Warning: could not load the tiktoken encoding, estimating token counts ({e})")
+            self.encoding = None
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: Number of tokens.
+        """
+        if self.encoding is None:
+            return -(-len(text) // self.chars_per_token)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate_start(self, text: str, max_tokens: int) -> str:
+        """
+        Keep only the last `max_tokens` tokens of a text.
+
+        Args:
+            text (str): The text.
+            max_tokens (int): Number of tokens to keep.
+
+        Returns:
+            str: The truncated text.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            return text[-max_tokens * self.chars_per_token:]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[-max_tokens:])
+
+    def truncate_end(self, text: str, max_tokens: int) -> str:
+        """
+        Keep only the first `max_tokens` tokens of a text.
+
+        Args:
+            text (str): The text.
+            max_tokens (int): Number of tokens to keep.
+
+        Returns:
+            str: The truncated text.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            return text[:max_tokens * self.chars_per_token]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+def format_history(history: List[Dict[str, str]]) -> str:
+    """
+    Format conversation messages as "Role: content" lines.
+
+    Args:
+        history (List[Dict[str, str]]): The messages.
+
+    Returns:
+        str: The formatted messages.
+    """
+    return "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in history)
+
+
+class PromptBuilder:
+    """Fits history and context into a token budget with a rolling history summary."""
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        budget: int = 8000,
+        keep_messages: int = 4,
+        summarize_fn: Optional[Callable[[str, str], str]] = None
+    ) -> None:
+        """
+        Initialize the prompt builder.
+
+        Args:
+            counter (TokenCounter): Token counter of the LLM model.
+            budget (int): Maximum number of prompt tokens.
+            keep_messages (int): Number of most recent messages that are never summarized.
+            summarize_fn (Callable): Function (previous summary, new turns) -> updated summary.
+                Without it, old turns are dropped instead of summarized.
+        """
+        self.counter = counter
+        self.budget = budget
+        self.keep_messages = keep_messages
+        self.summarize_fn = summarize_fn
+
+    def build(
+        self,
+        template: str,
+        query: str,
+        context: str,
+        history: List[Dict[str, str]],
+        summary: str = "",
+        summarized_upto: int = 0
+    ) -> Tuple[str, str, int, Dict[str, int]]:
+        """
+        Build the prompt from a template with `query`, `context` and `history` fields.
+
+        Args:
+            template (str): The prompt template.
+            query (str): The user query.
+            context (str): The retrieved context.
+            history (List[Dict[str, str]]): The full conversation history.
+            summary (str): The rolling summary of history[:summarized_upto].
+            summarized_upto (int): Number of messages already folded into the summary.
+
+        Returns:
+            Tuple[str, str, int, Dict[str, int]]: The prompt, the updated summary, the updated
+                summarized_upto and a report with token counts and the tokens saved.
+        """
+        # The context comes first, it is only cut when it does not fit on its own
+        template_tokens = self.counter.count(template.format(query = query, context = "", history = ""))
+        context = self.counter.truncate_end(context or "", self.budget - template_tokens)
+
+        fixed_tokens = self.counter.count(template.format(query = query, context = context, history = ""))
+        history_budget = max(self.budget - fixed_tokens, 0)
+
+        recent = history[summarized_upto:]
+        history_text = self._history_text(summary, recent)
+
+        # Fold the oldest messages into the summary until the history fits
+        if self.counter.count(history_text) > history_budget and len(recent) > self.keep_messages:
+            fold = len(recent) - self.keep_messages
+            fold -= fold % 2  # Keep user / assistant pairs together
+            if fold > 0:
+                if self.summarize_fn is not None:
+                    summary = self.summarize_fn(summary, format_history(recent[:fold]))
+                summarized_upto += fold
+                recent = history[summarized_upto:]
+                history_text = self._history_text(summary, recent)
+
+        # Still too long (huge messages), keep the most recent tokens
+        history_text = self.counter.truncate_start(history_text, history_budget)
+
+        prompt = template.format(query = query, context = context, history = history_text)
+        raw_history_tokens = self.counter.count(str(history))
+        history_tokens = self.counter.count(history_text)
+        report = {
+            "prompt_tokens": fixed_tokens + history_tokens,
+            "history_tokens": history_tokens,
+            "raw_history_tokens": raw_history_tokens,
+            "saved_tokens": max(raw_history_tokens - history_tokens, 0),
+            "summarized_messages": summarized_upto,
+        }
+        return prompt, summary, summarized_upto, report
+
+    @staticmethod
+    def _history_text(summary: str, recent: List[Dict[str, str]]) -> str:
+        text = format_history(recent)
+        if summary:
+            text = f"Summary of the earlier conversation: {summary}\n{text}"
+        return text
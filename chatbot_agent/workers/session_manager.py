@@ -0,0 +1,217 @@
+"""
+Session manager for serving many conversations from one process.
+Every session is a fork of one ChatWithDocs, so the LLM clients (and their connection pools), embeddings,
+vector index and caches are shared and only the conversation state is kept per session.
+Sessions are evicted LRU beyond `max_sessions` or after `idle_timeout`, optionally spilling to disk.
+"""
+
+import os, json, time, hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from chat_worker import ChatWithDocs
+
+
+class SessionManager:
+    """Bounded, LRU store of ChatWithDocs sessions over shared retrieval resources."""
+
+    def __init__(
+        self,
+        chatbot: ChatWithDocs,
+        max_sessions: int = 1000,
+        idle_timeout: float = 1800.0,
+        max_session_bytes: int = 256 * 1024,
+        spill_dir: Optional[str] = None
+    ) -> None:
+        """
+        Initialize the session manager.
+
+        Args:
+            chatbot (ChatWithDocs): The chat worker whose resources are shared by all sessions.
+            max_sessions (int): Maximum number of sessions kept in memory.
+            idle_timeout (float): Seconds of inactivity after which a session is evicted.
+            max_session_bytes (int): Bound on the conversation state of a session, oldest turns are dropped beyond it.
+            spill_dir (str): Directory where evicted sessions are saved and restored from, None to drop them.
+        """
+        self.chatbot = chatbot
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_session_bytes = max_session_bytes
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self.sessions: "OrderedDict[str, ChatWithDocs]" = OrderedDict()
+        self.last_used: Dict[str, float] = {}
+        self.stats = {"created": 0, "restored": 0, "evicted": 0, "spilled": 0, "trimmed_turns": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.sessions
+
+    @staticmethod
+    def session_bytes(session: ChatWithDocs) -> int:
+        """
+        Approximate memory used by the conversation state of a session.
+
+        Args:
+            session (ChatWithDocs): The session.
+
+        Returns:
+            int: Size of the state in bytes (UTF-8 encoded text).
+        """
+        size = sum(len(msg["content"].encode("utf-8")) for msg in session.conversation_history)
+        for text in (session.current_context, session.last_query_topic, session.history_summary):
+            if text:
+                size += len(text.encode("utf-8"))
+        return size
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """
+        Report the memory used by the sessions in memory.
+
+        Returns:
+            Dict[str, Any]: Number of sessions, total and largest state size in bytes.
+        """
+        with self._lock:
+            sizes = [self.session_bytes(session) for session in self.sessions.values()]
+        return {
+            "sessions": len(sizes),
+            "total_bytes": sum(sizes),
+            "max_session_bytes": max(sizes, default=0),
+        }
+
+    def _spill_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{name}.json")
+
+    def _spill(self, session_id: str, session: ChatWithDocs) -> None:
+        try:
+            with open(self._spill_path(session_id), "w") as f:
+                json.dump(session.get_state(), f)
+            self.stats["spilled"] += 1
+        except OSError as e:
+            print(f"Error spilling session to disk: {e}")
+
+    def _restore(self, session_id: str) -> Optional[ChatWithDocs]:
+        if not self.spill_dir or not os.path.exists(self._spill_path(session_id)):
+            return None
+        try:
+            with open(self._spill_path(session_id), "r") as f:
+                state = json.load(f)
+            os.remove(self._spill_path(session_id))
+        except (OSError, ValueError) as e:
+            print(f"Error restoring session from disk: {e}")
+            return None
+        session = self.chatbot.fork()
+        session.set_state(state)
+        self.stats["restored"] += 1
+        return session
+
+    def _evict(self, session_id: str) -> None:
+        session = self.sessions.pop(session_id)
+        self.last_used.pop(session_id, None)
+        if self.spill_dir:
+            self._spill(session_id, session)
+        self.stats["evicted"] += 1
+
+    def evict_idle(self) -> None:
+        """
+        Evict the sessions that have been idle for longer than `idle_timeout`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            idle = [session_id for session_id, used in self.last_used.items() if now - used > self.idle_timeout]
+            for session_id in idle:
+                self._evict(session_id)
+
+    def get(self, session_id: str, patient_id: Optional[str] = None) -> ChatWithDocs:
+        """
+        Get a session, restoring it from disk or creating it if needed.
+
+        Args:
+            session_id (str): The session id.
+            patient_id (str): The patient of a new session, whose records it searches, see 'ChatWithDocs.fork'.
+
+        Returns:
+            ChatWithDocs: The session.
+        """
+        self.evict_idle()
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self._restore(session_id)
+                if session is None:
+                    session = self.chatbot.fork(patient_id)
+                    self.stats["created"] += 1
+                self.sessions[session_id] = session
+
+            self.sessions.move_to_end(session_id)
+            self.last_used[session_id] = time.monotonic()
+
+            while len(self.sessions) > self.max_sessions:
+                self._evict(next(iter(self.sessions)))
+            return session
+
+    def close(self, session_id: str) -> None:
+        """
+        Forget a session, including its spilled state.
+
+        Args:
+            session_id (str): The session id.
+        """
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            self.last_used.pop(session_id, None)
+            if self.spill_dir and os.path.exists(self._spill_path(session_id)):
+                os.remove(self._spill_path(session_id))
+
+    def enforce_bound(self, session: ChatWithDocs) -> None:
+        """
+        Drop the oldest turns of a session until its state fits in `max_session_bytes`.
+        The last exchange is always kept.
+
+        Args:
+            session (ChatWithDocs): The session.
+        """
+        while self.session_bytes(session) > self.max_session_bytes and len(session.conversation_history) > 2:
+            session.drop_oldest_exchange()
+            self.stats["trimmed_turns"] += 1
+
+    def intent(self, session_id: str, query: str, patient_id: Optional[str] = None) -> str:
+        """
+        Answer a query in the given session, see 'ChatWithDocs.intent'.
+
+        Args:
+            session_id (str): The session id.
+            query (str): The user query.
+            patient_id (str): The patient of the session, used when the session is created.
+
+        Returns:
+            str: The generated response.
+        """
+        session = self.get(session_id, patient_id)
+        response = session.intent(query)
+        self.enforce_bound(session)
+        return response
+
+    async def aintent(self, session_id: str, query: str, patient_id: Optional[str] = None) -> str:
+        """
+        Async variant of 'intent', see 'ChatWithDocs.aintent'.
+
+        Args:
+            session_id (str): The session id.
+            query (str): The user query.
+            patient_id (str): The patient of the session, used when the session is created.
+
+        Returns:
+            str: The generated response.
+        """
+        session = self.get(session_id, patient_id)
+        response = await session.aintent(query)
+        self.enforce_bound(session)
+        return response
@@ -5,11 +5,18 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def print_timings(report):
+    stages = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in report["stages"].items())
+    print(f"\n⏱️ {stages} | total {report['total_time'] * 1000:.0f}ms | tokens {report['prompt_tokens']} in, {report['completion_tokens']} out")
+
 def main():
     parser = argparse.ArgumentParser(description="CLI chatbot with document retrieval")
     parser.add_argument("--model", default="gpt-4o-mini", help="LLM model to use")
     parser.add_argument("--embedding", default="text-embedding-3-small", help="Embedding model to use")
+    parser.add_argument("--embedding-backend", default="openai", choices=["openai", "local"], help="Embed with the OpenAI API or offline")
     parser.add_argument("--top-k", type=int, default=2, help="Number of documents to retrieve")
+    parser.add_argument("--stream", action="store_true", help="Print the response tokens as they arrive")
+    parser.add_argument("--timings", action="store_true", help="Print the stage timings of every turn")
     args = parser.parse_args()
 
     # Initialize the chatbot
@@ -17,7 +24,9 @@ def main():
     chatbot = ChatWithDocs(
         llm_model=args.model,
         embed_model=args.embedding,
-        top_k=args.top_k
+        top_k=args.top_k,
+        embedding_backend=args.embedding_backend,
+        turn_hooks=[print_timings] if args.timings else None
     )  
 
     print("\n=== 📑 ChatWithDocs CLI 📑 ===")
@@ -32,6 +41,13 @@ def main():
                 
             # Get response
             print("\n🧠🤔 Thinking . . . ")
+            if args.stream:
+                print("\n🤖 Assistant => ", end="", flush=True)
+                for token in chatbot.intent_stream(user_input):
+                    print(token, end="", flush=True)
+                print(f"\n\n⏱️ First token after {chatbot.stream_stats['time_to_first_token'] or 0:.2f}s")
+                continue
+
             response = chatbot.intent(user_input)
             
             print(f"\n🤖 Assistant => {response}")
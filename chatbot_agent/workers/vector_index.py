@@ -0,0 +1,340 @@
+"""
+Dense vector index for the chat worker.
+Keeps all chunk embeddings in one contiguous, L2-normalised matrix that is memory-mapped from disk,
+so that several worker processes can share the same pages. Scoring is a single matrix-vector product
+followed by an `argpartition` top-k.
+New rows are written in place into spare rows of the matrix file, which doubles in size when it is full,
+and their ids are appended to the ids file, so adding a few chunks costs only those chunks. A small
+metadata file, replaced last, records how many rows are valid. Writes hold a file lock and start from
+the latest state on disk, so that processes sharing the index do not drop each other's rows.
+"""
+
+import os, json
+from contextlib import contextmanager
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Rows of the k highest scores, with an `argpartition` instead of a full sort.
+
+    Args:
+        scores (np.ndarray): One score per row.
+        k (int): Number of rows to return.
+
+    Returns:
+        np.ndarray: Row numbers sorted by decreasing score.
+    """
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+class DenseVectorIndex:
+    """Exact cosine similarity index over a memory-mapped embedding matrix."""
+
+    # Rows scored per block, bounds the temporary memory used for float16 matrices
+    block_size = 65536
+    # Rows of a new matrix file, it then doubles whenever it is full
+    min_capacity = 1024
+
+    def __init__(self, path: str = "vector_index", dtype: str = "float32", model_name: str = "") -> None:
+        """
+        Initialize the index and memory-map the existing matrix from disk, if any.
+
+        Args:
+            path (str): Path prefix of the index files (`<path>.npy`, `<path>.ids`, `<path>.meta.json` and `<path>.lock`).
+            dtype (str): Storage dtype of the matrix, "float32" or "float16".
+            model_name (str): Name of the embedding model, an index built with another model is discarded.
+        """
+        assert dtype in ("float32", "float16"), "dtype must be float32 or float16"
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.model_name = model_name
+        self.matrix_path = f"{path}.npy"
+        self.ids_path = f"{path}.ids"
+        self.meta_path = f"{path}.meta.json"
+        self.lock_path = f"{path}.lock"
+
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix: Optional[np.ndarray] = None # The valid rows of `_mapped`
+        self.version = 0 # Increases with every write to the index files, by any process
+        self._mapped: Optional[np.ndarray] = None # The whole matrix file, spare rows included
+        self._ids_bytes = 0
+        self._disk_version = 0
+        self._loaded_stamp = None
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.rows
+
+    @contextmanager
+    def _locked(self, shared: bool = False):
+        """
+        Hold the index file lock, shared for readers and exclusive for writers.
+        """
+        with open(self.lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _meta_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.meta_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> None:
+        """
+        Memory-map the matrix and read the row ids from disk.
+        A missing, mismatched or corrupted index is treated as empty.
+        """
+        if not os.path.exists(self.meta_path):
+            self._load()
+            return
+        with self._locked(shared = True):
+            self._load()
+
+    def _load(self) -> None:
+        """
+        'load' with the file lock held.
+        """
+        self.ids, self.rows, self.matrix, self._mapped = [], {}, None, None
+        self.version, self._ids_bytes, self._disk_version = 0, 0, 0
+        self._loaded_stamp = self._meta_stamp()
+        if self._loaded_stamp is None:
+            return
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            self._disk_version = meta.get("version", 0)
+            count, ids_bytes = meta["count"], meta["ids_bytes"]
+            with open(self.ids_path, "rb") as f:
+                ids = f.read(ids_bytes).decode("utf-8").split("\n")[:-1]
+            mapped = np.load(self.matrix_path, mmap_mode="r")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error loading vector index: {e}")
+            return
+
+        if (
+            meta.get("model") != self.model_name
+            or mapped.dtype != self.dtype
+            or mapped.ndim != 2
+            or mapped.shape[0] < count
+            or len(ids) != count
+        ):
+            print("Vector index on disk does not match the configuration, rebuilding it")
+            return
+
+        self.ids = ids
+        self.rows = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._mapped = mapped
+        self.matrix = mapped[:count]
+        self._ids_bytes = ids_bytes
+        self.version = self._disk_version
+
+    def reload_if_changed(self) -> None:
+        """
+        Re-map the index if another process has written to it since it was loaded.
+        Only stats the metadata file when nothing changed.
+        """
+        if self._meta_stamp() != self._loaded_stamp:
+            self.load()
+
+    @contextmanager
+    def _writing(self):
+        """
+        Hold the exclusive file lock, with the latest state of the index loaded.
+        """
+        with self._locked():
+            if self._meta_stamp() != self._loaded_stamp:
+                self._load()
+            yield
+
+    def _commit(self, count: int) -> None:
+        """
+        Publish the first `count` rows and ids: atomically replace the metadata file.
+        """
+        version = self._disk_version + 1
+        with open(f"{self.meta_path}.tmp", "w") as f:
+            json.dump({"model": self.model_name, "count": count, "ids_bytes": self._ids_bytes, "version": version}, f)
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+        self._loaded_stamp = self._meta_stamp()
+        self._disk_version = self.version = version
+
+    def _write_matrix(self, capacity: int, dim: int, rows: Optional[np.ndarray] = None) -> None:
+        """
+        Atomically replace the matrix file with a new one of `capacity` rows, starting with `rows`.
+        Processes that still map the old file keep reading it until they reload.
+        """
+        # Release the current mapping first, the file cannot be replaced while mapped on Windows
+        self.matrix, self._mapped = None, None
+
+        matrix = np.lib.format.open_memmap(f"{self.matrix_path}.tmp", mode="w+", dtype=self.dtype, shape=(capacity, dim))
+        if rows is not None and len(rows):
+            for start in range(0, len(rows), self.block_size):
+                block = rows[start:start + self.block_size]
+                matrix[start:start + len(block)] = block
+        matrix.flush()
+        del matrix
+        os.replace(f"{self.matrix_path}.tmp", self.matrix_path)
+        self._mapped = np.load(self.matrix_path, mmap_mode="r")
+
+    def add(self, ids: List[str], vectors: List[List[float]]) -> None:
+        """
+        Add new rows to the index. Ids that are already indexed are skipped.
+        The rows are written in place into the spare rows of the matrix file.
+
+        Args:
+            ids (List[str]): The ids of the new rows (chunk content hashes).
+            vectors (List[List[float]]): One embedding per id.
+        """
+        if not ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+
+        with self._writing():
+            keep, seen = [], set()
+            for i, doc_id in enumerate(ids):
+                if doc_id not in self.rows and doc_id not in seen:
+                    keep.append(i)
+                    seen.add(doc_id)
+            if not keep:
+                return
+            new_ids = [ids[i] for i in keep]
+            new_matrix = matrix[keep]
+
+            count, dim = len(self.ids), new_matrix.shape[1]
+            if count and self._mapped.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {dim} does not match the index ({self._mapped.shape[1]})")
+
+            if self._mapped is None or self._mapped.shape[1] != dim or count + len(new_ids) > self._mapped.shape[0]:
+                capacity = max(self.min_capacity, count + len(new_ids), 2 * (self._mapped.shape[0] if count else 0))
+                self._write_matrix(capacity, dim, self._mapped[:count] if count else None)
+
+            # Rows past `count` are not read by anyone until the metadata is replaced
+            mapped = np.load(self.matrix_path, mmap_mode="r+")
+            mapped[count:count + len(new_ids)] = new_matrix
+            mapped.flush()
+            del mapped
+
+            with open(self.ids_path, "r+b" if os.path.exists(self.ids_path) else "wb") as f:
+                f.seek(self._ids_bytes)
+                f.truncate()
+                f.write("".join(f"{doc_id}\n" for doc_id in new_ids).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                self._ids_bytes = f.tell()
+            self._commit(count + len(new_ids))
+
+            for row, doc_id in enumerate(new_ids, start = count):
+                self.rows[doc_id] = row
+            self.ids.extend(new_ids)
+            self.matrix = self._mapped[:len(self.ids)]
+
+    def remove(self, ids: List[str]) -> None:
+        """
+        Remove rows from the index. Unknown ids are ignored.
+        The remaining rows are rewritten to new files, readers keep the old ones until they reload.
+        Removals only happen when records of the data file change, all of them in one call.
+
+        Args:
+            ids (List[str]): The ids of the rows to remove.
+        """
+        with self._writing():
+            drop = {self.rows[doc_id] for doc_id in ids if doc_id in self.rows}
+            if not drop:
+                return
+
+            keep = np.asarray([row for row in range(len(self.ids)) if row not in drop], dtype=np.int64)
+            kept_ids = [self.ids[row] for row in keep]
+            dim = self._mapped.shape[1]
+            self._write_matrix(max(self.min_capacity, 2 * len(keep)), dim, np.asarray(self.matrix)[keep])
+
+            with open(f"{self.ids_path}.tmp", "wb") as f:
+                f.write("".join(f"{doc_id}\n" for doc_id in kept_ids).encode("utf-8"))
+                self._ids_bytes = f.tell()
+            os.replace(f"{self.ids_path}.tmp", self.ids_path)
+            self._commit(len(kept_ids))
+
+            self.ids = kept_ids
+            self.rows = {doc_id: row for row, doc_id in enumerate(kept_ids)}
+            self.matrix = self._mapped[:len(kept_ids)]
+
+    def scores(self, query_vector: List[float], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Compute the cosine similarity of the query with every row, or only with the given rows.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            rows (np.ndarray): Row numbers to score (e.g. ANN candidates), all rows when None.
+
+        Returns:
+            np.ndarray: One float32 score per (given) row.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        if rows is not None:
+            out = np.empty(len(rows), dtype=np.float32)
+            for start in range(0, len(rows), self.block_size):
+                block = np.asarray(self.matrix[rows[start:start + self.block_size]], dtype=np.float32)
+                out[start:start + len(block)] = block @ query
+            return out
+
+        if self.dtype == np.float32:
+            return np.asarray(self.matrix @ query)
+
+        # numpy has no BLAS path for float16, upcast block by block
+        out = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), self.block_size):
+            block = self.matrix[start:start + self.block_size].astype(np.float32)
+            out[start:start + len(block)] = block @ query
+        return out
+
+    def search(self, query_vector: List[float], k: int) -> List[Tuple[str, float]]:
+        """
+        Find the k rows most similar to the query, including the rows added by other processes.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            k (int): Number of results to return.
+
+        Returns:
+            List[Tuple[str, float]]: (id, score) pairs sorted by decreasing score.
+        """
+        self.reload_if_changed()
+        if self.matrix is None or not self.ids or k <= 0:
+            return []
+
+        scores = self.scores(query_vector)
+        top = top_k_rows(scores, k)
+        return [(self.ids[row], float(scores[row])) for row in top]
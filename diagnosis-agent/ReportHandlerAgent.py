@@ -2,6 +2,7 @@
 File for agent which takes the query from the user and forwards it to the required agent.
 """
 
+import os
 from uagents import Agent, Context, Model
 
 """
@@ -25,6 +26,11 @@ CHEST_XRAY_AGENT_ADDRESS = "agent1qdpsw05ma4wd92647zssdyd2hvyu2qfffn39y7yqvstpf8
 MRI_AGENT_ADDRESS = "agent1qf0mqfr25jtrarxs3jh9t4xl42snz5k6q7nfnjj4v8qgy8phzd75y689zry"
 LUNG_AGENT_ADDRESS = "agent1qw3adtswm99rnmah2gapuq0pelaqkhhe7f5qte2c088m062uuupqcuq5fuy"  # <-- Added lung agent address
 
+# When set, all medical images go to the InferenceHostAgent instead of the per-modality agents
+INFERENCE_HOST_AGENT_ADDRESS = os.getenv("INFERENCE_HOST_AGENT_ADDRESS")
+if INFERENCE_HOST_AGENT_ADDRESS:
+    CHEST_XRAY_AGENT_ADDRESS = MRI_AGENT_ADDRESS = LUNG_AGENT_ADDRESS = INFERENCE_HOST_AGENT_ADDRESS
+
 """
 Startup Handler with User Options
 """
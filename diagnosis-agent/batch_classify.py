@@ -0,0 +1,310 @@
+"""
+Offline batch classification of medical images, for backfills.
+Takes a directory of images of one modality, or a manifest of thousands of X-ray, MRI and CT files,
+decodes them in parallel, runs them through the image models in batches and streams one JSON line per
+image to the output file as soon as its batch completes. The output file is also the checkpoint: rerunning
+the same command skips the images already in it, so an interrupted run resumes where it stopped.
+
+Manifests are text files with one image path per line (using --model), CSV files with `path` and
+optional `model` columns, or JSONL files with `path` and optional `model` keys.
+
+Example:
+    python batch_classify.py --input scans/xrays --model chest_xray --output xray_results.jsonl
+    python batch_classify.py --manifest backfill.csv --output backfill_results.jsonl --decode-processes
+"""
+
+import os, sys, csv, json, time
+import argparse
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from inference.model_registry import ModelRegistry
+from inference.model_specs import MODEL_SPECS, predict
+from inference.modes import IMAGE_EXTENSIONS
+from inference.preprocessing import PreprocessConfig, load_image_with_digest
+from inference.result_cache import ResultCache
+
+"""
+Inputs
+"""
+
+def find_images(directory: str, recursive: bool) -> Iterator[str]:
+    """
+    Image files of a directory, in sorted order, as absolute paths so that a rerun from another
+    working directory matches the checkpoint.
+    """
+    directory = os.path.abspath(directory)
+    if not recursive:
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(directory, name)
+        return
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def read_manifest(path: str, default_model: Optional[str]) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    (image path, model name) pairs of a text, CSV or JSONL manifest.
+    Relative image paths are relative to the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(image_path: str) -> str:
+        return image_path if os.path.isabs(image_path) else os.path.join(base, image_path)
+
+    with open(path, "r", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield resolve(entry["path"]), entry.get("model") or default_model
+        elif path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield resolve(row["path"]), row.get("model") or default_model
+        else:
+            for line in f:
+                if line.strip() and not line.startswith("#"):
+                    yield resolve(line.strip()), default_model
+
+
+def completed_items(output_path: str, retry_errors: bool) -> Set[Tuple[str, str]]:
+    """
+    (image path, model name) pairs already in the output file of a previous run.
+    A line cut by an interruption is ignored, so its image is classified again.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if retry_errors and "error" in record:
+                continue
+            done.add((record["path"], record["model"]))
+    return done
+
+"""
+Decoding
+"""
+
+def timed_decode(file_path: str, config: PreprocessConfig) -> Tuple[str, np.ndarray, float]:
+    """
+    Decodes and preprocesses an image in a decode worker.
+
+    Returns:
+        Tuple[str, np.ndarray, float]: The pixel hash, the preprocessed array and the decoding time in seconds
+    """
+    start = time.perf_counter()
+    digest, image = load_image_with_digest(file_path, config)
+    return digest, image, time.perf_counter() - start
+
+"""
+Batch Classifier
+"""
+
+class BatchClassifier:
+    """Streams the images through the decode pool, the models and the output file."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.specs = {spec.name: spec for spec in MODEL_SPECS}
+        self.registry = ModelRegistry(MODEL_SPECS, memory_cap_mb=args.memory_cap_mb)
+        self.cache = ResultCache.from_env() if args.cache else None
+
+        self.buffers: Dict[str, list] = defaultdict(list)  # Decoded images waiting for a full batch
+        self.output = None
+        self.unsynced = 0
+        self.counts = {"classified": 0, "cached": 0, "errors": 0, "skipped": 0}
+        self.timings = {"decode": 0.0, "load": 0.0, "inference": 0.0, "write": 0.0}
+        self.start = time.perf_counter()
+
+    def write(self, record: dict) -> None:
+        """
+        Append a result line, flushed at once and synced to disk every `checkpoint_every` lines.
+        """
+        start = time.perf_counter()
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.args.checkpoint_every:
+            os.fsync(self.output.fileno())
+            self.unsynced = 0
+        self.timings["write"] += time.perf_counter() - start
+
+        if "error" in record:
+            self.counts["errors"] += 1
+        elif record.get("cached"):
+            self.counts["cached"] += 1
+        else:
+            self.counts["classified"] += 1
+        done = self.counts["classified"] + self.counts["cached"] + self.counts["errors"]
+        if self.args.progress_every and done % self.args.progress_every == 0:
+            rate = done / (time.perf_counter() - self.start)
+            print(f"{done} images, {rate:.1f} images/s")
+
+    def run_batch(self, model: str) -> None:
+        """
+        Run the buffered images of a model through it in one forward pass and write their results.
+        """
+        batch, self.buffers[model] = self.buffers[model], []
+        if not batch:
+            return
+        try:
+            start = time.perf_counter()
+            loaded, fingerprint = self.registry.loaded(model)
+            self.timings["load"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = predict(loaded, self.specs[model], [torch.from_numpy(image) for _, _, image in batch])
+            self.timings["inference"] += time.perf_counter() - start
+        except Exception as e:
+            for path, _, _ in batch:
+                self.write({"path": path, "model": model, "error": str(e)})
+            return
+
+        for (path, digest, _), result in zip(batch, results):
+            if self.cache is not None and fingerprint is not None:
+                self.cache.put(model, fingerprint, digest, result)
+            self.write({"path": path, "model": model, "result": result})
+
+    def decoded(self, path: str, model: str, future) -> None:
+        """
+        Handle a finished decode: write errors and cache hits, buffer the rest for their model's next batch.
+        """
+        try:
+            digest, image, seconds = future.result()
+        except Exception as e:
+            self.write({"path": path, "model": model, "error": f"Error processing image: {e}"})
+            return
+        self.timings["decode"] += seconds
+
+        fingerprint = self.registry.fingerprint(model) if self.cache is not None else None
+        if fingerprint is not None:
+            result = self.cache.get(fingerprint, digest)
+            if result is not None:
+                self.write({"path": path, "model": model, "result": result, "cached": True})
+                return
+
+        self.buffers[model].append((path, digest, image))
+        if len(self.buffers[model]) >= self.args.batch_size:
+            self.run_batch(model)
+
+    def run(self, items: Iterator[Tuple[str, Optional[str]]]) -> None:
+        """
+        Classify all items. Decoding runs ahead of inference by at most `decode_ahead` images,
+        which bounds the memory held by decoded images.
+        """
+        args = self.args
+        done = completed_items(args.output, args.retry_errors)
+        pool_class = ProcessPoolExecutor if args.decode_processes else ThreadPoolExecutor
+        decode_pool = pool_class(args.decode_workers)
+
+        # A line cut by an interruption is completed so that the next record starts on its own line
+        if os.path.exists(args.output) and os.path.getsize(args.output):
+            with open(args.output, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    with open(args.output, "a") as out:
+                        out.write("\n")
+        self.output = open(args.output, "a")
+
+        in_flight = {}
+        try:
+            for path, model in items:
+                if (path, model) in done:
+                    self.counts["skipped"] += 1
+                    continue
+                if model not in self.specs:
+                    self.write({"path": path, "model": model, "error": f"Unknown model {model}"})
+                    continue
+                future = decode_pool.submit(timed_decode, path, self.specs[model].preprocess)
+                in_flight[future] = (path, model)
+                while len(in_flight) >= args.decode_ahead:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self.decoded(*in_flight.pop(future), future)
+
+            for future in list(in_flight):
+                self.decoded(*in_flight.pop(future), future)
+            for model in list(self.buffers):
+                self.run_batch(model)
+        except KeyboardInterrupt:
+            print("\nInterrupted, rerun the same command to resume")
+        finally:
+            decode_pool.shutdown(wait=False, cancel_futures=True)
+            self.output.flush()
+            os.fsync(self.output.fileno())
+            self.output.close()
+            if self.cache is not None:
+                self.cache.close()
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        processed = self.counts["classified"] + self.counts["cached"] + self.counts["errors"]
+        lines = [
+            f"\n{processed} images in {elapsed:.1f}s: {processed / elapsed if elapsed else 0.0:.1f} images/s "
+            f"({self.counts['classified']} classified, {self.counts['cached']} cached, {self.counts['errors']} errors, "
+            f"{self.counts['skipped']} already done)",
+            f"{'stage':<22}{'total s':>10}{'ms/image':>10}",
+        ]
+        stages = [
+            ("decode (worker time)", self.timings["decode"], processed),
+            ("model loading", self.timings["load"], processed),
+            ("inference", self.timings["inference"], self.counts["classified"]),
+            ("write", self.timings["write"], processed),
+        ]
+        for name, seconds, count in stages:
+            lines.append(f"{name:<22}{seconds:>10.2f}{seconds / count * 1000 if count else 0.0:>10.2f}")
+        return "\n".join(lines)
+
+"""
+Main Execution
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a directory or manifest of medical images to JSONL")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory of images of one modality (requires --model)")
+    source.add_argument("--manifest", help="Text, CSV or JSONL manifest of image paths and models")
+    parser.add_argument("--model", choices=[spec.name for spec in MODEL_SPECS], help="Model of the images without one")
+    parser.add_argument("--output", required=True, help="JSONL output file, also the checkpoint of the run")
+    parser.add_argument("--recursive", action="store_true", help="Also classify the images of subdirectories")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 4, help="Parallel decoders")
+    parser.add_argument("--decode-processes", action="store_true", help="Decode in processes instead of threads")
+    parser.add_argument("--decode-ahead", type=int, default=256, help="Maximum decoded images waiting for inference")
+    parser.add_argument("--memory-cap-mb", type=float, default=None, help="Resident models cap for mixed manifests")
+    parser.add_argument("--cache", action="store_true", help="Read and fill the result cache (INFERENCE_CACHE_PATH)")
+    parser.add_argument("--retry-errors", action="store_true", help="Classify again the images that failed before")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Results between two syncs to disk")
+    parser.add_argument("--progress-every", type=int, default=1000, help="Images between two progress lines, 0 for none")
+    args = parser.parse_args()
+
+    if args.input and not args.model:
+        parser.error("--input requires --model")
+
+    if args.input:
+        items = ((path, args.model) for path in find_images(args.input, args.recursive))
+    else:
+        items = read_manifest(args.manifest, args.model)
+
+    classifier = BatchClassifier(args)
+    classifier.run(items)
+    print(classifier.summary())
+
+
+if __name__ == "__main__":
+    main()
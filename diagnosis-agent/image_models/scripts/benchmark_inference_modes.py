@@ -0,0 +1,174 @@
+"""
+Inference Modes Benchmark
+
+Runs one image model on the CPU in every inference mode (see inference/modes.py) over a held-out
+folder of images, and with --onnx the exported graph on onnxruntime (see export_onnx.py). For each
+mode it reports:
+- startup: model load time and the latency of the first (cold) inference;
+- accuracy parity against fp32: prediction agreement and largest probability difference;
+- batch-1 latency percentiles;
+- batched throughput.
+It then recommends the fastest mode that stays within the tolerances. Set that mode in the
+model's *_MODE environment variable (or *_BACKEND=onnx for the onnx row).
+
+Example:
+    python benchmark_inference_modes.py --model lung_ct --images ../../data/LungCancer_Data/test/normal --onnx
+"""
+
+import os, sys, time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from inference.modes import INFERENCE_MODES, calibration_batches, list_images
+from inference.model_specs import MODEL_SPECS
+from inference.preprocessing import load_image
+
+"""
+Measurement
+"""
+
+def run_batches(model, images: torch.Tensor, batch_size: int) -> torch.Tensor:
+    """
+    Runs all images through the model, `batch_size` images per forward pass.
+
+    Returns:
+        torch.Tensor: The concatenated fp32 logits
+    """
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            outputs.append(model(images[start:start + batch_size]).float())
+    return torch.cat(outputs)
+
+
+def probabilities(logits: torch.Tensor, multi_label: bool) -> torch.Tensor:
+    return torch.sigmoid(logits) if multi_label else torch.softmax(logits, dim=1)
+
+
+def parity(logits: torch.Tensor, reference: torch.Tensor, multi_label: bool) -> dict:
+    """
+    Compares the outputs of a mode with the fp32 outputs.
+
+    Returns:
+        dict: Fraction of images with the same prediction (same set of labels above 50% for
+              multi-label models, same top class otherwise) and largest absolute probability difference
+    """
+    probs, reference_probs = probabilities(logits, multi_label), probabilities(reference, multi_label)
+    if multi_label:
+        same = ((probs > 0.5) == (reference_probs > 0.5)).all(dim=1)
+    else:
+        same = probs.argmax(dim=1) == reference_probs.argmax(dim=1)
+    return {
+        "agreement": same.float().mean().item(),
+        "max_prob_diff": (probs - reference_probs).abs().max().item()
+    }
+
+
+def latency(model, images: torch.Tensor, samples: int) -> dict:
+    """
+    Batch-1 latency percentiles in milliseconds.
+    """
+    times = []
+    with torch.no_grad():
+        for image in images[:samples]:
+            start = time.perf_counter()
+            model(image.unsqueeze(0))
+            times.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": float(np.percentile(times, 50)), "p95_ms": float(np.percentile(times, 95))}
+
+
+def throughput(model, images: torch.Tensor, batch_size: int, repeats: int) -> float:
+    """
+    Images per second of batched inference, best of `repeats` passes over the images.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_batches(model, images, batch_size)
+        best = min(best, time.perf_counter() - start)
+    return len(images) / best
+
+"""
+Main Execution
+"""
+
+def main():
+    specs = {spec.name: spec for spec in MODEL_SPECS}
+
+    parser = argparse.ArgumentParser(description="Parity, latency and throughput of the inference modes of a model")
+    parser.add_argument("--model", required=True, choices=list(specs), help="Model to benchmark")
+    parser.add_argument("--images", required=True, help="Held-out folder of images of the model's modality")
+    parser.add_argument("--calibration", default=None, help="Calibration images folder of int8_static (default: --images)")
+    parser.add_argument("--calibration-images", type=int, default=64, help="Number of calibration images")
+    parser.add_argument("--modes", nargs="+", default=list(INFERENCE_MODES), choices=INFERENCE_MODES, help="Modes to compare")
+    parser.add_argument("--onnx", action="store_true", help="Also run the exported graph on onnxruntime")
+    parser.add_argument("--limit", type=int, default=256, help="Maximum number of held-out images")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size of the throughput runs")
+    parser.add_argument("--latency-samples", type=int, default=32, help="Number of batch-1 latency runs")
+    parser.add_argument("--repeats", type=int, default=3, help="Throughput passes, the best one is reported")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch default)")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Minimum prediction agreement with fp32")
+    parser.add_argument("--max-prob-diff", type=float, default=0.05, help="Maximum probability difference with fp32")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    spec = specs[args.model]
+    paths = list_images(args.images)[:args.limit]
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+    images = torch.from_numpy(np.stack([load_image(path, spec.preprocess) for path in paths]))
+    calibration = calibration_batches(args.calibration or args.images, spec.preprocess, limit=args.calibration_images)
+    print(f"{spec.name}: {len(paths)} held-out images, {torch.get_num_threads()} threads, "
+          f"quantized engine {torch.backends.quantized.engine}\n")
+
+    # fp32 is the reference of the parity check, it always runs first
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"] + (["onnx"] if args.onnx else [])
+    cpu = torch.device("cpu")
+    reference, results = None, {}
+
+    print(f"{'mode':<15}{'load s':>8}{'first ms':>10}{'agree':>8}{'max diff':>10}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>9}{'MB':>8}")
+    for mode in modes:
+        try:
+            start = time.perf_counter()
+            if mode == "onnx":
+                model = spec.load(device=cpu, backend="onnx")
+            else:
+                model = spec.load(device=cpu, mode=mode, calibration=calibration if mode == "int8_static" else None, backend="torch")
+            load_seconds = time.perf_counter() - start
+            first_ms = latency(model, images, 1)["p50_ms"]
+            logits = run_batches(model, images, args.batch_size)  # Also warms the mode up
+        except Exception as e:
+            print(f"{mode:<15}unsupported: {e}")
+            continue
+
+        if reference is None:
+            reference = logits
+        result = parity(logits, reference, spec.multi_label)
+        result.update(latency(model, images, args.latency_samples))
+        result["images_per_second"] = throughput(model, images, args.batch_size, args.repeats)
+        result["resident_mb"] = model.resident_bytes / (1024 * 1024)
+        results[mode] = result
+        print(f"{mode:<15}{load_seconds:>8.2f}{first_ms:>10.1f}{result['agreement']:>8.3f}{result['max_prob_diff']:>10.4f}"
+              f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['images_per_second']:>9.1f}"
+              f"{result['resident_mb']:>8.1f}")
+
+    if "fp32" not in results:
+        sys.exit("The fp32 baseline could not run, check the weights path")
+    within = {
+        mode: result for mode, result in results.items()
+        if result["agreement"] >= args.min_agreement and result["max_prob_diff"] <= args.max_prob_diff
+    }
+    if within:
+        best = max(within, key=lambda mode: within[mode]["images_per_second"])
+        speedup = within[best]["images_per_second"] / results["fp32"]["images_per_second"]
+        print(f"\nFastest mode within tolerance: {best} ({speedup:.2f}x fp32 throughput)")
+
+
+if __name__ == "__main__":
+    main()
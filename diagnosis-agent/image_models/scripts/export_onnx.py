@@ -0,0 +1,93 @@
+"""
+ONNX Export Script
+
+Exports the image models (the CLASS_NAMES-sized heads loaded by the agents) to ONNX with a dynamic
+batch axis, to the *_ONNX paths of inference/model_specs.py (next to the weights by default), and checks
+the exported graphs against PyTorch on onnxruntime. Select the graph with the model's *_BACKEND=onnx
+environment variable.
+
+Example:
+    python export_onnx.py --model chest_xray lung_ct
+"""
+
+import os, sys
+import argparse, inspect
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from inference.model_specs import MODEL_SPECS
+from inference.onnx_backend import OnnxModel
+
+"""
+Export
+"""
+
+def export(spec, path: str, opset: int) -> torch.nn.Module:
+    """
+    Exports the fp32 torch model of a spec.
+
+    Returns:
+        torch.nn.Module: The exported torch model, for the parity check
+    """
+    model = spec.load(device=torch.device("cpu"), mode="fp32", backend="torch").model
+
+    height, width = spec.preprocess.size
+    example = torch.zeros(1, 3, height, width)
+    options = {}
+    if "external_data" in inspect.signature(torch.onnx.export).parameters:
+        # Recent exporters write the weights to a side file by default, keep a single file
+        options["external_data"] = False
+    torch.onnx.export(
+        model, (example,), path,
+        input_names=["image"], output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        **options
+    )
+    return model
+
+
+def check(model: torch.nn.Module, spec, path: str, batch_size: int) -> float:
+    """
+    Largest absolute logit difference between PyTorch and onnxruntime on a random batch.
+    """
+    height, width = spec.preprocess.size
+    batch = torch.randn(batch_size, 3, height, width)
+    with torch.no_grad():
+        expected = model(batch).numpy()
+    actual = OnnxModel(path)(batch).numpy()
+    return float(np.abs(expected - actual).max())
+
+"""
+Main Execution
+"""
+
+def main():
+    specs = {spec.name: spec for spec in MODEL_SPECS}
+
+    parser = argparse.ArgumentParser(description="Export the image models to ONNX")
+    parser.add_argument("--model", nargs="+", default=list(specs), choices=list(specs), help="Models to export")
+    parser.add_argument("--output-dir", default=None, help="Output folder (default: the *_ONNX paths)")
+    parser.add_argument("--opset", type=int, default=18, help="ONNX opset version")
+    parser.add_argument("--check-batch-size", type=int, default=3, help="Batch size of the parity check, 0 to skip it")
+    args = parser.parse_args()
+
+    for name in args.model:
+        spec = specs[name]
+        path = spec.onnx_path
+        if args.output_dir:
+            path = os.path.join(args.output_dir, os.path.basename(path))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        model = export(spec, path, args.opset)
+        print(f"{name}: exported to {path} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+        if args.check_batch_size:
+            diff = check(model, spec, path, args.check_batch_size)
+            print(f"{name}: max logit difference with PyTorch on a batch of {args.check_batch_size}: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,6 @@ File for agent which takes brain MRI images and predicts tumor type
 """
 
 import torch
-import torch.nn as nn
-import torchvision.transforms as transforms
-from PIL import Image
-from efficientnet_pytorch import EfficientNet
 from uagents import Agent, Context
 
 '''
@@ -15,6 +11,11 @@ Request & Response Models
 - MRIResponse: returns the predicted tumor type as a string
 '''
 from agent_models.mri_models import MRIRequest, MRIResponse
+from inference.executor import InferenceExecutor, AgentBusyError
+from inference.preprocessing import load_image, load_image_with_digest, MRI_PREPROCESS
+from inference.model_specs import load_brain_mri, BRAIN_MRI, MRI_CLASS_NAMES
+from inference.model_registry import model_fingerprint
+from inference.result_cache import ResultCache
 
 '''
 Agent Configuration
@@ -30,32 +31,29 @@ REPORT_HANDLER_AGENT_ADDRESS = "agent1qfteffcpfqhrsj9mpcjxvza42axkr5y9zva0fnmgzt
 Load Pre-trained Brain Tumor Classification Model (EfficientNet-B3)
 '''
 
-# Path to trained model weights
-MODEL_PATH = "/Users/js/Desktop/ReportSense-Agentic-AI-Backend/diagnosis-agent/image_models/weights/brain_mri_model.pt"
-
 # Class labels for brain tumor classification
-CLASS_NAMES = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+CLASS_NAMES = MRI_CLASS_NAMES
 
 # Use GPU (Apple MPS) if available, otherwise fallback to CPU
 DEVICE = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
 
-# Load EfficientNet-B3 model and adjust output layer
-model = EfficientNet.from_name('efficientnet-b3')
-model._fc = nn.Linear(model._fc.in_features, len(CLASS_NAMES))
-model.load_state_dict(torch.load(MODEL_PATH, map_location=DEVICE))
-model = model.to(DEVICE)
-model.eval()
+# Fingerprint of the weights loaded below, keys the cached results of the model
+MRI_FINGERPRINT = model_fingerprint(BRAIN_MRI)
+
+# Load EfficientNet-B3 model with the adjusted output layer, weights from BRAIN_MRI_WEIGHTS
+model = load_brain_mri(DEVICE)
 
 '''
-Image Preprocessing Pipeline
+Image Preprocessing & Executors
+- Images are resized to 300x300 (EfficientNet-B3 input), converted to 3-channel grayscale
+  and normalized, see MRI_PREPROCESS.
+- Decoding and forward passes run off the event loop, requests past INFERENCE_MAX_PENDING
+  are answered with an error at once (see InferenceExecutor.from_env).
+- Results of scans analyzed before are served from the result cache (see ResultCache.from_env).
 '''
 
-transform = transforms.Compose([
-    transforms.Resize((300, 300)),  # Resize to match EfficientNet-B3 input
-    transforms.Grayscale(num_output_channels=3),  # Ensure 3-channel input
-    transforms.ToTensor(),
-    transforms.Normalize([0.5] * 3, [0.5] * 3)  # Normalize image
-])
+executor = InferenceExecutor.from_env()
+result_cache = ResultCache.from_env()
 
 '''
 Brain MRI Analysis Handler
@@ -77,18 +75,45 @@ async def analyze_mri(ctx: Context, sender: str, message: MRIRequest):
     file_path = message.file_path
     ctx.logger.info(f"Received brain MRI analysis request from {sender}: {file_path}")
 
-    prediction = classify_mri(file_path)
+    try:
+        prediction = await result_cache.run(
+            BRAIN_MRI.name, MRI_FINGERPRINT, file_path, decode_mri_image, infer_mri, admit=executor.admit
+        )
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting brain MRI analysis request from {sender}: {e}")
+        prediction = f"Error processing image: {str(e)}"
+    except Exception as e:
+        prediction = f"Error processing image: {str(e)}"
 
     ctx.logger.info(f"Sending analysis result to ReportHandlerAgent: {prediction}")
     response = MRIResponse(tumor_prediction=prediction)
     await ctx.send(REPORT_HANDLER_AGENT_ADDRESS, response)
 
 '''
-Brain MRI Tumor Classification Function
-- Takes a file path, transforms the image, runs inference,
+Brain MRI Tumor Classification Functions
+- predict_mri runs a batch of preprocessed images through the model,
+  classify_mri takes a file path, transforms the image, runs inference,
   and returns the predicted tumor class.
 '''
 
+def predict_mri(images: list) -> list:
+    """
+    Runs a batch of preprocessed images through the EfficientNet-B3 model.
+
+    Args:
+        images (list): Image tensors of shape (3, 300, 300)
+
+    Returns:
+        list: Predicted tumor type of every image
+    """
+    batch = torch.stack(images).to(DEVICE)
+
+    with torch.no_grad():
+        output = model(batch)
+        _, preds = torch.max(output, 1)
+
+    return [CLASS_NAMES[pred] for pred in preds.tolist()]
+
 def classify_mri(file_path: str):
     """
     Classifies a brain MRI image using the EfficientNet-B3 model.
@@ -100,24 +125,29 @@ def classify_mri(file_path: str):
         str: Predicted tumor type or error message
     """
     try:
-        image = Image.open(file_path).convert("L")  # Ensure grayscale input
-        image = transform(image).unsqueeze(0).to(DEVICE)  # Add batch dimension
-
-        with torch.no_grad():
-            output = model(image)
-            _, pred = torch.max(output, 1)
-            predicted_class = CLASS_NAMES[pred.item()]
-
-        return predicted_class
+        image = torch.from_numpy(load_image(file_path, MRI_PREPROCESS))
+        return predict_mri([image])[0]
 
     except Exception as e:
         return f"Error processing image: {str(e)}"
 
+async def decode_mri_image(file_path: str):
+    return await executor.decode(load_image_with_digest, file_path, MRI_PREPROCESS)
+
+async def infer_mri(image) -> tuple:
+    return (await executor.infer(predict_mri, [torch.from_numpy(image)]))[0], MRI_FINGERPRINT
+
 '''
 Main Execution
 - Prints the agent's address and starts the agent server.
 '''
 
+@brain_mri_agent.on_event("shutdown")
+async def stop_inference(ctx: Context):
+    executor.shutdown()
+    ctx.logger.info(result_cache.report())
+    result_cache.close()
+
 if __name__ == "__main__":
     print(f"BrainMRIAgent Address: {brain_mri_agent.address}")
     brain_mri_agent.run()
\ No newline at end of file
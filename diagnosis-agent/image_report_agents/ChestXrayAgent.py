@@ -3,11 +3,9 @@ File for agent which takes text chest xray images and predict the diseases
 """
 
 
+import os
 import torch
-import torchvision.transforms as transforms
-from PIL import Image
 from uagents import Agent, Context
-from torchvision import models
 
 '''
 Request & Response Models
@@ -18,6 +16,12 @@ import sys
 # Add the parent directory to the path
 sys.path.append("..")
 from agent_models.xray_models import XrayRequest, XrayResponse
+from inference.batching import MicroBatcher
+from inference.executor import InferenceExecutor, AgentBusyError
+from inference.preprocessing import load_image, load_image_with_digest, XRAY_PREPROCESS
+from inference.model_specs import load_chexnet, xray_conditions, CHEST_XRAY, XRAY_CLASS_NAMES
+from inference.model_registry import model_fingerprint
+from inference.result_cache import ResultCache
 
 
 '''
@@ -37,27 +41,26 @@ Load Pre-trained CheXNet Model (DenseNet-121)
 # Use GPU if available, otherwise fallback to CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load DenseNet-121 model architecture without pretrained classifier
-model = models.densenet121(pretrained=False)
-
 # Class labels for ChestX-ray14 dataset (14 disease conditions)
-CLASS_NAMES = [
-    "Atelectasis", "Cardiomegaly", "Consolidation", "Edema", "Effusion",
-    "Emphysema", "Fibrosis", "Hernia", "Infiltration", "Mass", "Nodule",
-    "Pleural Thickening", "Pneumonia", "Pneumothorax"
-]
+CLASS_NAMES = XRAY_CLASS_NAMES
 
-# Modify final classifier layer to output 14 disease probabilities
-model.classifier = torch.nn.Linear(model.classifier.in_features, len(CLASS_NAMES))
+# Fingerprint of the weights loaded below, keys the cached results of the model
+XRAY_FINGERPRINT = model_fingerprint(CHEST_XRAY)
 
-# Load model weights (ignoring mismatched layers like old classifier)
-state_dict = torch.load("C:/Users/91790/Desktop/Projects/ReportSense-Agentic-AI-Backend/diagnosis-agent/image_models/weights/chexnet_model.pth", map_location=device)
-filtered_state_dict = {k: v for k, v in state_dict.items() if "classifier" not in k}  # Remove outdated classifier weights
-model.load_state_dict(filtered_state_dict, strict=False)
+# Load DenseNet-121 with a 14-class classifier, weights from CHEXNET_WEIGHTS
+model = load_chexnet(device)
 
-# Move model to appropriate device and set to evaluation mode
-model = model.to(device)
-model.eval()
+'''
+Micro-Batching & Executors
+- Requests arriving within XRAY_MAX_BATCH_WAIT seconds are run through CheXNet in one forward pass,
+  up to XRAY_MAX_BATCH_SIZE images per pass.
+- Decoding and forward passes run off the event loop, requests past INFERENCE_MAX_PENDING
+  are answered with an error at once (see InferenceExecutor.from_env).
+- Results of scans analyzed before are served from the result cache (see ResultCache.from_env).
+'''
+
+MAX_BATCH_SIZE = int(os.getenv("XRAY_MAX_BATCH_SIZE", "16"))
+MAX_BATCH_WAIT = float(os.getenv("XRAY_MAX_BATCH_WAIT", "0.01"))
 
 '''
 Chest X-ray Processing Handler
@@ -79,8 +82,16 @@ async def analyze_xray(ctx: Context, sender: str, message: XrayRequest):
     file_path = message.file_path
     ctx.logger.info(f"Received chest X-ray analysis request from {sender}: {file_path}")
 
-    # Analyze the X-ray and return disease probabilities
-    detected_conditions = classify_xray(file_path)
+    # Analyze the X-ray and return disease probabilities, batched with the concurrent requests
+    try:
+        detected_conditions = await result_cache.run(
+            CHEST_XRAY.name, XRAY_FINGERPRINT, file_path, decode_xray_image, infer_xray, admit=executor.admit
+        )
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting chest X-ray analysis request from {sender}: {e}")
+        detected_conditions = {"Error processing image": str(e)}
+    except Exception as e:
+        detected_conditions = {"Error processing image": str(e)}
 
     # Send the analysis results back to the ReportHandlerAgent
     ctx.logger.info(f"Sending analysis result to ReportHandlerAgent: {detected_conditions}")
@@ -88,14 +99,59 @@ async def analyze_xray(ctx: Context, sender: str, message: XrayRequest):
     await ctx.send(REPORT_HANDLER_AGENT_ADDRESS, response)
 
 '''
-Chest X-ray Multi-Label Classification Function
-- This function takes an image path, processes it, runs inference,
-  and returns disease predictions with confidence scores.
+Chest X-ray Multi-Label Classification Functions
+- preprocess_xray loads an image into a normalized tensor,
+  predict_xray runs a batch of tensors through CheXNet,
+  postprocess_xray turns the probabilities of one image into the detected conditions.
 '''
 
+def preprocess_xray(file_path: str) -> torch.Tensor:
+    """
+    Loads and preprocesses a chest X-ray image.
+
+    Args:
+        file_path (str): Path to the X-ray image
+
+    Returns:
+        torch.Tensor: Normalized image tensor of shape (3, 224, 224)
+    """
+    return torch.from_numpy(load_image(file_path, XRAY_PREPROCESS))
+
+def predict_xray(images: list) -> torch.Tensor:
+    """
+    Runs a batch of preprocessed images through CheXNet in a single forward pass.
+
+    Args:
+        images (list): Image tensors returned by preprocess_xray
+
+    Returns:
+        torch.Tensor: Disease probabilities of shape (len(images), 14), on the CPU
+    """
+    batch = torch.stack(images).to(device)
+
+    # Run inference without computing gradients
+    with torch.no_grad():
+        output = model(batch)
+        probabilities = torch.sigmoid(output)  # Sigmoid for multi-label classification
+
+    return probabilities.cpu()
+
+def postprocess_xray(probabilities: torch.Tensor) -> dict:
+    """
+    Selects the detected conditions of one image.
+
+    Args:
+        probabilities (torch.Tensor): The 14 disease probabilities of the image
+
+    Returns:
+        dict: Dictionary of detected conditions with confidence scores
+    """
+    # Only return conditions with probability > 50%, or a default message
+    return xray_conditions(probabilities)
+
 def classify_xray(file_path: str):
     """
-    Classifies a chest X-ray image using the CheXNet model.
+    Classifies a single chest X-ray image using the CheXNet model.
     Returns multiple detected conditions with confidence scores.
 
     Args:
@@ -105,32 +161,35 @@ def classify_xray(file_path: str):
         dict: Dictionary of detected conditions with confidence scores
     """
     try:
-        # Load and preprocess the image
-        image = Image.open(file_path).convert("RGB")
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),  # Resize to match CheXNet input size
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        image = transform(image).unsqueeze(0).to(device)
-
-        # Run inference without computing gradients
-        with torch.no_grad():
-            output = model(image)
-            probabilities = torch.sigmoid(output[0])  # Sigmoid for multi-label classification
-
-        # Only return conditions with probability > 50%
-        detected_conditions = {
-            CLASS_NAMES[i]: round(probabilities[i].item() * 100, 2)
-            for i in range(len(CLASS_NAMES)) if probabilities[i].item() > 0.5
-        }
-
-        # Return results or default message
-        return detected_conditions if detected_conditions else {"No disease detected": 0.0}
+        return postprocess_xray(predict_xray([preprocess_xray(file_path)])[0])
 
     except Exception as e:
         return {"Error processing image": str(e)}
 
+# Runs decoding and inference off the event loop
+executor = InferenceExecutor.from_env()
+
+# Batches the forward passes of concurrent requests, see predict_xray
+xray_batcher = MicroBatcher(
+    predict_xray, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT, executor=executor.inference_pool
+)
+
+# Results of the scans analyzed before, invalidated when the weights change
+result_cache = ResultCache.from_env()
+
+async def decode_xray_image(file_path: str):
+    return await executor.decode(load_image_with_digest, file_path, XRAY_PREPROCESS)
+
+async def infer_xray(image) -> tuple:
+    return postprocess_xray(await xray_batcher.submit(torch.from_numpy(image))), XRAY_FINGERPRINT
+
+@chest_xray_agent.on_event("shutdown")
+async def stop_inference(ctx: Context):
+    await xray_batcher.stop()
+    executor.shutdown()
+    ctx.logger.info(result_cache.report())
+    result_cache.close()
+
 '''
 Main Execution
 - Prints the agent's address and starts the agent server.
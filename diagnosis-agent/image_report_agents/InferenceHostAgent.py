@@ -0,0 +1,186 @@
+"""
+File for agent which serves chest X-ray, brain MRI and lung CT requests from a single process.
+The three models share one torch runtime and are loaded from the model registry on first use;
+when their total size exceeds MODEL_MEMORY_CAP_MB, the least recently used one is evicted.
+"""
+
+import os
+import torch
+from uagents import Agent, Context
+
+'''
+Request & Response Models
+- XrayRequest / XrayResponse: chest X-ray file path, detected conditions
+- MRIRequest / MRIResponse: brain MRI file path, predicted tumor type
+- LungRequest / LungResponse: lung CT file path, predicted cancer type
+'''
+import sys
+# Add the parent directory to the path
+sys.path.append("..")
+from agent_models.xray_models import XrayRequest, XrayResponse
+from agent_models.mri_models import MRIRequest, MRIResponse
+from agent_models.lung_models import LungRequest, LungResponse
+from inference.batching import MicroBatcher
+from inference.executor import InferenceExecutor, AgentBusyError
+from inference.preprocessing import load_image_with_digest
+from inference.model_registry import ModelRegistry
+from inference.model_specs import MODEL_SPECS, CHEST_XRAY, BRAIN_MRI, LUNG_CT, predict
+from inference.result_cache import ResultCache
+
+
+'''
+Agent Configuration
+'''
+
+# Create the InferenceHostAgent (Runs locally on port 8006)
+inference_host_agent = Agent(name="InferenceHostAgent", port=8006, endpoint="http://localhost:8006/submit")
+
+# Maximum total size of the resident models in MB (0 for no cap)
+MEMORY_CAP_MB = float(os.getenv("MODEL_MEMORY_CAP_MB", "0"))
+
+# Micro-batching of the concurrent requests of each model
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+MAX_BATCH_WAIT = float(os.getenv("INFERENCE_MAX_BATCH_WAIT", "0.01"))
+
+# Interval in seconds between two logs of the model statistics
+STATS_INTERVAL = float(os.getenv("MODEL_STATS_INTERVAL", "300"))
+
+'''
+Model Registry & Executors
+- No model is loaded at startup, each one is loaded by the first batch that needs it.
+- Decoding and forward passes run off the event loop, requests past INFERENCE_MAX_PENDING
+  are answered with an error at once (see InferenceExecutor.from_env).
+- Results of scans analyzed before are served from the result cache (see ResultCache.from_env),
+  without loading their model. Results are keyed on the fingerprint of the weights each model
+  was loaded from, so a model reloaded from new weights does not serve the old results.
+'''
+
+registry = ModelRegistry(MODEL_SPECS, memory_cap_mb=MEMORY_CAP_MB)
+executor = InferenceExecutor.from_env()
+result_cache = ResultCache.from_env()
+
+def batch_predictor(name: str):
+    """
+    Creates the batch function of a model: loads the model from the registry and runs the batch through it.
+
+    Args:
+        name (str): The model name
+
+    Returns:
+        Callable: Takes a list of image tensors, returns one (decoded result, model fingerprint) pair per image
+    """
+    spec = registry.specs[name]
+
+    def predict_batch(images: list) -> list:
+        model, fingerprint = registry.loaded(name)
+        return [(result, fingerprint) for result in predict(model, spec, images)]
+
+    return predict_batch
+
+batchers = {
+    spec.name: MicroBatcher(
+        batch_predictor(spec.name), max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT,
+        executor=executor.inference_pool
+    )
+    for spec in MODEL_SPECS
+}
+
+async def run_model(name: str, file_path: str):
+    """
+    Decodes an image and runs it through a model, batched with the concurrent requests of the same model,
+    unless its result is cached.
+
+    Args:
+        name (str): The model name
+        file_path (str): Path to the image
+
+    Returns:
+        Any: The decoded model output of the image
+    """
+    preprocess = registry.specs[name].preprocess
+
+    async def decode(path: str):
+        return await executor.decode(load_image_with_digest, path, preprocess)
+
+    async def infer(image):
+        return await batchers[name].submit(torch.from_numpy(image))
+
+    return await result_cache.run(name, registry.fingerprint(name), file_path, decode, infer, admit=executor.admit)
+
+'''
+Request Handlers
+- Each handler replies to the sender with the response model of its request type.
+'''
+
+@inference_host_agent.on_message(model=XrayRequest)
+async def analyze_xray(ctx: Context, sender: str, message: XrayRequest):
+    ctx.logger.info(f"Received chest X-ray analysis request from {sender}: {message.file_path}")
+    try:
+        detected_conditions = await run_model(CHEST_XRAY.name, message.file_path)
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting chest X-ray analysis request from {sender}: {e}")
+        detected_conditions = {"Error processing image": str(e)}
+    except Exception as e:
+        detected_conditions = {"Error processing image": str(e)}
+
+    ctx.logger.info(f"Sending chest X-ray analysis result to {sender}: {detected_conditions}")
+    await ctx.send(sender, XrayResponse(detected_conditions=detected_conditions))
+
+@inference_host_agent.on_message(model=MRIRequest)
+async def analyze_mri(ctx: Context, sender: str, message: MRIRequest):
+    ctx.logger.info(f"Received brain MRI analysis request from {sender}: {message.file_path}")
+    try:
+        prediction = await run_model(BRAIN_MRI.name, message.file_path)
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting brain MRI analysis request from {sender}: {e}")
+        prediction = f"Error processing image: {str(e)}"
+    except Exception as e:
+        prediction = f"Error processing image: {str(e)}"
+
+    ctx.logger.info(f"Sending brain MRI analysis result to {sender}: {prediction}")
+    await ctx.send(sender, MRIResponse(tumor_prediction=prediction))
+
+@inference_host_agent.on_message(model=LungRequest)
+async def handle_lung_ct(ctx: Context, sender: str, message: LungRequest):
+    ctx.logger.info(f"Received lung CT scan from {sender}: {message.file_path}")
+    try:
+        prediction = await run_model(LUNG_CT.name, message.file_path)
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting lung CT scan from {sender}: {e}")
+        prediction = f"Error: {str(e)}"
+    except Exception as e:
+        prediction = f"Error: {str(e)}"
+
+    ctx.logger.info(f"Sending lung CT prediction to {sender}: {prediction}")
+    await ctx.send(sender, LungResponse(cancer_prediction=prediction))
+
+'''
+Statistics & Shutdown
+'''
+
+@inference_host_agent.on_interval(period=STATS_INTERVAL)
+async def log_model_stats(ctx: Context):
+    ctx.logger.info(f"Model registry:\n{registry.report()}")
+    ctx.logger.info(result_cache.report())
+    for name, batcher in batchers.items():
+        if batcher.stats["batches"]:
+            ctx.logger.info(f"{name}: {batcher.stats['items']} images in {batcher.stats['batches']} batches "
+                            f"(mean batch size {batcher.mean_batch_size:.1f})")
+
+@inference_host_agent.on_event("shutdown")
+async def stop_inference(ctx: Context):
+    for batcher in batchers.values():
+        await batcher.stop()
+    executor.shutdown()
+    ctx.logger.info(f"Model registry:\n{registry.report()}")
+    ctx.logger.info(result_cache.report())
+    result_cache.close()
+
+'''
+Main Execution
+- Prints the agent's address and starts the agent server.
+'''
+
+if __name__ == "__main__":
+    print(f"InferenceHostAgent Address: {inference_host_agent.address}")
+    inference_host_agent.run()
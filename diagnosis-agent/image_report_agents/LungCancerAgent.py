@@ -7,12 +7,14 @@ and returns the predicted label to a connected agent.
 """
 
 import torch
-import torch.nn as nn
-from torchvision import transforms, models
-from PIL import Image
 from uagents import Agent, Context
 
 from agent_models.lung_models import LungRequest, LungResponse
+from inference.executor import InferenceExecutor, AgentBusyError
+from inference.preprocessing import load_image, load_image_with_digest, LUNG_PREPROCESS
+from inference.model_specs import load_lung_ct, LUNG_CT, LUNG_CLASS_NAMES
+from inference.model_registry import model_fingerprint
+from inference.result_cache import ResultCache
 
 """
 Agent Configuration
@@ -28,33 +30,29 @@ REPORT_HANDLER_AGENT_ADDRESS = "agent1qfteffcpfqhrsj9mpcjxvza42axkr5y9zva0fnmgzt
 Model Configuration
 """
 
-# Path to the trained ResNet18 model weights
-MODEL_PATH = "/Users/js/Desktop/LungCancerDetection/lung_cancer_model.pth"
-
 # Class labels in the same order as used during training
-CLASS_NAMES = ['adenocarcinoma', 'large cell carcinoma', 'normal', 'squamous cell carcinoma']
+CLASS_NAMES = LUNG_CLASS_NAMES
 
 # Select appropriate device (Apple MPS if available, else CPU)
 DEVICE = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
 
-# Load the ResNet18 model and modify the classifier layer
-model = models.resnet18(pretrained=False)
-model.fc = nn.Linear(model.fc.in_features, len(CLASS_NAMES))
-model.load_state_dict(torch.load(MODEL_PATH, map_location=DEVICE))
-model = model.to(DEVICE)
-model.eval()
+# Fingerprint of the weights loaded below, keys the cached results of the model
+LUNG_FINGERPRINT = model_fingerprint(LUNG_CT)
+
+# Load the ResNet18 model with the modified classifier layer, weights from LUNG_CT_WEIGHTS
+model = load_lung_ct(DEVICE)
 
 """
-Image Preprocessing
+Image Preprocessing & Executors
+
+Images are resized to 224x224 and normalized with the ImageNet statistics, see LUNG_PREPROCESS.
+Decoding and forward passes run off the event loop, requests past INFERENCE_MAX_PENDING
+are answered with an error at once (see InferenceExecutor.from_env).
+Results of scans analyzed before are served from the result cache (see ResultCache.from_env).
 """
 
-# Transform pipeline to resize, normalize, and convert the image to tensor
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406],
-                         [0.229, 0.224, 0.225])
-])
+executor = InferenceExecutor.from_env()
+result_cache = ResultCache.from_env()
 
 """
 Lung CT Scan Handler
@@ -76,18 +74,45 @@ async def handle_lung_ct(ctx: Context, sender: str, message: LungRequest):
     file_path = message.file_path
     ctx.logger.info(f"Received lung CT scan from {sender}: {file_path}")
 
-    prediction = classify_lung_ct(file_path)
+    try:
+        prediction = await result_cache.run(
+            LUNG_CT.name, LUNG_FINGERPRINT, file_path, decode_lung_image, infer_lung_ct, admit=executor.admit
+        )
+    except AgentBusyError as e:
+        ctx.logger.warning(f"Rejecting lung CT scan from {sender}: {e}")
+        prediction = f"Error: {str(e)}"
+    except Exception as e:
+        prediction = f"Error: {str(e)}"
 
     ctx.logger.info(f"Prediction result: {prediction}")
     response = LungResponse(cancer_prediction=prediction)
     await ctx.send(REPORT_HANDLER_AGENT_ADDRESS, response)
 
 """
-Prediction Function
+Prediction Functions
 
-Takes an image file path, processes it, and predicts the class using the model.
+predict_lung_ct runs a batch of preprocessed images through the model,
+classify_lung_ct takes an image file path, processes it, and predicts the class using the model.
 """
 
+def predict_lung_ct(images: list) -> list:
+    """
+    Runs a batch of preprocessed images through the ResNet18 model.
+
+    Args:
+        images (list): Image tensors of shape (3, 224, 224)
+
+    Returns:
+        list: Predicted cancer type of every image
+    """
+    batch = torch.stack(images).to(DEVICE)
+
+    with torch.no_grad():
+        output = model(batch)
+        _, preds = torch.max(output, 1)
+
+    return [CLASS_NAMES[pred] for pred in preds.tolist()]
+
 def classify_lung_ct(file_path: str):
     """
     Classifies a lung CT image using the trained ResNet18 model.
@@ -99,22 +124,29 @@ def classify_lung_ct(file_path: str):
         str: Predicted cancer type or error message
     """
     try:
-        image = Image.open(file_path).convert("RGB")
-        image = transform(image).unsqueeze(0).to(DEVICE)
-
-        with torch.no_grad():
-            output = model(image)
-            _, pred = torch.max(output, 1)
-            return CLASS_NAMES[pred.item()]
+        image = torch.from_numpy(load_image(file_path, LUNG_PREPROCESS))
+        return predict_lung_ct([image])[0]
     except Exception as e:
         return f"Error: {str(e)}"
 
+async def decode_lung_image(file_path: str):
+    return await executor.decode(load_image_with_digest, file_path, LUNG_PREPROCESS)
+
+async def infer_lung_ct(image) -> tuple:
+    return (await executor.infer(predict_lung_ct, [torch.from_numpy(image)]))[0], LUNG_FINGERPRINT
+
 """
 Main Execution
 
 Prints the agent address and starts the UAgents runtime.
 """
 
+@lung_agent.on_event("shutdown")
+async def stop_inference(ctx: Context):
+    executor.shutdown()
+    ctx.logger.info(result_cache.report())
+    result_cache.close()
+
 if __name__ == "__main__":
     print(f"LungCancerAgent Address: {lung_agent.address}")
     lung_agent.run()
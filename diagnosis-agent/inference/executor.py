@@ -0,0 +1,133 @@
+"""
+Executors running the blocking work of the image agents off the uAgents event loop.
+Model forward passes run in a small dedicated thread pool (torch releases the GIL and parallelizes
+each operation itself), image decoding runs in a separate thread or process pool. The number of
+requests in flight is bounded: past `max_pending`, new requests are rejected at once with
+AgentBusyError, so that a burst degrades into fast error replies instead of an ever-growing queue.
+"""
+
+import asyncio, os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+
+class AgentBusyError(RuntimeError):
+    """Raised when a request arrives while `max_pending` requests are already in flight."""
+
+
+class InferenceExecutor:
+    """Thread pool for inference, pool for decoding, and admission control of the requests."""
+
+    def __init__(
+        self,
+        max_pending: int = 64,
+        inference_threads: int = 1,
+        decode_workers: int = 2,
+        decode_processes: bool = False
+    ) -> None:
+        """
+        Initialize the executor. The pools are created on first use.
+
+        Args:
+            max_pending (int): Maximum number of requests being decoded, queued or run at the same time.
+            inference_threads (int): Number of threads running forward passes.
+            decode_workers (int): Number of decode threads or processes.
+            decode_processes (bool): Decode in worker processes instead of threads. The decode functions
+                must be importable without loading a model (see inference.preprocessing), and with the
+                "spawn" start method (Windows, macOS) the workers re-import the main module.
+        """
+        assert max_pending >= 1, "max_pending must be at least 1"
+
+        self.max_pending = max_pending
+        self.inference_threads = inference_threads
+        self.decode_workers = decode_workers
+        self.decode_processes = decode_processes
+
+        self.pending = 0
+        self._inference_pool = None
+        self._decode_pool = None
+        self.stats = {"admitted": 0, "rejected": 0, "max_pending": 0}
+
+    @classmethod
+    def from_env(cls) -> "InferenceExecutor":
+        """
+        Create an executor configured by the INFERENCE_MAX_PENDING, INFERENCE_THREADS,
+        INFERENCE_DECODE_WORKERS and INFERENCE_DECODE_PROCESSES environment variables.
+        """
+        return cls(
+            max_pending=int(os.getenv("INFERENCE_MAX_PENDING", "64")),
+            inference_threads=int(os.getenv("INFERENCE_THREADS", "1")),
+            decode_workers=int(os.getenv("INFERENCE_DECODE_WORKERS", "2")),
+            decode_processes=os.getenv("INFERENCE_DECODE_PROCESSES", "0").lower() in ("1", "true", "yes")
+        )
+
+    @property
+    def inference_pool(self) -> Executor:
+        """The thread pool of the forward passes, e.g. to give to a MicroBatcher."""
+        if self._inference_pool is None:
+            self._inference_pool = ThreadPoolExecutor(self.inference_threads, thread_name_prefix="inference")
+        return self._inference_pool
+
+    @property
+    def decode_pool(self) -> Executor:
+        if self._decode_pool is None:
+            if self.decode_processes:
+                self._decode_pool = ProcessPoolExecutor(self.decode_workers)
+            else:
+                self._decode_pool = ThreadPoolExecutor(self.decode_workers, thread_name_prefix="decode")
+        return self._decode_pool
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """
+        Count a request as in flight for the duration of the block.
+
+        Raises:
+            AgentBusyError: If `max_pending` requests are already in flight.
+        """
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise AgentBusyError(f"Agent busy, {self.pending} requests in flight, retry later")
+        self.pending += 1
+        self.stats["admitted"] += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"], self.pending)
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def decode(self, fn: Callable, *args: Any) -> Any:
+        """
+        Run a decoding function in the decode pool.
+
+        Args:
+            fn (Callable): The function, picklable (defined at module level) when decoding in processes.
+            *args: Its arguments.
+
+        Returns:
+            Any: The result of the function.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.decode_pool, fn, *args)
+
+    async def infer(self, fn: Callable, *args: Any) -> Any:
+        """
+        Run an inference function in the inference thread pool.
+
+        Args:
+            fn (Callable): The function.
+            *args: Its arguments.
+
+        Returns:
+            Any: The result of the function.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.inference_pool, fn, *args)
+
+    def shutdown(self) -> None:
+        """
+        Stop the pools, without waiting for the running tasks.
+        """
+        for pool in (self._inference_pool, self._decode_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._inference_pool = self._decode_pool = None
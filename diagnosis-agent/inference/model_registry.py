@@ -0,0 +1,275 @@
+"""
+Registry of the image models served by an inference host.
+Models are loaded on first use and kept in LRU order; when the resident models exceed the memory cap,
+the least recently used ones are evicted and reloaded on their next request. Load times, resident
+sizes, hits and evictions are tracked per model. Each model is fingerprinted from the weights it is
+loaded from, so that its cached results (see inference.result_cache) are keyed on the model actually served.
+"""
+
+import gc, hashlib, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from inference.preprocessing import PreprocessConfig, PREPROCESSING_VERSION
+
+
+@dataclass
+class ModelSpec:
+    """How to load and run one model."""
+    name: str
+    load: Callable[..., Any]  # Builds the model with its weights, ready for inference (optional device, mode, backend)
+    preprocess: PreprocessConfig
+    postprocess: Callable[[Any], List[Any]]  # Batch of model outputs -> one result per image
+    weights_path: str = ""
+    onnx_path: str = ""  # Exported graph of the onnx backend
+    mode: str = "fp32"  # Default inference mode of `load`
+    backend: str = "torch"  # Default backend of `load`
+    class_names: List[str] = field(default_factory=list)
+    multi_label: bool = False  # Sigmoid outputs (several classes per image) instead of softmax
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Hex SHA-256 digest of a file's content.
+
+    Args:
+        path (str): The file
+        block_size (int): Bytes read at a time
+
+    Returns:
+        str: The digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_fingerprint(spec: ModelSpec) -> Optional[str]:
+    """
+    Identity of the results of a model: hash of the weights (or exported graph) it is loaded from,
+    with its inference mode, backend and the preprocessing version.
+    Compute it when loading the model, the weights on disk may change afterwards.
+
+    Args:
+        spec (ModelSpec): The model specification
+
+    Returns:
+        Optional[str]: The fingerprint, None if the weights file cannot be read (results are not cached)
+    """
+    path = spec.onnx_path if spec.backend == "onnx" else spec.weights_path
+    try:
+        weights_hash = file_sha256(path)
+    except OSError as e:
+        print(f"Not caching {spec.name} results, cannot hash its weights: {e}")
+        return None
+    return f"{weights_hash[:32]}:{spec.backend}:{spec.mode}:v{PREPROCESSING_VERSION}"
+
+
+def resident_bytes(model: Any) -> int:
+    """
+    Memory held by a loaded model: its parameters and buffers for torch modules,
+    or its own `resident_bytes` attribute for other backends.
+
+    Args:
+        model (Any): The loaded model
+
+    Returns:
+        int: Size in bytes, 0 if unknown
+    """
+    if hasattr(model, "resident_bytes"):
+        return int(model.resident_bytes)
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+    return 0
+
+
+class ModelRegistry:
+    """Lazily loaded, memory-bounded set of models."""
+
+    def __init__(self, specs: Iterable[ModelSpec], memory_cap_mb: Optional[float] = None) -> None:
+        """
+        Initialize the registry. No model is loaded until it is requested.
+
+        Args:
+            specs (Iterable[ModelSpec]): The models that can be served.
+            memory_cap_mb (float): Maximum total size of the resident models in MB, None or 0 for no cap.
+                The requested model is always kept, even if it alone exceeds the cap.
+        """
+        self.specs: Dict[str, ModelSpec] = {spec.name: spec for spec in specs}
+        self.memory_cap = memory_cap_mb * 1024 * 1024 if memory_cap_mb else None
+
+        self.models: "OrderedDict[str, Any]" = OrderedDict()  # Least recently used first
+        self.sizes: Dict[str, int] = {}
+        self.fingerprints: Dict[str, Optional[str]] = {}  # Of the resident models, see model_fingerprint
+        self.disk_fingerprints: Dict[str, Tuple[Tuple[int, int], Optional[str]]] = {}  # (mtime, size) of the weights
+        self.lock = threading.Lock()  # Guards the dicts above, never held while a model loads
+        self.loading: Dict[str, Future] = {}  # Loads in progress, shared by concurrent requests for the model
+        self.stats: Dict[str, Dict[str, Any]] = {
+            name: {"hits": 0, "loads": 0, "load_seconds": 0.0, "resident_mb": 0.0, "evictions": 0}
+            for name in self.specs
+        }
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def get(self, name: str) -> Any:
+        """
+        Return a model, see `loaded`.
+
+        Args:
+            name (str): The model name
+
+        Returns:
+            Any: The loaded model
+        """
+        return self.loaded(name)[0]
+
+    def loaded(self, name: str) -> Tuple[Any, Optional[str]]:
+        """
+        Return a model and its fingerprint, loading it (and evicting others under the memory cap) if it is not resident.
+        Safe to call from several inference threads: concurrent requests for a model share a single load,
+        and the registry lock is only held to look models up and insert them, not during a load.
+
+        Args:
+            name (str): The model name
+
+        Returns:
+            Tuple[Any, Optional[str]]: The loaded model and the fingerprint of the weights it was loaded from
+        """
+        if name not in self.specs:
+            raise KeyError(f"Unknown model {name}, expected one of {', '.join(self.specs)}")
+
+        with self.lock:
+            stats = self.stats[name]
+            if name in self.models:
+                stats["hits"] += 1
+                self.models.move_to_end(name)
+                return self.models[name], self.fingerprints[name]
+            future = self.loading.get(name)
+            loads = future is None
+            if loads:
+                future = self.loading[name] = Future()
+
+        # Only the first request loads the model, the others wait for it while resident models keep being served
+        if not loads:
+            return future.result()
+        try:
+            start = time.perf_counter()
+            fingerprint = self.weights_fingerprint(name)
+            model = self.specs[name].load()
+            size = resident_bytes(model)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[name]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            stats["loads"] += 1
+            stats["load_seconds"] = time.perf_counter() - start
+            self.models[name] = model
+            self.sizes[name] = size
+            self.fingerprints[name] = fingerprint
+            stats["resident_mb"] = size / (1024 * 1024)
+            del self.loading[name]
+            self._evict(keep=name)
+        print(f"Loaded model {name} in {stats['load_seconds']:.2f}s ({stats['resident_mb']:.1f} MB)")
+        future.set_result((model, fingerprint))
+        return model, fingerprint
+
+    def fingerprint(self, name: str) -> Optional[str]:
+        """
+        Fingerprint of the model that serves the next request: the resident model,
+        or the weights on disk the next load would read.
+
+        Args:
+            name (str): The model name
+
+        Returns:
+            Optional[str]: The fingerprint, None if its results cannot be cached
+        """
+        with self.lock:
+            if name in self.models:
+                return self.fingerprints[name]
+        return self.weights_fingerprint(name)
+
+    def weights_fingerprint(self, name: str) -> Optional[str]:
+        """
+        Fingerprint of the weights of a model currently on disk, hashed again only when they change
+        (new mtime or size).
+
+        Args:
+            name (str): The model name
+
+        Returns:
+            Optional[str]: The fingerprint, None if the weights cannot be read
+        """
+        spec = self.specs[name]
+        try:
+            stat = os.stat(spec.onnx_path if spec.backend == "onnx" else spec.weights_path)
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self.disk_fingerprints.get(name)
+        if entry is None or entry[0] != version:
+            entry = self.disk_fingerprints[name] = (version, model_fingerprint(spec))
+        return entry[1]
+
+    def _evict(self, keep: str) -> None:
+        """
+        Evict the least recently used models until the resident models fit under the cap.
+        Must be called with the lock held.
+        """
+        if self.memory_cap is None:
+            return
+        evicted = False
+        for name in list(self.models):
+            if self.resident_bytes <= self.memory_cap:
+                break
+            if name == keep:
+                continue
+            self.unload(name)
+            evicted = True
+        if evicted:
+            # Release the evicted weights now rather than at the next collection
+            gc.collect()
+
+    def unload(self, name: str) -> None:
+        """
+        Drop a resident model. Requests already running with it finish normally.
+
+        Args:
+            name (str): The model name
+        """
+        if self.models.pop(name, None) is None:
+            return
+        self.sizes.pop(name, None)
+        self.fingerprints.pop(name, None)
+        self.stats[name]["evictions"] += 1
+        self.stats[name]["resident_mb"] = 0.0
+        print(f"Evicted model {name}")
+
+    def report(self) -> str:
+        """
+        Format the per-model statistics.
+
+        Returns:
+            str: One line per model
+        """
+        lines = [f"{len(self.models)} resident models, {self.resident_bytes / (1024 * 1024):.1f} MB"]
+        for name, stats in self.stats.items():
+            lines.append(
+                f"{name}: {'resident' if name in self.models else 'not loaded'}, {stats['hits']} hits, "
+                f"{stats['loads']} loads (last {stats['load_seconds']:.2f}s), {stats['resident_mb']:.1f} MB, "
+                f"{stats['evictions']} evictions"
+            )
+        return "\n".join(lines)
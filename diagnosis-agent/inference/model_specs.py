@@ -0,0 +1,276 @@
+"""
+Model specifications of the image agents: architecture, weights, preprocessing and output decoding.
+The weights paths are read from environment variables, defaulting to the paths the agents were developed with,
+and so are the inference modes (see inference.modes), defaulting to fp32, and the execution backends:
+"torch" (eager PyTorch) or "onnx" (the graph exported by export_onnx.py on onnxruntime, see inference.onnx_backend).
+"""
+
+import os, re
+from typing import Dict, Iterable, List, Optional
+
+import torch
+import torch.nn as nn
+
+from inference.model_registry import ModelSpec
+from inference.preprocessing import PreprocessConfig, XRAY_PREPROCESS, MRI_PREPROCESS, LUNG_PREPROCESS
+from inference.modes import apply_mode, calibration_batches, QUANTIZED_MODES
+from inference.onnx_backend import OnnxModel
+
+
+'''
+Weights & Device
+'''
+
+CHEXNET_WEIGHTS = os.getenv(
+    "CHEXNET_WEIGHTS",
+    "C:/Users/91790/Desktop/Projects/ReportSense-Agentic-AI-Backend/diagnosis-agent/image_models/weights/chexnet_model.pth"
+)
+BRAIN_MRI_WEIGHTS = os.getenv(
+    "BRAIN_MRI_WEIGHTS",
+    "/Users/js/Desktop/ReportSense-Agentic-AI-Backend/diagnosis-agent/image_models/weights/brain_mri_model.pt"
+)
+LUNG_CT_WEIGHTS = os.getenv("LUNG_CT_WEIGHTS", "/Users/js/Desktop/LungCancerDetection/lung_cancer_model.pth")
+
+# Inference mode of each model, see INFERENCE_MODES
+CHEXNET_MODE = os.getenv("CHEXNET_MODE", "fp32")
+BRAIN_MRI_MODE = os.getenv("BRAIN_MRI_MODE", "fp32")
+LUNG_CT_MODE = os.getenv("LUNG_CT_MODE", "fp32")
+
+# Execution backend of each model, "torch" or "onnx"
+BACKENDS = ("torch", "onnx")
+CHEXNET_BACKEND = os.getenv("CHEXNET_BACKEND", "torch")
+BRAIN_MRI_BACKEND = os.getenv("BRAIN_MRI_BACKEND", "torch")
+LUNG_CT_BACKEND = os.getenv("LUNG_CT_BACKEND", "torch")
+
+# Exported ONNX graphs, next to the weights by default
+CHEXNET_ONNX = os.getenv("CHEXNET_ONNX", os.path.splitext(CHEXNET_WEIGHTS)[0] + ".onnx")
+BRAIN_MRI_ONNX = os.getenv("BRAIN_MRI_ONNX", os.path.splitext(BRAIN_MRI_WEIGHTS)[0] + ".onnx")
+LUNG_CT_ONNX = os.getenv("LUNG_CT_ONNX", os.path.splitext(LUNG_CT_WEIGHTS)[0] + ".onnx")
+
+# Folder of sample images of each modality, calibrates the int8_static mode
+CHEXNET_CALIBRATION_DIR = os.getenv("CHEXNET_CALIBRATION_DIR", "")
+BRAIN_MRI_CALIBRATION_DIR = os.getenv("BRAIN_MRI_CALIBRATION_DIR", "")
+LUNG_CT_CALIBRATION_DIR = os.getenv("LUNG_CT_CALIBRATION_DIR", "")
+
+
+def default_device() -> torch.device:
+    """
+    Use CUDA if available, then Apple MPS, otherwise fallback to CPU.
+    """
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+DEVICE = default_device()
+
+'''
+Class Labels
+'''
+
+# ChestX-ray14 dataset (14 disease conditions)
+XRAY_CLASS_NAMES = [
+    "Atelectasis", "Cardiomegaly", "Consolidation", "Edema", "Effusion",
+    "Emphysema", "Fibrosis", "Hernia", "Infiltration", "Mass", "Nodule",
+    "Pleural Thickening", "Pneumonia", "Pneumothorax"
+]
+MRI_CLASS_NAMES = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+LUNG_CLASS_NAMES = ['adenocarcinoma', 'large cell carcinoma', 'normal', 'squamous cell carcinoma']
+
+'''
+Model Loaders
+- Each loader builds the fp32 model and prepares it for its inference mode.
+  The INT8 modes always run on the CPU, int8_static calibrates on the images of the model's
+  *_CALIBRATION_DIR unless calibration batches are given.
+- With the onnx backend, the loaders open the exported graph instead (on the CPU, the mode is ignored).
+'''
+
+def check_backend(backend: str) -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}")
+
+def inference_device(device: torch.device, mode: str) -> torch.device:
+    return torch.device("cpu") if mode in QUANTIZED_MODES else device
+
+def prepare(
+    model: nn.Module,
+    device: torch.device,
+    mode: str,
+    preprocess: PreprocessConfig,
+    calibration: Optional[Iterable[torch.Tensor]],
+    calibration_dir: str
+) -> nn.Module:
+    model = model.to(device).eval()
+    if mode == "int8_static" and calibration is None and calibration_dir:
+        calibration = calibration_batches(calibration_dir, preprocess)
+    return apply_mode(model, mode, device, calibration)
+
+def chexnet_state_dict(state_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """
+    Map the keys of a CheXNet checkpoint to torchvision's DenseNet-121: drops the DataParallel and
+    "densenet121." prefixes and the Sequential wrapping the classifier of the original CheXNet,
+    and renames the legacy "norm.1" style layer names.
+    """
+    remapped = {}
+    for key, value in state_dict.items():
+        key = re.sub(r"^(module\.)?(densenet121\.)?", "", key)
+        key = re.sub(r"^classifier\.0\.", "classifier.", key)
+        key = re.sub(r"\.(norm|relu|conv)\.(\d)\.", r".\1\2.", key)
+        remapped[key] = value
+    return remapped
+
+def load_chexnet(
+    device: torch.device = DEVICE,
+    mode: str = CHEXNET_MODE,
+    calibration: Optional[Iterable[torch.Tensor]] = None,
+    backend: str = CHEXNET_BACKEND
+) -> nn.Module:
+    """
+    CheXNet (DenseNet-121) with a 14-class classifier, loaded from the weights including their classifier.
+    A classifier of the weights that does not have 14 classes (like the 1000-class ImageNet head) is replaced
+    by one initialized from a fixed seed, so that every process and backend serves the same head.
+    """
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxModel.from_env(CHEXNET_ONNX)
+
+    from torchvision import models
+
+    device = inference_device(device, mode)
+
+    model = models.densenet121(pretrained=False)
+    model.classifier = nn.Linear(model.classifier.in_features, len(XRAY_CLASS_NAMES))
+
+    state_dict = chexnet_state_dict(torch.load(CHEXNET_WEIGHTS, map_location=device))
+    classifier = {k: v for k, v in state_dict.items() if k.startswith("classifier.")}
+    if classifier.get("classifier.weight") is None or classifier["classifier.weight"].shape != model.classifier.weight.shape:
+        print(f"CheXNet weights have no {len(XRAY_CLASS_NAMES)}-class classifier, using a seeded one")
+        state_dict = {k: v for k, v in state_dict.items() if k not in classifier}
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(0)
+            model.classifier.reset_parameters()
+    model.load_state_dict(state_dict, strict=False)
+    return prepare(model, device, mode, XRAY_PREPROCESS, calibration, CHEXNET_CALIBRATION_DIR)
+
+def load_brain_mri(
+    device: torch.device = DEVICE,
+    mode: str = BRAIN_MRI_MODE,
+    calibration: Optional[Iterable[torch.Tensor]] = None,
+    backend: str = BRAIN_MRI_BACKEND
+) -> nn.Module:
+    """
+    EfficientNet-B3 brain tumor classifier.
+    """
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxModel.from_env(BRAIN_MRI_ONNX)
+
+    from efficientnet_pytorch import EfficientNet
+
+    device = inference_device(device, mode)
+
+    model = EfficientNet.from_name('efficientnet-b3')
+    model._fc = nn.Linear(model._fc.in_features, len(MRI_CLASS_NAMES))
+    model.load_state_dict(torch.load(BRAIN_MRI_WEIGHTS, map_location=device))
+    # Plain swish: the memory-efficient one only saves memory in training, and cannot be traced or exported
+    model.set_swish(memory_efficient=False)
+    return prepare(model, device, mode, MRI_PREPROCESS, calibration, BRAIN_MRI_CALIBRATION_DIR)
+
+
+def load_lung_ct(
+    device: torch.device = DEVICE,
+    mode: str = LUNG_CT_MODE,
+    calibration: Optional[Iterable[torch.Tensor]] = None,
+    backend: str = LUNG_CT_BACKEND
+) -> nn.Module:
+    """
+    ResNet18 lung cancer classifier.
+    """
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxModel.from_env(LUNG_CT_ONNX)
+
+    from torchvision import models
+
+    device = inference_device(device, mode)
+
+    model = models.resnet18(pretrained=False)
+    model.fc = nn.Linear(model.fc.in_features, len(LUNG_CLASS_NAMES))
+    model.load_state_dict(torch.load(LUNG_CT_WEIGHTS, map_location=device))
+    return prepare(model, device, mode, LUNG_PREPROCESS, calibration, LUNG_CT_CALIBRATION_DIR)
+
+'''
+Output Decoding
+'''
+
+def xray_conditions(probabilities: torch.Tensor) -> dict:
+    """
+    Detected conditions of one X-ray: the conditions with probability > 50%, with confidence scores.
+
+    Args:
+        probabilities (torch.Tensor): The 14 disease probabilities of the image
+
+    Returns:
+        dict: Dictionary of detected conditions with confidence scores
+    """
+    detected_conditions = {
+        XRAY_CLASS_NAMES[i]: round(probabilities[i].item() * 100, 2)
+        for i in range(len(XRAY_CLASS_NAMES)) if probabilities[i].item() > 0.5
+    }
+    return detected_conditions if detected_conditions else {"No disease detected": 0.0}
+
+
+def decode_xray(outputs: torch.Tensor) -> List[dict]:
+    """Multi-label decoding of a batch of CheXNet logits."""
+    return [xray_conditions(probabilities) for probabilities in torch.sigmoid(outputs)]
+
+
+def argmax_decoder(class_names: List[str]):
+    """Single-label decoding of a batch of logits into class names."""
+    def decode(outputs: torch.Tensor) -> List[str]:
+        return [class_names[pred] for pred in torch.argmax(outputs, dim=1).tolist()]
+    return decode
+
+'''
+Specifications
+'''
+
+CHEST_XRAY = ModelSpec(
+    name="chest_xray", load=load_chexnet, preprocess=XRAY_PREPROCESS, postprocess=decode_xray,
+    weights_path=CHEXNET_WEIGHTS, onnx_path=CHEXNET_ONNX, mode=CHEXNET_MODE, backend=CHEXNET_BACKEND,
+    class_names=XRAY_CLASS_NAMES, multi_label=True
+)
+BRAIN_MRI = ModelSpec(
+    name="brain_mri", load=load_brain_mri, preprocess=MRI_PREPROCESS, postprocess=argmax_decoder(MRI_CLASS_NAMES),
+    weights_path=BRAIN_MRI_WEIGHTS, onnx_path=BRAIN_MRI_ONNX, mode=BRAIN_MRI_MODE, backend=BRAIN_MRI_BACKEND,
+    class_names=MRI_CLASS_NAMES
+)
+LUNG_CT = ModelSpec(
+    name="lung_ct", load=load_lung_ct, preprocess=LUNG_PREPROCESS, postprocess=argmax_decoder(LUNG_CLASS_NAMES),
+    weights_path=LUNG_CT_WEIGHTS, onnx_path=LUNG_CT_ONNX, mode=LUNG_CT_MODE, backend=LUNG_CT_BACKEND,
+    class_names=LUNG_CLASS_NAMES
+)
+
+MODEL_SPECS = [CHEST_XRAY, BRAIN_MRI, LUNG_CT]
+
+
+def predict(model: nn.Module, spec: ModelSpec, images: list, device: torch.device = DEVICE) -> list:
+    """
+    Runs a batch of preprocessed images through a model in a single forward pass.
+
+    Args:
+        model (nn.Module): The loaded model
+        spec (ModelSpec): Its specification
+        images (list): Image tensors of shape (3, height, width)
+        device (torch.device): Device of the model
+
+    Returns:
+        list: One decoded result per image
+    """
+    # The model moves the batch to its own device, e.g. the CPU for the INT8 modes
+    batch = torch.stack(images).to(device)
+    with torch.no_grad():
+        outputs = model(batch)
+    return spec.postprocess(outputs.cpu())
@@ -0,0 +1,150 @@
+"""
+CPU inference modes of the image models.
+- fp32: the model as trained (baseline)
+- channels_last: NHWC memory format, faster convolutions with oneDNN
+- bf16: channels_last and bfloat16 autocast, for CPUs with AVX512-BF16 / AMX
+- int8_dynamic: dynamic INT8 quantization of the Linear layers (for these CNNs, only the classifier)
+- int8_static: post-training static INT8 quantization of the whole graph (FX mode), calibrated on sample images
+Each mode trades accuracy for speed differently per model and CPU, compare them with
+image_models/scripts/benchmark_inference_modes.py before switching a model to a new mode.
+"""
+
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from inference.preprocessing import PreprocessConfig, load_image
+
+
+INFERENCE_MODES = ("fp32", "channels_last", "bf16", "int8_dynamic", "int8_static")
+
+# Quantized kernels only run on the CPU
+QUANTIZED_MODES = ("int8_dynamic", "int8_static")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class ModeWrapper(nn.Module):
+    """Runs a prepared model with the input device, memory format and autocast of its mode."""
+
+    def __init__(
+        self,
+        model: nn.Module,
+        mode: str,
+        device: torch.device,
+        memory_format: Optional[torch.memory_format] = None,
+        autocast_dtype: Optional[torch.dtype] = None
+    ) -> None:
+        super().__init__()
+        self.model = model
+        self.mode = mode
+        self.device = device
+        self.memory_format = memory_format
+        self.autocast_dtype = autocast_dtype
+
+    @property
+    def resident_bytes(self) -> int:
+        """Size of the weights, including packed quantized weights that are not parameters."""
+        def size(value) -> int:
+            if isinstance(value, torch.Tensor):
+                return value.numel() * value.element_size()
+            if isinstance(value, (tuple, list)):
+                return sum(size(item) for item in value)
+            return 0
+        return sum(size(value) for value in self.model.state_dict().values())
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.to(self.device)
+        if self.memory_format is not None:
+            x = x.contiguous(memory_format=self.memory_format)
+        if self.autocast_dtype is not None:
+            with torch.autocast(device_type=self.device.type, dtype=self.autocast_dtype):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def apply_mode(
+    model: nn.Module,
+    mode: str,
+    device: torch.device,
+    calibration: Optional[Iterable[torch.Tensor]] = None
+) -> ModeWrapper:
+    """
+    Prepares a model for an inference mode.
+
+    Args:
+        model (nn.Module): The fp32 model in evaluation mode, on `device`
+        mode (str): One of INFERENCE_MODES
+        device (torch.device): Device of the model, must be the CPU for the INT8 modes
+        calibration (Iterable[torch.Tensor]): Batches of preprocessed images, required by int8_static
+
+    Returns:
+        ModeWrapper: The prepared model, takes the same input batches as the fp32 model
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode {mode}, expected one of {', '.join(INFERENCE_MODES)}")
+    if mode in QUANTIZED_MODES and device.type != "cpu":
+        raise ValueError(f"Inference mode {mode} only runs on the CPU, not on {device.type}")
+
+    if mode == "fp32":
+        return ModeWrapper(model, mode, device).eval()
+
+    if mode in ("channels_last", "bf16"):
+        model = model.to(memory_format=torch.channels_last)
+        autocast_dtype = torch.bfloat16 if mode == "bf16" else None
+        return ModeWrapper(model, mode, device, memory_format=torch.channels_last, autocast_dtype=autocast_dtype).eval()
+
+    if mode == "int8_dynamic":
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return ModeWrapper(model, mode, device).eval()
+
+    # int8_static
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    batches = list(calibration or [])
+    if not batches:
+        raise ValueError("Inference mode int8_static needs calibration images")
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(model, qconfig_mapping, (batches[0],))
+    with torch.no_grad():
+        for batch in batches:
+            prepared(batch)
+    return ModeWrapper(convert_fx(prepared), mode, device).eval()
+
+
+def list_images(folder: str) -> List[str]:
+    """
+    Image files of a folder, in sorted order.
+
+    Args:
+        folder (str): The folder
+
+    Returns:
+        List[str]: The image paths
+    """
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def calibration_batches(folder: str, config: PreprocessConfig, limit: int = 64, batch_size: int = 16) -> List[torch.Tensor]:
+    """
+    Loads calibration batches for int8_static from a folder of representative images.
+
+    Args:
+        folder (str): Folder of images of the model's modality
+        config (PreprocessConfig): The input format of the model
+        limit (int): Maximum number of images
+        batch_size (int): Number of images per batch
+
+    Returns:
+        List[torch.Tensor]: Batches of preprocessed images
+    """
+    paths = list_images(folder)[:limit]
+    images = np.stack([load_image(path, config) for path in paths]) if paths else np.empty((0,))
+    return [torch.from_numpy(images[start:start + batch_size]) for start in range(0, len(paths), batch_size)]
@@ -0,0 +1,79 @@
+"""
+ONNX Runtime execution backend of the image models.
+Runs a graph exported by image_models/scripts/export_onnx.py on the onnxruntime CPU provider,
+with the thread settings of the ONNX_* environment variables. An OnnxModel is called like the torch
+model it replaces (a batch tensor in, a logits tensor out), so the agents and the host do not change.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+
+
+class OnnxModel:
+    """An exported image model running on onnxruntime."""
+
+    def __init__(
+        self,
+        path: str,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: int = 1,
+        allow_spinning: bool = True
+    ) -> None:
+        """
+        Create the inference session.
+
+        Args:
+            path (str): Path to the .onnx graph
+            intra_op_threads (int): Threads used inside an operator, None for one per physical core
+            inter_op_threads (int): Threads running independent operators in parallel,
+                1 since the CNN graphs are sequential
+            allow_spinning (bool): Let idle threads busy-wait for the next operator, lower latency
+                but uses CPU between requests (disable when other models share the cores)
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend needs onnxruntime, install it with `pip install onnxruntime`") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = inter_op_threads
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        options.add_session_config_entry("session.intra_op.allow_spinning", "1" if allow_spinning else "0")
+
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.resident_bytes = os.path.getsize(path)
+
+    @classmethod
+    def from_env(cls, path: str) -> "OnnxModel":
+        """
+        Create a session with the ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+        and ONNX_ALLOW_SPINNING environment variables.
+        """
+        return cls(
+            path,
+            intra_op_threads=int(os.getenv("ONNX_INTRA_OP_THREADS", "0")) or None,
+            inter_op_threads=int(os.getenv("ONNX_INTER_OP_THREADS", "1")),
+            allow_spinning=os.getenv("ONNX_ALLOW_SPINNING", "1").lower() in ("1", "true", "yes")
+        )
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        """
+        Run a batch of preprocessed images.
+
+        Args:
+            batch (torch.Tensor): Images of shape (batch, 3, height, width)
+
+        Returns:
+            torch.Tensor: The logits, on the CPU
+        """
+        inputs = np.ascontiguousarray(batch.detach().cpu().numpy(), dtype=np.float32)
+        (logits,) = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(logits)
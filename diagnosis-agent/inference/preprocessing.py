@@ -0,0 +1,104 @@
+"""
+Image decoding and preprocessing of the image agents, without torch.
+Produces the same arrays as the torchvision pipelines of the agents (PIL bilinear Resize, ToTensor,
+Normalize) using only PIL and numpy, so that it can run in decode worker processes that do not import
+torch or load a model. The agents turn the arrays into tensors with `torch.from_numpy`.
+"""
+
+import hashlib
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+# Bump when the preprocessing output changes, e.g. to invalidate cached results
+PREPROCESSING_VERSION = 1
+
+
+class PreprocessConfig(NamedTuple):
+    """Input format of a model."""
+    size: Tuple[int, int]  # (height, width)
+    mean: Tuple[float, float, float]
+    std: Tuple[float, float, float]
+    grayscale: bool = False  # Decode as grayscale, replicated to 3 channels
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Preprocessing of each agent's model
+XRAY_PREPROCESS = PreprocessConfig(size=(224, 224), mean=IMAGENET_MEAN, std=IMAGENET_STD)
+MRI_PREPROCESS = PreprocessConfig(size=(300, 300), mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5), grayscale=True)
+LUNG_PREPROCESS = PreprocessConfig(size=(224, 224), mean=IMAGENET_MEAN, std=IMAGENET_STD)
+
+
+def preprocess_image(image: Image.Image, config: PreprocessConfig) -> np.ndarray:
+    """
+    Resizes and normalizes a decoded image.
+
+    Args:
+        image (Image.Image): The decoded image
+        config (PreprocessConfig): The input format of the model
+
+    Returns:
+        np.ndarray: float32 array of shape (3, height, width)
+    """
+    image = image.convert("L" if config.grayscale else "RGB")
+    height, width = config.size
+    image = image.resize((width, height), Image.BILINEAR)
+
+    array = np.asarray(image, dtype=np.float32) / 255.0
+    if config.grayscale:
+        array = np.repeat(array[:, :, None], 3, axis=2)
+
+    mean = np.asarray(config.mean, dtype=np.float32)
+    std = np.asarray(config.std, dtype=np.float32)
+    array = (array - mean) / std
+    return np.ascontiguousarray(array.transpose(2, 0, 1))
+
+
+def load_image(file_path: str, config: PreprocessConfig) -> np.ndarray:
+    """
+    Decodes and preprocesses an image file.
+
+    Args:
+        file_path (str): Path to the image
+        config (PreprocessConfig): The input format of the model
+
+    Returns:
+        np.ndarray: float32 array of shape (3, height, width)
+    """
+    with Image.open(file_path) as image:
+        return preprocess_image(image, config)
+
+
+def image_digest(image: Image.Image) -> str:
+    """
+    Hash of the decoded pixels of an image, the same for any file encoding the same pixels.
+
+    Args:
+        image (Image.Image): The decoded image
+
+    Returns:
+        str: Hex SHA-256 digest of the pixel mode, size and bytes
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def load_image_with_digest(file_path: str, config: PreprocessConfig) -> Tuple[str, np.ndarray]:
+    """
+    Decodes an image file once for both its cache key and its model input.
+
+    Args:
+        file_path (str): Path to the image
+        config (PreprocessConfig): The input format of the model
+
+    Returns:
+        Tuple[str, np.ndarray]: The digest of the decoded pixels and the preprocessed float32 array
+    """
+    with Image.open(file_path) as image:
+        image.load()
+        return image_digest(image), preprocess_image(image, config)
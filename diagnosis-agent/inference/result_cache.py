@@ -0,0 +1,216 @@
+"""
+Persistent cache of model results, keyed by image content.
+The same scan is often submitted again (re-uploads, re-triggered analyses, reruns of ReportHandlerAgent).
+A result is stored under the hash of the decoded image pixels and the fingerprint of the model that computed it
+(weights file hash, inference mode, backend and preprocessing version, see model_registry.model_fingerprint),
+so a new file with the same pixels hits the cache, and changed weights or preprocessing never do.
+Entries live in an SQLite file shared by the agents, bounded in size with least-recently-used eviction,
+which also removes the results of old weights over time (agents sharing the file may still serve other
+weights, modes or backends, so they are not deleted eagerly). An in-process memo of (path, mtime, size) ->
+pixel hash lets repeated submissions of the same file skip the decoding, so their hits take well under a millisecond.
+"""
+
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, ContextManager, Optional, Tuple
+
+import numpy as np
+
+
+class ResultCache:
+    """SQLite store of model results with an in-memory file memo."""
+
+    def __init__(self, path: str = "inference_cache.sqlite", max_entries: int = 100000, memo_size: int = 10000) -> None:
+        """
+        Open (or create) the cache.
+
+        Args:
+            path (str): Path of the SQLite file, can be shared by several agents
+            max_entries (int): Maximum number of results, the least recently used ones are evicted
+            memo_size (int): Maximum number of (path, mtime, size) -> pixel hash entries kept in memory
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.memo_size = memo_size
+        self.memo: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.puts = 0
+        # Counting is a table scan, the bound is checked every few writes only
+        self.check_every = max(1, min(100, max_entries // 10))
+        self.stats = {"hits": 0, "misses": 0, "decodes_skipped": 0, "evicted": 0}
+
+        self.db = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "result TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Open the cache of the INFERENCE_CACHE_PATH and INFERENCE_CACHE_MAX_ENTRIES environment variables.
+        """
+        return cls(
+            path=os.getenv("INFERENCE_CACHE_PATH", "inference_cache.sqlite"),
+            max_entries=int(os.getenv("INFERENCE_CACHE_MAX_ENTRIES", "100000"))
+        )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @staticmethod
+    def key(fingerprint: str, digest: str) -> str:
+        return hashlib.sha256(f"{fingerprint}:{digest}".encode("utf-8")).hexdigest()
+
+    def file_digest(self, file_path: str) -> Optional[str]:
+        """
+        Pixel hash of a file seen before, if it has not changed since (same mtime and size).
+
+        Args:
+            file_path (str): Path to the image
+
+        Returns:
+            Optional[str]: The pixel hash, None if unknown
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        entry = self.memo.get(os.path.abspath(file_path))
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return entry[2]
+
+    def remember(self, file_path: str, digest: str) -> None:
+        """
+        Memoize the pixel hash of a file.
+
+        Args:
+            file_path (str): Path to the image
+            digest (str): Hash of its decoded pixels
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        path = os.path.abspath(file_path)
+        self.memo[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        self.memo.move_to_end(path)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def get(self, fingerprint: str, digest: str) -> Optional[Any]:
+        """
+        Cached result of a model on an image.
+
+        Args:
+            fingerprint (str): The model fingerprint, see model_registry.model_fingerprint
+            digest (str): Hash of the decoded image pixels
+
+        Returns:
+            Optional[Any]: The result, None on a miss
+        """
+        key = self.key(fingerprint, digest)
+        with self.lock:
+            row = self.db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, model: str, fingerprint: str, digest: str, result: Any) -> None:
+        """
+        Store a result, evicting the least recently used ones past `max_entries`.
+
+        Args:
+            model (str): The model name
+            fingerprint (str): The model fingerprint
+            digest (str): Hash of the decoded image pixels
+            result (Any): The JSON-serializable result
+        """
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, model, fingerprint, result, last_used) VALUES (?, ?, ?, ?, ?)",
+                (self.key(fingerprint, digest), model, fingerprint, json.dumps(result), time.time())
+            )
+            self.puts += 1
+            # Evict down to 90% so that the next writes do not evict again
+            if self.puts % self.check_every == 0:
+                count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.max_entries:
+                    excess = count - int(self.max_entries * 0.9)
+                    self.db.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                        (excess,)
+                    )
+                    self.stats["evicted"] += excess
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    async def run(
+        self,
+        model: str,
+        fingerprint: Optional[str],
+        file_path: str,
+        decode: Callable[[str], Awaitable[Tuple[str, np.ndarray]]],
+        infer: Callable[[np.ndarray], Awaitable[Tuple[Any, Optional[str]]]],
+        admit: Callable[[], ContextManager] = nullcontext
+    ) -> Any:
+        """
+        Result of a model on an image file, from the cache when possible.
+        A file seen before is looked up without being decoded; otherwise it is decoded once,
+        looked up by its pixel hash, and only run through the model on a miss.
+
+        Args:
+            model (str): The model name
+            fingerprint (str): Fingerprint of the model that would serve the image (see ModelRegistry.fingerprint),
+                looked up in the cache, None to bypass the cache
+            file_path (str): Path to the image
+            decode (Callable): Async, file path -> (pixel hash, preprocessed array), e.g. load_image_with_digest
+            infer (Callable): Async, preprocessed array -> (JSON-serializable result, fingerprint of the model
+                that computed it), the result is stored under that fingerprint
+            admit (Callable): Context manager around the decoding and inference, e.g. InferenceExecutor.admit.
+                Hits of known files do not enter it.
+
+        Returns:
+            Any: The result
+        """
+        if fingerprint is not None:
+            digest = self.file_digest(file_path)
+            if digest is not None:
+                result = self.get(fingerprint, digest)
+                if result is not None:
+                    self.stats["hits"] += 1
+                    self.stats["decodes_skipped"] += 1
+                    return result
+
+        with admit():
+            digest, image = await decode(file_path)
+            if fingerprint is None:
+                return (await infer(image))[0]
+
+            self.remember(file_path, digest)
+            result = self.get(fingerprint, digest)
+            if result is not None:
+                self.stats["hits"] += 1
+                return result
+
+            self.stats["misses"] += 1
+            result, served_fingerprint = await infer(image)
+            if served_fingerprint is not None:
+                self.put(model, served_fingerprint, digest, result)
+            return result
+
+    def report(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"Result cache: {self.stats['hits']} hits / {lookups} lookups ({hit_rate:.0%}), "
+                f"{self.stats['decodes_skipped']} decodes skipped, {self.stats['evicted']} evicted")
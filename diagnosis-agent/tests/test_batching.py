@@ -0,0 +1,71 @@
+import os, sys
+import asyncio, threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from inference.batching import MicroBatcher
+
+
+def test_items_are_batched_and_fanned_back():
+    batches = []
+
+    def predict_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8, 10]
+    assert [len(batch) for batch in batches] == [4, 2]
+
+
+def test_errors_of_a_batch_are_raised_to_every_caller():
+    def predict_batch(items):
+        raise ValueError("bad batch")
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=2, max_wait=0.05)
+        results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        await batcher.stop()
+        return results, batcher.stats
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert stats["errors"] == 1
+
+
+def test_stop_cancels_items_in_flight_and_queued():
+    started, release = threading.Event(), threading.Event()
+
+    def predict_batch(items):
+        started.set()
+        release.wait(5)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=2, max_wait=0.01)
+        submits = [asyncio.ensure_future(batcher.submit(i)) for i in range(3)]
+        # The first two items are in the forward pass, the third one is queued
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        assert len(batcher.in_flight) == 2 and batcher.queue.qsize() == 1
+        await batcher.stop()
+        release.set()
+        return await asyncio.gather(*submits, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+
+def test_batcher_restarts_after_stop():
+    async def main():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=2, max_wait=0.01)
+        assert await batcher.submit(1) == 1
+        await batcher.stop()
+        assert await batcher.submit(2) == 2
+        await batcher.stop()
+
+    asyncio.run(main())
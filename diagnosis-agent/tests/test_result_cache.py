@@ -0,0 +1,97 @@
+import os, sys
+import asyncio
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from inference.model_registry import ModelRegistry, ModelSpec
+from inference.preprocessing import XRAY_PREPROCESS
+from inference.result_cache import ResultCache
+
+
+class FakeModel:
+    resident_bytes = 1024
+
+    def __init__(self, weights_path):
+        with open(weights_path, "rb") as f:
+            self.weights = f.read().decode("utf-8")
+
+
+def make_registry(weights_path):
+    spec = ModelSpec(
+        name="xray",
+        load=lambda: FakeModel(weights_path),
+        preprocess=XRAY_PREPROCESS,
+        postprocess=list,
+        weights_path=weights_path
+    )
+    return ModelRegistry([spec])
+
+
+def classify(cache, registry, image_path, calls):
+    async def decode(file_path):
+        calls["decode"] += 1
+        return "pixels-of-" + os.path.basename(file_path), np.zeros((1, 3, 2, 2), dtype=np.float32)
+
+    async def infer(image):
+        calls["infer"] += 1
+        model, fingerprint = registry.loaded("xray")
+        return {"weights": model.weights}, fingerprint
+
+    return asyncio.run(cache.run("xray", registry.fingerprint("xray"), image_path, decode, infer))
+
+
+def test_results_are_reused_until_the_weights_change(tmp_path):
+    weights_path = str(tmp_path / "weights.pth")
+    image_path = str(tmp_path / "scan.png")
+    with open(weights_path, "w") as f:
+        f.write("v1")
+    with open(image_path, "w") as f:
+        f.write("scan")
+
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    registry = make_registry(weights_path)
+    calls = {"decode": 0, "infer": 0}
+    assert classify(cache, registry, image_path, calls) == {"weights": "v1"}
+    assert classify(cache, registry, image_path, calls) == {"weights": "v1"}
+    assert calls == {"decode": 1, "infer": 1}
+
+    # New weights on disk: the resident model keeps serving (and hitting) until it is reloaded
+    with open(weights_path, "w") as f:
+        f.write("v2-retrained")
+    assert classify(cache, registry, image_path, calls) == {"weights": "v1"}
+    registry.unload("xray")
+    assert classify(cache, registry, image_path, calls) == {"weights": "v2-retrained"}
+    assert calls == {"decode": 2, "infer": 2}
+
+    # A restarted agent sharing the cache file hits the result of the new weights
+    restarted = ResultCache(cache.path)
+    calls = {"decode": 0, "infer": 0}
+    assert classify(restarted, make_registry(weights_path), image_path, calls) == {"weights": "v2-retrained"}
+    assert calls == {"decode": 1, "infer": 0}
+
+
+def test_results_are_not_cached_without_a_fingerprint(tmp_path):
+    image_path = str(tmp_path / "scan.png")
+    with open(image_path, "w") as f:
+        f.write("scan")
+
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    registry = make_registry(str(tmp_path / "missing.pth"))
+    registry.specs["xray"].load = lambda: FakeModel(image_path)
+    calls = {"decode": 0, "infer": 0}
+    classify(cache, registry, image_path, calls)
+    classify(cache, registry, image_path, calls)
+    assert calls == {"decode": 2, "infer": 2} and len(cache) == 0
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    for i in range(10):
+        cache.put("xray", "fingerprint", f"digest-{i}", i)
+    assert cache.get("fingerprint", "digest-0") == 0
+    for i in range(10, 20):
+        cache.put("xray", "fingerprint", f"digest-{i}", i)
+    assert len(cache) <= 10
+    assert cache.get("fingerprint", "digest-1") is None